@@ -1,14 +1,13 @@
 #!/home/dusts/.miniconda3/bin/python3
 import sys
 import os
-import time
 import re
-import requests
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 from lxml import html
 from markdownify import markdownify as md
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+
+from image_store import localize_images
+from page_extract import fetch_page, get_main_content, strip_boilerplate
 
 # --- Scraping Functions ---
 
@@ -26,143 +25,22 @@ def generate_filename(url):
     return filename
 
 
-def get_main_content(tree, url):
-    """
-    Attempts to find the main content element using a broad dynamic XPath.
-    If the found element seems too sparse, it falls back to domain‐specific selectors.
-    """
-    # Prioritize article elements first
-    article_xpath = "//article"
-    article_matches = tree.xpath(article_xpath)
-    if article_matches:
-        best_article = max(
-            article_matches, key=lambda el: len(el.text_content().strip())
-        )
-        if len(best_article.text_content().strip()) > 100:
-            print("Main content found using article element.")
-            return best_article, article_xpath
-
-    # Then try the specific CSS path structure
-    gatsby_xpath = "//div[@id='___gatsby']//article//div[contains(@class, 'Grid')]//div[contains(@class, 'Cell')]"
-    gatsby_matches = tree.xpath(gatsby_xpath)
-    if gatsby_matches:
-        best_gatsby = max(gatsby_matches, key=lambda el: len(el.text_content().strip()))
-        if len(best_gatsby.text_content().strip()) > 100:
-            print("Main content found using Gatsby structure.")
-            return best_gatsby, gatsby_xpath
-
-    # Continue with your existing dynamic approach
-    keywords = [
-        "article",  # Moved to top for priority
-        "main",
-        "body",
-        "content",
-        "maincontent",
-        "question",
-        "answer",
-        "forum",
-    ]
-    # Rest of your function remains the same...
-    conditions = []
-    for kw in keywords:
-        conditions.append(
-            f"contains(translate(@id, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-        )
-        conditions.append(
-            f"contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-        )
-    xpath_expr = "//*[" + " or ".join(conditions) + "]"
-    print(f"Dynamic XPath expression: {xpath_expr}")
-    matches = tree.xpath(xpath_expr)
-
-    if matches:
-        best_element = max(matches, key=lambda el: len(el.text_content().strip()))
-        # Heuristic: require at least 100 characters of text
-        if len(best_element.text_content().strip()) > 100:
-            print("Main content found using dynamic XPath.")
-            return best_element, xpath_expr
-        else:
-            print("Dynamic XPath found elements, but none have enough content.")
-    else:
-        print("No elements found using dynamic XPath.")
-
-    # Domain-specific fallback (example: repost.aws)
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc.lower()
-    if "repost.aws" in domain:
-        print("Applying site-specific logic for repost.aws")
-        question_xpath = "//div[contains(@class, 'QuestionDetail_banner')]"
-        question_matches = tree.xpath(question_xpath)
-        if question_matches:
-            best_question = max(
-                question_matches, key=lambda el: len(el.text_content().strip())
-            )
-            print("Main question found using site-specific selector.")
-            return best_question, question_xpath
-        answer_xpath = "//div[contains(@class, 'ResponseDetail_container')]"
-        answer_matches = tree.xpath(answer_xpath)
-        if answer_matches:
-            best_answer = max(
-                answer_matches, key=lambda el: len(el.text_content().strip())
-            )
-            print("Main answer found using site-specific selector.")
-            return best_answer, answer_xpath
-
-    # Fallback: use entire <body>
-    print("Falling back to the <body> element.")
-    body = tree.xpath("//body")
-    if body:
-        return body[0], "//body"
-    else:
-        print("Error: <body> element not found.")
-        sys.exit(1)
-
-
 def scrape_markdown(url):
-    # Set up Selenium with headless Chrome.
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(url)
-    time.sleep(3)  # Wait for full page load
-    html_content = driver.page_source
-    driver.quit()
+    # Plain HTTP when the page is server-rendered, a warm headless browser if not.
+    html_content = fetch_page(url)
 
     tree = html.fromstring(html_content)
     main_element, used_selector = get_main_content(tree, url)
     print(f"Using selector: {used_selector}")
+    strip_boilerplate(main_element, url)
 
     # Convert element to HTML then to Markdown.
     element_html = html.tostring(main_element, encoding="unicode")
     markdown_text = md(element_html)
 
-    # Process images: download and update src attributes.
-    images_dir = "images"
-    if not os.path.exists(images_dir):
-        os.makedirs(images_dir)
-    for img in main_element.xpath(".//img"):
-        src = img.get("src")
-        if not src:
-            continue
-        img_url = urljoin(url, src)
-        filename = os.path.basename(urlparse(img_url).path)
-        local_path = os.path.join(images_dir, filename)
-        if not os.path.exists(local_path):
-            try:
-                img_response = requests.get(img_url)
-                if img_response.status_code == 200:
-                    with open(local_path, "wb") as f:
-                        f.write(img_response.content)
-                    print(f"Downloaded image: {filename}")
-                else:
-                    print(
-                        f"Failed to download image {img_url} (status {img_response.status_code})"
-                    )
-            except Exception as e:
-                print(f"Error downloading image {img_url}: {e}")
-        img.set("src", f"./images/{filename}")
+    # Download images concurrently, once per URL, named by content hash,
+    # and point their src attributes at the local copies.
+    localize_images(main_element, url)
 
     # Reconvert the updated element to Markdown.
     element_html = html.tostring(main_element, encoding="unicode")
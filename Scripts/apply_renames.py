@@ -1,45 +1,409 @@
 #!/usr/bin/env python3
+"""
+Apply rename_map.csv.
+
+The plan is grouped by directory and each directory is solved as a graph:
+a row whose target is another row's source waits for that source to move
+(chains A->B, B->C run C first) and cycles (swaps, rotations) are broken by
+parking one file under a temporary name. A target that exists and is not
+itself being renamed away is a conflict, and so is every row that depends
+on it. Each directory is listed with one scandir (no per-file stat) and
+directories are processed in parallel threads.
+
+Every completed step is appended to a journal (rename_map.csv.journal) as
+"R|T<TAB>row<TAB>old<TAB>new" (T = moved to a temporary name). A T line is
+written before its rename, so no parked file goes unrecorded; an R line
+after, so no row is marked done that wasn't. Rerunning after a crash or
+Ctrl-C skips journaled rows and picks parked files up from their temporary
+names (or the original name, if the crash came before the park); the
+journal also serves as an undo log.
+
+    ./apply_renames.py             # apply / resume
+    ./apply_renames.py --restart   # ignore the journal and start over
+    ./apply_renames.py --bench 100000
+"""
+import os
 import csv
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 
 CSV_FILE = "rename_map.csv"
+JOURNAL_FILE = CSV_FILE + ".journal"
 DRY_RUN = False  # set False to actually rename
+RENAME_WORKERS = 8  # directories renamed concurrently
+TMP_PREFIX = ".renametmp-"
 
+# (rowno, old_name, new_name) within one directory
+Row = Tuple[int, str, str]
+# (rowno, src_name, dst_name, final) - final=False parks src under a temp name
+Step = Tuple[int, str, str, bool]
+# (reason, name) for a row plan_steps leaves out
+Skip = Tuple[str, str]
 
-def main():
-    p = Path(CSV_FILE)
-    if not p.exists():
-        print(f"{CSV_FILE} not found.")
-        return
+NOT_A_FILE = "not a file"
+DUPLICATE_SOURCE = "duplicate source"
+DUPLICATE_TARGET = "duplicate target"
+TARGET_EXISTS = "target exists"
+CONFLICTS = {DUPLICATE_TARGET, TARGET_EXISTS}  # counted as conflicts
 
-    total = 0
-    conflicts = 0
-    renamed = 0
 
+def plan_id(p: Path) -> str:
+    st = p.stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def load_plan(p: Path) -> Tuple[Dict[str, List[Row]], List[str]]:
+    """CSV -> {directory: [(rowno, old_name, new_name), ...]} plus bad rows."""
+    by_dir: Dict[str, List[Row]] = defaultdict(list)
+    bad = []
     with p.open("r", encoding="utf-8", newline="") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            old_path = Path(row["old_path"])
-            new_base = row["new_basename"]
-            if not old_path.is_file():
-                print(f"Skip (not a file): {old_path}")
+        for rowno, row in enumerate(csv.DictReader(f), 1):
+            old_dir, old_name = os.path.split(row["old_path"])
+            new_name = row["new_basename"]
+            if not old_name or not new_name or os.sep in new_name:
+                bad.append(f"Skip (bad row {rowno}): {row}")
                 continue
+            by_dir[old_dir or "."].append((rowno, old_name, new_name))
+    return by_dir, bad
+
+
+class Journal:
+    def __init__(self, path: Path, plan: str, resume: bool):
+        self.lock = threading.Lock()
+        if resume:
+            self.f = path.open("a", encoding="utf-8")
+            self.f.write("\n")  # terminate a line cut short by a crash
+        else:
+            self.f = path.open("w", encoding="utf-8")
+            self.f.write(f"# plan {plan}\n")
+        self.f.flush()
+
+    def write(self, final: bool, rowno: int, src: str, dst: str):
+        # Flushed per line: a crash loses at most the OS buffer.
+        with self.lock:
+            self.f.write(f"{'R' if final else 'T'}\t{rowno}\t{src}\t{dst}\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def read_journal(path: Path, plan: str) -> Tuple[Set[int], Dict[int, str]]:
+    """Rows already renamed, and {row: temp name} for rows left parked."""
+    done: Set[int] = set()
+    parked: Dict[int, str] = {}
+    if not path.exists():
+        return done, parked
+    with path.open("r", encoding="utf-8") as f:
+        if f.readline().rstrip("\n") != f"# plan {plan}":
+            return done, parked
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4 or not parts[1].isdigit():
+                continue
+            kind, rowno = parts[0], int(parts[1])
+            if kind == "T":
+                parked[rowno] = os.path.basename(parts[3])
+            elif kind == "R":
+                done.add(rowno)
+                parked.pop(rowno, None)
+    return done, parked
+
+
+def dir_index(d: str) -> Set[str]:
+    """Names present in d, from a single scandir."""
+    with os.scandir(d) as it:
+        return {entry.name for entry in it}
+
+
+def plan_steps(
+    rows: List[Row], present: Set[str], parked: Dict[int, str]
+) -> Tuple[List[Step], List[Skip]]:
+    """
+    Order one directory's renames so no step overwrites a file that has not
+    moved yet. Returns (steps, skipped rows as (reason, name)).
+    """
+    skips: List[Skip] = []
+    moves: Dict[str, Tuple[int, str]] = {}  # current name -> (rowno, target)
+    targets: Set[str] = set()
+    for rowno, src, dst in rows:
+        cur = parked.get(rowno)
+        if cur not in present:  # not parked, or the crash came before the park
+            cur = src
+        if cur not in present:
+            skips.append((NOT_A_FILE, src))
+        elif cur == dst:
+            continue
+        elif cur in moves:
+            skips.append((DUPLICATE_SOURCE, src))
+        elif dst in targets:
+            skips.append((DUPLICATE_TARGET, dst))
+        else:
+            moves[cur] = (rowno, dst)
+            targets.add(dst)
+
+    # A target that exists and stays put blocks its row, which in turn keeps
+    # that row's source in place and blocks whoever targets it.
+    pred = {dst: cur for cur, (_, dst) in moves.items()}
+    stack = [cur for cur, (_, dst) in moves.items() if dst in present and dst not in moves]
+    while stack:
+        cur = stack.pop()
+        if cur not in moves:
+            continue
+        _, dst = moves.pop(cur)
+        skips.append((TARGET_EXISTS, dst))
+        p = pred.get(cur)
+        if p in moves:
+            stack.append(p)
+    pred = {dst: cur for cur, (_, dst) in moves.items()}
+
+    steps: List[Step] = []
+    seen: Set[str] = set()
+
+    def walk_back(node: Optional[str], stop: Optional[str] = None):
+        while node is not None and node != stop and node not in seen:
+            seen.add(node)
+            rowno, dst = moves[node]
+            steps.append((rowno, node, dst, True))
+            node = pred.get(node)
+
+    # Chains: start at the end whose target is free, then walk back.
+    for cur, (_, dst) in moves.items():
+        if dst not in moves:
+            walk_back(cur)
+    # What is left are cycles: park one member, rotate the rest, unpark.
+    for cur, (rowno, dst) in moves.items():
+        if cur in seen:
+            continue
+        seen.add(cur)
+        tmp = f"{TMP_PREFIX}{rowno}-{cur}"
+        while tmp in present:
+            tmp = "_" + tmp
+        steps.append((rowno, cur, tmp, False))
+        walk_back(pred[cur], stop=cur)
+        steps.append((rowno, tmp, dst, True))
+    return steps, skips
+
+
+def apply_dir(
+    d: str,
+    rows: List[Row],
+    done: Set[int],
+    parked: Dict[int, str],
+    journal: Optional[Journal],
+    verbose: bool = True,
+) -> Dict[str, int]:
+    counts = {"entries": 0, "conflicts": 0, "renamed": 0, "resumed": 0, "errors": 0}
+    todo = [r for r in rows if r[0] not in done]
+    counts["resumed"] = len(rows) - len(todo)
+    try:
+        present = dir_index(d)
+    except OSError as e:
+        print(f"Skip (cannot list {d}): {e}")
+        counts["errors"] += len(todo)
+        return counts
+    steps, skips = plan_steps(todo, present, parked)
+    for reason, name in skips:
+        if verbose:
+            print(f"Skip ({reason}): {name}")
+        if reason in CONFLICTS:
+            counts["conflicts"] += 1
+    counts["entries"] = sum(1 for s in steps if s[3]) + counts["conflicts"]
 
-            target = old_path.with_name(new_base)
-            total += 1
+    # A failed step leaves its source occupied; anything targeting it stops.
+    blocked: Set[str] = set()
+    for rowno, src, dst, final in steps:
+        old, new = os.path.join(d, src), os.path.join(d, dst)
+        if dst in blocked:
+            print(f"Skip (blocked by failed rename): {old} -> {new}")
+            blocked.add(src)
+            counts["errors"] += 1
+            continue
+        if verbose and final:
+            print(f"{'DRY-RUN ' if DRY_RUN else ''}Rename: {old} -> {new}")
+        if DRY_RUN:
+            continue
+        if journal is not None and not final:
+            # Before the rename: a crash in between must not strand the file
+            # under a temporary name nothing knows about.
+            journal.write(final, rowno, old, new)
+        try:
+            os.rename(old, new)
+        except OSError as e:
+            print(f"Error: {old} -> {new}: {e}")
+            blocked.add(src)
+            counts["errors"] += 1
+            continue
+        if journal is not None and final:
+            journal.write(final, rowno, old, new)
+        if final:
+            counts["renamed"] += 1
+    return counts
 
+
+def apply_plan(
+    by_dir: Dict[str, List[Row]],
+    done: Set[int],
+    parked: Dict[int, str],
+    journal: Optional[Journal],
+    workers: int = RENAME_WORKERS,
+    verbose: bool = True,
+) -> Dict[str, int]:
+    totals: Dict[str, int] = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(apply_dir, d, rows, done, parked, journal, verbose)
+            for d, rows in by_dir.items()
+        ]
+        for fut in futures:
+            for k, v in fut.result().items():
+                totals[k] += v
+    return totals
+
+
+# Benchmark
+
+
+def serial_apply(p: Path):
+    """The previous implementation (row order, skip existing targets)."""
+    with p.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            old_path = Path(row["old_path"])
+            if not old_path.is_file():
+                continue
+            target = old_path.with_name(row["new_basename"])
             if target.exists():
-                print(f"Skip (target exists): {target}")
-                conflicts += 1
                 continue
+            old_path.rename(target)
+
+
+def make_bench_tree(root: Path, n: int, per_dir: int = 1000) -> Dict[str, int]:
+    """
+    n files in n/per_dir directories plus a plan: mostly plain renames, some
+    3-long chains, swaps and 3-cycles. Returns {new_path: inode expected}.
+    """
+    expected = {}
+    with (root / CSV_FILE).open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, quoting=csv.QUOTE_ALL)
+        w.writerow(["old_path", "new_basename"])
+        for start in range(0, n, per_dir):
+            d = root / f"d{start // per_dir:04d}"
+            d.mkdir()
+            names = [f"f{i:07d}.mkv" for i in range(start, min(n, start + per_dir))]
+            for name in names:
+                (d / name).touch()
+            ino = {name: (d / name).stat().st_ino for name in names}
+            i = 0
+            while i < len(names):
+                kind = i % 20
+                if kind < 14 or i + 3 > len(names):  # plain
+                    pairs = [(names[i], "new-" + names[i])]
+                    i += 1
+                elif kind < 17:  # chain a->b->c->new
+                    a, b, c = names[i : i + 3]
+                    pairs = [(a, b), (b, c), (c, "new-" + c)]
+                    i += 3
+                elif kind < 19:  # swap
+                    a, b = names[i : i + 2]
+                    pairs = [(a, b), (b, a)]
+                    i += 2
+                else:  # rotation
+                    a, b, c = names[i : i + 3]
+                    pairs = [(a, b), (b, c), (c, a)]
+                    i += 3
+                for src, dst in pairs:
+                    w.writerow([str(d / src), dst])
+                    expected[str(d / dst)] = ino[src]
+    return expected
+
+
+def check_tree(expected: Dict[str, int]) -> int:
+    ok = 0
+    for path, ino in expected.items():
+        try:
+            ok += os.stat(path).st_ino == ino
+        except OSError:
+            pass
+    return ok
+
+
+def run_benchmark(n: int, workers: int):
+    for label in ("serial (old)", "graph executor"):
+        root = Path(tempfile.mkdtemp(prefix="apply_renames_bench_"))
+        try:
+            expected = make_bench_tree(root, n)
+            plan = root / CSV_FILE
+            t0 = time.perf_counter()
+            if label.startswith("serial"):
+                serial_apply(plan)
+            else:
+                by_dir, _ = load_plan(plan)
+                apply_plan(by_dir, set(), {}, None, workers, verbose=False)
+            dt = time.perf_counter() - t0
+            ok = check_tree(expected)
+            print(
+                f"  {label:<15} {dt:7.2f}s  {n / dt:8.0f} renames/s  "
+                f"correct {ok}/{len(expected)}"
+            )
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Apply {CSV_FILE}.")
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore the journal and start over."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=RENAME_WORKERS,
+        help=f"Directories renamed in parallel (default: {RENAME_WORKERS}).",
+    )
+    parser.add_argument("-q", "--quiet", action="store_true", help="No per-file lines.")
+    parser.add_argument(
+        "--bench", type=int, metavar="N", help="Benchmark N renames in a temp dir."
+    )
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench, args.workers)
+        return
+
+    p = Path(CSV_FILE)
+    if not p.exists():
+        print(f"{CSV_FILE} not found.")
+        return
+
+    plan = plan_id(p)
+    journal_path = Path(JOURNAL_FILE)
+    done, parked = (set(), {}) if args.restart else read_journal(journal_path, plan)
+    if done or parked:
+        print(
+            f"Resuming: {len(done)} rows done, {len(parked)} parked ({JOURNAL_FILE})."
+        )
 
-            print(f"{'DRY-RUN ' if DRY_RUN else ''}Rename: {old_path} -> {target}")
-            if not DRY_RUN:
-                old_path.rename(target)
-                renamed += 1
+    by_dir, bad = load_plan(p)
+    for msg in bad:
+        print(msg)
+    journal = None if DRY_RUN else Journal(journal_path, plan, bool(done or parked))
+    try:
+        c = apply_plan(by_dir, done, parked, journal, args.workers, not args.quiet)
+    finally:
+        if journal is not None:
+            journal.close()
 
     print(
-        f"Entries: {total}, Conflicts: {conflicts}, {'Would rename' if DRY_RUN else 'Renamed'}: {total - conflicts}"
+        f"Entries: {c['entries']}, Conflicts: {c['conflicts']}, {'Would rename' if DRY_RUN else 'Renamed'}: {c['entries'] - c['conflicts'] if DRY_RUN else c['renamed']}"
+        + (f", Already done: {c['resumed']}" if c["resumed"] else "")
+        + (f", Errors: {c['errors']}" if c["errors"] else "")
     )
 
 
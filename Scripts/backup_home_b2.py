@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import time
 import json
+import uuid
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+from itertools import islice
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -10,6 +20,13 @@ import b2sdk.v2 as b2
 
 from dotenv import load_dotenv
 
+from media_walk import walk_files
+from fs_watch import TreeWatcher
+from chunk_store import ChunkIndex, chunk_digest, chunk_file
+from backup_state import StateStore
+from file_pack import PACK_FILE_MAX, Packer, Segment, decompress
+from backup_metrics import BackupMetrics, serve as serve_metrics
+
 # Configuration: update these as needed.
 DIRECTORIES_TO_BACKUP = [
     str(Path.home() / "Documents"),
@@ -17,37 +34,61 @@ DIRECTORIES_TO_BACKUP = [
     # add more directories as desired
 ]
 BUCKET_NAME = "my-backup-bucket"  # change to your B2 bucket name
-STATE_FILE = Path("backup_state.json")
+STATE_FILE = Path("backup_state.json")  # legacy state, imported into STATE_DB once
+STATE_DB = Path("backup_state.sqlite")
 SCAN_INTERVAL_SECONDS = 600  # check every 10 minutes
+RECONCILE_INTERVAL_SECONDS = 6 * 3600  # --watch: full safety-net scan this often
+DEBOUNCE_SECONDS = 5  # --watch: upload once a file has been quiet this long
+UPLOAD_WORKERS = 4  # concurrent uploads sharing the bucket
+UPLOAD_QUEUE_SIZE = 256  # files queued ahead of the workers before the scan waits
+UPLOAD_BANDWIDTH_LIMIT = 0  # bytes/s per worker, 0 = unlimited
+METRICS_INTERVAL_SECONDS = 10  # progress line while a pipeline is running
+LARGE_FILE_THRESHOLD = 200 * 1000 * 1000  # bytes; bigger files go up in resumable parts
+PART_SIZE = 100 * 1000 * 1000  # B2 accepts 5 MB to 5 GB per part
+PART_WORKERS = 4  # parts of one large file sent concurrently
+READ_BLOCK = 1 << 20
+CHUNK_PREFIX = "chunks/"  # --chunked: content-addressed chunk objects
+MANIFEST_PREFIX = "manifests/"  # --chunked: per-file chunk lists, <path>.json
+PACK_PREFIX = "packs/"  # --pack: <segment>.pack and its <segment>.idx.json
+SKIP_DIRS = ["node_modules", "__pycache__", "@eaDir", ".Trash-*"]  # globs never scanned
+SCAN_BLOCK = 500  # scanned files looked up in the state per query
+METRICS_LOG = Path("backup_metrics.jsonl")  # one JSON line per cycle
+METRICS_PORT = 0  # serve Prometheus metrics on 127.0.0.1:PORT, 0 = off
+
+METRICS = BackupMetrics()
 
 def load_state():
-    if STATE_FILE.exists():
-        try:
-            with open(STATE_FILE, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading state: {e}")
-    return {}  # file path -> { "mtime": <float>, "size": <int> }
+    # file path -> { "mtime": <float>, "size": <int> }, stored in SQLite
+    return StateStore(STATE_DB, import_json=STATE_FILE)
 
 def save_state(state):
+    start = time.monotonic()
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f)
+        state.flush()
     except Exception as e:
         print(f"Error saving state: {e}")
+    METRICS.observe("state_save_seconds", time.monotonic() - start)
 
 def get_all_files(directories):
-    all_files = []
+    """
+    (path, state key, stat) for every file, one stat per file. path is as
+    walked under the configured directory and names the upload; the key is
+    the resolved path, so a file reached two ways is tracked once.
+    """
     for dir_path in directories:
         p = Path(dir_path)
-        if p.exists() and p.is_dir():
-            # recursively list all files
-            for file in p.rglob("*"):
-                if file.is_file():
-                    all_files.append(file)
+        if p.is_dir():
+            # Resolve the root once; entries below it then only differ from
+            # their resolved path by that prefix, except for file symlinks.
+            root, real_root = str(p), str(p.resolve())
+            for entry in walk_files(root, skip_dirs=SKIP_DIRS):
+                try:
+                    key = os.path.realpath(entry.path) if entry.is_symlink() else real_root + entry.path[len(root):]
+                    yield entry.path, key, entry.stat()
+                except OSError as e:
+                    print(f"Could not stat {entry.path}: {e}")
         else:
             print(f"Warning: {dir_path} is not a valid directory.")
-    return all_files
 
 def initialize_b2():
     load_dotenv()  # load from .env file if present
@@ -61,16 +102,237 @@ def initialize_b2():
     bucket = b2_api.get_bucket_by_name(BUCKET_NAME)
     return bucket
 
-def file_has_changed(file_path: Path, state_entry: dict) -> bool:
+def file_has_changed(stat: os.stat_result, state_entry: dict) -> bool:
+    # Compare modification time and size
+    return (stat.st_mtime != state_entry.get("mtime") or stat.st_size != state_entry.get("size"))
+
+class Throttle(b2.AbstractProgressListener):
+    """
+    Progress listener that caps one upload at `rate` bytes/s by sleeping in
+    bytes_completed(), which b2sdk calls from the thread reading the file.
+    """
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.start = time.monotonic()
+
+    def set_total_bytes(self, total_byte_count):
+        pass
+
+    def bytes_completed(self, byte_count):
+        ahead = byte_count / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+class UploadPipeline:
+    """
+    Bounded producer/consumer upload queue. The scanner submit()s changed
+    files; `workers` threads share the bucket and record successes in
+    state. submit() blocks while the queue is full, so a scan never runs
+    more than `queue_size` files ahead of the uploads. With a chunk_index,
+    files go up as deduplicated chunks (upload_chunked) instead of whole;
+    otherwise files over LARGE_FILE_THRESHOLD go up in resumable parts.
+    With a packer, files under PACK_FILE_MAX are packed by the scanning
+    thread and only full segments are queued, at most `workers` of them
+    queued or uploading at once so their buffers don't pile up in memory.
+    """
+    def __init__(self, bucket, state, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE, bandwidth_limit=UPLOAD_BANDWIDTH_LIMIT, chunk_index=None, packer=None):
+        self.bucket = bucket
+        self.state = state
+        self.bandwidth_limit = bandwidth_limit
+        self.chunk_index = chunk_index
+        self.packer = packer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.segments = threading.BoundedSemaphore(workers)
+        self.lock = threading.Lock()
+        self.files = self.bytes = self.failed = self.in_flight = 0
+        self.start = time.monotonic()
+        self.stop_metrics = threading.Event()
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        self.threads.append(threading.Thread(target=self._report, daemon=True))
+        for t in self.threads:
+            t.start()
+
+    def submit(self, file_str: str, key: str, stat: os.stat_result):
+        """Queue file_str for upload, recorded in the state under key."""
+        if self.packer is not None and stat.st_size < PACK_FILE_MAX:
+            segment = self.packer.add(file_str, stat, key)
+            if segment is not None:
+                self._put_segment(segment)
+            return
+        self.queue.put((file_str, key, stat))
+
+    def _put_segment(self, segment: Segment):
+        self.segments.acquire()  # released by the worker once it is uploaded
+        self.queue.put(segment)
+
+    def _upload_file(self, file_str: str, key: str, stat: os.stat_result):
+        """([(path, state entry)] uploaded, number failed) for one file."""
+        if self.chunk_index is not None:
+            result = upload_chunked(self.bucket, self.chunk_index, Path(file_str), stat, self.bandwidth_limit)
+        elif stat.st_size >= LARGE_FILE_THRESHOLD:
+            result = upload_large_file(self.bucket, self.state, Path(file_str), key, stat, self.bandwidth_limit)
+        else:
+            listener = Throttle(self.bandwidth_limit) if self.bandwidth_limit else None
+            result = upload_file(self.bucket, Path(file_str), listener)
+        if result is None:
+            return [], 1
+        # Update state with new mtime and size
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size}
+        if self.chunk_index is not None:
+            entry["chunked"] = True
+        return [(key, entry)], 0
+
+    def _upload_segment(self, segment: Segment):
+        if upload_segment(self.bucket, segment, self.bandwidth_limit) is None:
+            return [], len(segment.members)
+        return [
+            (key, {"mtime": stat.st_mtime, "size": stat.st_size,
+                    "pack": {"segment": segment.id, "offset": offset, "length": length, "codec": codec}})
+            for _, key, stat, offset, length, codec in segment.members
+        ], 0
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            with self.lock:
+                self.in_flight += 1
+            start = time.monotonic()
+            if isinstance(item, Segment):
+                try:
+                    uploaded, failed = self._upload_segment(item)
+                finally:
+                    self.segments.release()
+            else:
+                uploaded, failed = self._upload_file(*item)
+            METRICS.observe("upload_seconds", time.monotonic() - start)
+            now = time.time()
+            for _, entry in uploaded:
+                METRICS.observe("upload_lag_seconds", max(0.0, now - entry["mtime"]))
+            METRICS.count("files_uploaded", len(uploaded))
+            METRICS.count("bytes_uploaded", sum(entry["size"] for _, entry in uploaded))
+            METRICS.count("files_failed", failed)
+            with self.lock:
+                self.in_flight -= 1
+                for file_str, entry in uploaded:
+                    self.state.put(file_str, entry)
+                    self.bytes += entry["size"]
+                self.files += len(uploaded)
+                self.failed += failed
+
+    def metrics(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        with self.lock:
+            return (f"{self.files} files, {self.bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+                    f"({self.files / elapsed:.1f} files/s, {self.bytes / 1e6 / elapsed:.2f} MB/s), "
+                    f"queue {self.queue.qsize()}, in flight {self.in_flight}, failed {self.failed}")
+
+    def _report(self):
+        while not self.stop_metrics.wait(METRICS_INTERVAL_SECONDS):
+            print(f"[upload] {self.metrics()}")
+
+    def close(self):
+        """Wait for queued uploads to finish and stop the workers."""
+        if self.packer is not None and (segment := self.packer.flush()) is not None:
+            self._put_segment(segment)
+        workers = self.threads[:-1]
+        for _ in workers:
+            self.queue.put(None)
+        for t in workers:
+            t.join()
+        self.stop_metrics.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def needs_upload(entry, stat: os.stat_result, chunked=False) -> bool:
+    # If file not in state, has changed or was stored in the other mode, upload it
+    if entry is None or file_has_changed(stat, entry):
+        return True
+    return "pack" not in entry and entry.get("chunked", False) != chunked
+
+def reconcile(bucket, state, **pipeline_opts):
+    print(f"Scanning for changes at {datetime.now().isoformat()}...")
+    start = time.monotonic()
+    files = get_all_files(DIRECTORIES_TO_BACKUP)
+    with UploadPipeline(bucket, state, **pipeline_opts) as pipe:
+        while block := list(islice(files, SCAN_BLOCK)):
+            METRICS.count("files_scanned", len(block))
+            known = state.get_many(key for _, key, _ in block)
+            for file_str, key, stat in block:
+                if needs_upload(known.get(key), stat, pipe.chunk_index is not None):
+                    METRICS.count("files_changed")
+                    pipe.submit(file_str, key, stat)
+        # Includes time blocked on a full queue, i.e. waiting for uploads.
+        METRICS.observe("scan_seconds", time.monotonic() - start)
+    # Save the state to disk after each scan
+    save_state(state)
+    METRICS.observe("cycle_seconds", time.monotonic() - start)
+    METRICS.end_cycle("reconcile")
+    print(f"Scan complete: {pipe.metrics()}")
+    if pipe.chunk_index is not None:
+        print(f"Chunks: {pipe.chunk_index.summary()}")
+
+def backup_paths(bucket, state, paths, **pipeline_opts):
+    start = time.monotonic()
+    changed = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # gone again before the debounce expired
+        if not os.path.isfile(path):
+            continue
+        key = os.path.realpath(path)
+        if needs_upload(state.get(key), stat, pipeline_opts.get("chunk_index") is not None):
+            changed.append((path, key, stat))
+    if not changed:
+        return
+    METRICS.count("files_scanned", len(paths))
+    METRICS.count("files_changed", len(changed))
+    with UploadPipeline(bucket, state, **pipeline_opts) as pipe:
+        for file_str, key, stat in changed:
+            pipe.submit(file_str, key, stat)
+    save_state(state)
+    METRICS.observe("cycle_seconds", time.monotonic() - start)
+    METRICS.end_cycle("watch")
+    print(f"{datetime.now().isoformat()}: {pipe.metrics()}")
+
+def watch(bucket, state, **pipeline_opts):
+    """
+    Upload files as inotify reports them (debounced), with a full reconcile
+    scan at start, every RECONCILE_INTERVAL_SECONDS, and whenever events
+    may have been lost. Between events the process sleeps in poll(). Once
+    the inotify watch limit has left directories unwatched, reconciles run
+    every SCAN_INTERVAL_SECONDS instead, as in polling mode.
+    """
+    # Watch the roots as configured (inotify follows a symlinked root), so
+    # reported paths stay under ~ like the scanned ones.
+    roots = [d for d in DIRECTORIES_TO_BACKUP if Path(d).is_dir()]
+    watcher = TreeWatcher(roots, skip_dirs=SKIP_DIRS, debounce=DEBOUNCE_SECONDS)
+    print(f"Watching {len(watcher.dirs)} directories.")
     try:
-        stat = file_path.stat()
-        # Compare modification time and size
-        return (stat.st_mtime != state_entry.get("mtime") or stat.st_size != state_entry.get("size"))
-    except Exception as e:
-        print(f"Could not stat {file_path}: {e}")
-        return False
+        while True:
+            reconcile(bucket, state, **pipeline_opts)
+            watcher.needs_rescan = False
+            interval = SCAN_INTERVAL_SECONDS if watcher.unwatched else RECONCILE_INTERVAL_SECONDS
+            next_scan = time.monotonic() + interval
+            while not watcher.needs_rescan:
+                timeout = next_scan - time.monotonic()
+                if timeout <= 0:
+                    break
+                backup_paths(bucket, state, watcher.wait(timeout), **pipeline_opts)
+            if watcher.needs_rescan:
+                print("Change events were lost; rescanning.")
+    finally:
+        watcher.close()
 
-def upload_file(bucket, file_path: Path):
+def upload_file(bucket, file_path: Path, progress_listener=None):
     try:
         # Use relative path (or file name) as destination name.
         dest_name = str(file_path.relative_to(Path.home()))
@@ -78,7 +340,8 @@ def upload_file(bucket, file_path: Path):
         result = bucket.upload_local_file(
             local_file=str(file_path.resolve()),
             file_name=dest_name,
-            file_infos={}  # add extra metadata if needed
+            file_infos={},  # add extra metadata if needed
+            progress_listener=progress_listener,
         )
         download_url = bucket.get_download_url_for_fileid(result.id_)
         print(f"Uploaded successfully. File URL: {download_url}")
@@ -87,31 +350,396 @@ def upload_file(bucket, file_path: Path):
         print(f"Failed to upload {file_path}: {e}")
         return None
 
-def main():
-    print("Initializing B2 connection...")
+class PartReader:
+    """
+    Seekable stream over bytes [start, end) of an open file, read with
+    pread so parts of one file can be sent from several threads at once
+    (and a file truncated mid-upload just fails, where mmap would SIGBUS).
+    """
+    def __init__(self, fd: int, start: int, end: int, progress=None):
+        self.fd, self.start, self.end, self.pos = fd, start, end, start
+        self.progress = progress
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.end - self.pos
+        data = os.pread(self.fd, min(n, self.end - self.pos), self.pos)
+        self.pos += len(data)
+        if self.progress is not None and data:
+            self.progress(len(data))
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = (self.start, self.pos, self.end)[whence]
+        self.pos = min(max(base + offset, self.start), self.end)
+        return self.pos - self.start
+
+    def tell(self):
+        return self.pos - self.start
+
+def part_sha1(fd: int, start: int, end: int) -> str:
+    h = hashlib.sha1()
+    for off in range(start, end, READ_BLOCK):
+        h.update(os.pread(fd, min(READ_BLOCK, end - off), off))
+    return h.hexdigest()
+
+def resumable_upload(bucket, state, file_str: str, stat: os.stat_result):
+    """(file_id, {part: sha1} already sent) for an unfinished upload of this exact file version, if B2 still has it."""
+    progress = state.large_upload(file_str)
+    if progress is None or (progress["mtime"], progress["size"], progress["part_size"]) != (stat.st_mtime, stat.st_size, PART_SIZE):
+        return None
+    try:
+        bucket.api.session.list_parts(progress["file_id"], 1, 1)
+    except Exception:
+        return None  # cancelled or expired on the B2 side
+    return progress["file_id"], progress["parts"]
+
+def cancel_stale_upload(session, file_id: str, file_path: Path):
+    """
+    Cancel an unfinished large file left by an older version of a file, so
+    its stored parts stop being billed. Raises if B2 still has it but the
+    cancel failed: the state row is the only record of file_id, so it has
+    to stay until a later cycle manages the cancel.
+    """
+    try:
+        session.cancel_large_file(file_id)
+        print(f"Cancelled the unfinished upload of an older version of {file_path}.")
+    except Exception:
+        try:
+            session.list_parts(file_id, 1, 1)
+        except Exception:
+            return  # already cancelled or expired on the B2 side
+        raise
+
+def upload_large_file(bucket, state, file_path: Path, key: str, stat: os.stat_result, bandwidth_limit=0):
+    """
+    Send file_path as a B2 large file in PART_SIZE parts, PART_WORKERS at a
+    time. Every part is hashed by the thread that sends it, so hashing one
+    part overlaps sending the others. Finished parts are recorded in the
+    state under key as they complete, so an interrupted upload only sends
+    what's missing.
+    """
+    file_str = key
+    session = bucket.api.session
+    try:
+        dest_name = str(file_path.relative_to(Path.home()))
+        resumed = resumable_upload(bucket, state, file_str, stat)
+        if resumed:
+            file_id, done = resumed
+            print(f"Resuming {file_path} ({len(done)} parts already sent)...")
+        else:
+            stale = state.large_upload(file_str)
+            if stale is not None:
+                cancel_stale_upload(session, stale["file_id"], file_path)
+            file_id = session.start_large_file(bucket.id_, dest_name, "b2/x-auto", {})["fileId"]
+            state.start_large_upload(file_str, file_id, stat.st_mtime, stat.st_size, PART_SIZE)
+            done = {}
+            print(f"Uploading {file_path} as {dest_name} in parts...")
+
+        # One cap for all parts together, like a whole-file upload.
+        throttle = Throttle(bandwidth_limit) if bandwidth_limit else None
+        sent = 0
+        sent_lock = threading.Lock()
+        def count(n):
+            nonlocal sent
+            with sent_lock:
+                sent += n
+                total = sent
+            throttle.bytes_completed(total)
+        progress = count if throttle else None
+
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            def send(part):
+                if part in done:
+                    return done[part]
+                start = (part - 1) * PART_SIZE
+                end = min(start + PART_SIZE, stat.st_size)
+                sha1 = part_sha1(fd, start, end)
+                session.upload_part(file_id, part, end - start, sha1, PartReader(fd, start, end, progress))
+                state.large_part_done(file_str, part, sha1)
+                return sha1
+            with ThreadPoolExecutor(max_workers=PART_WORKERS) as pool:
+                sha1s = list(pool.map(send, range(1, -(-stat.st_size // PART_SIZE) + 1)))
+        finally:
+            os.close(fd)
+        result = session.finish_large_file(file_id, sha1s)
+        state.end_large_upload(file_str)
+        print(f"Uploaded {file_path} in {len(sha1s)} parts ({len(done)} resumed).")
+        return result
+    except Exception as e:
+        print(f"Failed to upload {file_path}: {e}")
+        return None
+
+def chunk_name(digest: str) -> str:
+    return f"{CHUNK_PREFIX}{digest[:2]}/{digest}"
+
+def upload_chunked(bucket, index, file_path: Path, stat: os.stat_result, bandwidth_limit=0):
+    """
+    Upload only the chunks of file_path the bucket doesn't hold yet, then a
+    manifest listing all of them (restore_chunked() reassembles from it).
+    """
+    try:
+        dest_name = str(file_path.relative_to(Path.home()))
+        digests, sent = [], 0
+        for digest, data in chunk_file(str(file_path)):
+            digests.append(digest)
+            if not index.claim(digest, len(data)):
+                continue
+            stored = False
+            try:
+                listener = Throttle(bandwidth_limit) if bandwidth_limit else None
+                bucket.upload_bytes(data, chunk_name(digest), progress_listener=listener)
+                stored = True
+            finally:
+                index.release(digest, len(data), stored)
+            sent += len(data)
+        manifest = {"size": stat.st_size, "mtime": stat.st_mtime, "chunks": digests}
+        result = bucket.upload_bytes(json.dumps(manifest).encode(), f"{MANIFEST_PREFIX}{dest_name}.json")
+        print(f"Uploaded {file_path}: {len(digests)} chunks, {sent} new bytes.")
+        return result
+    except Exception as e:
+        print(f"Failed to upload {file_path}: {e}")
+        return None
+
+def upload_segment(bucket, segment: Segment, bandwidth_limit=0):
+    """Upload a segment of packed files, then its member index."""
+    name = f"{PACK_PREFIX}{segment.id}"
     try:
-        bucket = initialize_b2()
+        listener = Throttle(bandwidth_limit) if bandwidth_limit else None
+        result = bucket.upload_bytes(bytes(segment.data), f"{name}.pack", progress_listener=listener)
+        bucket.upload_bytes(segment.index_json(), f"{name}.idx.json")
+        print(f"Uploaded segment {segment.id}: {len(segment.members)} files, {segment.raw_bytes} bytes packed into {len(segment.data)}.")
+        return result
     except Exception as e:
-        print(f"Error initializing B2: {e}")
+        print(f"Failed to upload segment {segment.id}: {e}")
+        return None
+
+def download_bytes(bucket, file_name: str, range_=None) -> bytes:
+    """Whole object, or the inclusive byte range_ (start, end) of it."""
+    buf = io.BytesIO()
+    bucket.download_file_by_name(file_name, range_=range_).save(buf)
+    return buf.getvalue()
+
+def restore_file(bucket, state, dest_name: str, target: Path):
+    """
+    Rebuild ~/dest_name at target from its packed segment or --chunked
+    manifest. Raises ValueError for a file stored some other way. Without a
+    state entry (state lost with the disk) the manifest is tried.
+    """
+    entry = state.get(os.path.realpath(Path.home() / dest_name))
+    if entry is not None and "pack" in entry:
+        restore_packed(bucket, entry, dest_name, target)
+    elif entry is not None and not entry.get("chunked"):
+        raise ValueError(f"{dest_name} was uploaded whole, so it is not restorable from packs/manifests; download it from the bucket as {dest_name}")
+    else:
+        restore_chunked(bucket, dest_name, target)
+
+def restore_packed(bucket, entry, dest_name: str, target: Path):
+    pack = entry["pack"]
+    payload = b""
+    if pack["length"]:
+        start = pack["offset"]
+        payload = download_bytes(bucket, f"{PACK_PREFIX}{pack['segment']}.pack", (start, start + pack["length"] - 1))
+    data = decompress(pack["codec"], payload)
+    if len(data) != entry["size"]:
+        raise ValueError(f"restored size of {dest_name} does not match the state")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".restoring")
+    partial.write_bytes(data)
+    os.replace(partial, target)
+    os.utime(target, (entry["mtime"], entry["mtime"]))
+    print(f"Restored {dest_name} to {target} (from segment {pack['segment']}).")
+
+def restore_chunked(bucket, dest_name: str, target: Path):
+    """Rebuild a --chunked backup of ~/dest_name at target, verifying every chunk."""
+    try:
+        manifest = json.loads(download_bytes(bucket, f"{MANIFEST_PREFIX}{dest_name}.json"))
+    except Exception as e:
+        raise ValueError(f"{dest_name} is not restorable from packs/manifests: no manifest ({e})") from None
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".restoring")
+    with open(partial, "wb") as out:
+        for digest in manifest["chunks"]:
+            data = download_bytes(bucket, chunk_name(digest))
+            if chunk_digest(data) != digest:
+                raise ValueError(f"chunk {digest} of {dest_name} is corrupt")
+            out.write(data)
+    if partial.stat().st_size != manifest["size"]:
+        raise ValueError(f"restored size of {dest_name} does not match its manifest")
+    os.replace(partial, target)
+    os.utime(target, (manifest["mtime"], manifest["mtime"]))
+    print(f"Restored {dest_name} to {target} ({len(manifest['chunks'])} chunks).")
+
+class FakeLargeFileSession:
+    """The large-file calls of b2sdk's B2Session, backed by FakeBucket's directory."""
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.parts_root = bucket.root / ".large"
+
+    def _parts(self, file_id):
+        d = self.parts_root / file_id
+        if not d.is_dir():
+            raise ValueError(f"no unfinished large file {file_id}")
+        return d
+
+    def start_large_file(self, bucket_id, file_name, content_type, file_info):
+        file_id = uuid.uuid4().hex
+        d = self.parts_root / file_id
+        d.mkdir(parents=True)
+        (d / "name").write_text(file_name)
+        return {"fileId": file_id}
+
+    def list_parts(self, file_id, start_part_number, max_part_count):
+        parts = sorted(int(p.name) for p in self._parts(file_id).iterdir() if p.name.isdigit())
+        return {"parts": [{"partNumber": n} for n in parts if n >= start_part_number][:max_part_count]}
+
+    def upload_part(self, file_id, part_number, content_length, sha1_sum, input_stream):
+        time.sleep(self.bucket.latency)
+        d = self._parts(file_id)
+        h, total, start = hashlib.sha1(), 0, time.monotonic()
+        with open(d / f"{part_number}.tmp", "wb") as out:
+            while block := input_stream.read(READ_BLOCK):
+                out.write(block)
+                h.update(block)
+                total += len(block)
+                if self.bucket.link_rate:
+                    time.sleep(max(0, total / self.bucket.link_rate - (time.monotonic() - start)))
+        if total != content_length or h.hexdigest() != sha1_sum:
+            raise ValueError(f"part {part_number} does not match its length/sha1")
+        os.replace(d / f"{part_number}.tmp", d / str(part_number))
+        return {"partNumber": part_number, "contentSha1": sha1_sum}
+
+    def cancel_large_file(self, file_id):
+        shutil.rmtree(self._parts(file_id))
+        return {"fileId": file_id}
+
+    def finish_large_file(self, file_id, part_sha1_array):
+        d = self._parts(file_id)
+        dest = self.bucket.root / (d / "name").read_text()
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(dest, "wb") as out:
+            for n, sha1 in enumerate(part_sha1_array, 1):
+                data = (d / str(n)).read_bytes()
+                if hashlib.sha1(data).hexdigest() != sha1:
+                    raise ValueError(f"part {n} sha1 mismatch")
+                out.write(data)
+        shutil.rmtree(d)
+        return {"fileId": file_id}
+
+class FakeBucket:
+    """
+    Stand-in for a b2 Bucket that copies uploads into a local directory,
+    for trying the pipeline without an account. `latency` is added per
+    upload and `link_rate` (bytes/s, 0 = unlimited) caps each transfer.
+    """
+    def __init__(self, root, latency=0.05, link_rate=0):
+        self.root = Path(root)
+        self.latency = latency
+        self.link_rate = link_rate
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.id_ = "fake-bucket"
+        self.api = SimpleNamespace(session=FakeLargeFileSession(self))
+
+    def upload_local_file(self, local_file, file_name, file_infos=None, progress_listener=None):
+        time.sleep(self.latency)
+        dest = self.root / file_name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        start, done = time.monotonic(), 0
+        with open(local_file, "rb") as src, open(dest, "wb") as out:
+            while block := src.read(1 << 20):
+                out.write(block)
+                done += len(block)
+                if progress_listener is not None:
+                    progress_listener.bytes_completed(done)
+                if self.link_rate:
+                    time.sleep(max(0, done / self.link_rate - (time.monotonic() - start)))
+        with self.lock:
+            self.uploads += 1
+            file_id = f"fake-{self.uploads}"
+        return type("FakeFileVersion", (), {"id_": file_id})()
+
+    def upload_bytes(self, data_bytes, file_name, progress_listener=None):
+        time.sleep(self.latency)
+        dest = self.root / file_name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(data_bytes)
+        if progress_listener is not None:
+            progress_listener.bytes_completed(len(data_bytes))
+        with self.lock:
+            self.uploads += 1
+            file_id = f"fake-{self.uploads}"
+        return type("FakeFileVersion", (), {"id_": file_id})()
+
+    def download_file_by_name(self, file_name, range_=None):
+        data = (self.root / file_name).read_bytes()
+        if range_ is not None:
+            data = data[range_[0]:range_[1] + 1]
+        return type("FakeDownload", (), {"save": lambda _, f: f.write(data)})()
+
+    def get_download_url_for_fileid(self, file_id):
+        return f"file://{self.root}#{file_id}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up home directories to B2.")
+    parser.add_argument("--watch", action="store_true", help="Use inotify instead of polling; rescan only every RECONCILE_INTERVAL_SECONDS.")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS, help=f"Concurrent uploads (default: {UPLOAD_WORKERS}).")
+    parser.add_argument("--queue-size", type=int, default=UPLOAD_QUEUE_SIZE, help=f"Files queued ahead of the uploads (default: {UPLOAD_QUEUE_SIZE}).")
+    parser.add_argument("--bwlimit", type=float, default=UPLOAD_BANDWIDTH_LIMIT / 1e6, help="Per-worker upload cap in MB/s (default: unlimited).")
+    parser.add_argument("--fake-bucket", metavar="DIR", help="Upload into DIR instead of B2, tracking state in DIR/state.sqlite (one scan, then exit).")
+    parser.add_argument("--chunked", action="store_true", help="Upload deduplicated content-defined chunks plus a manifest per file.")
+    parser.add_argument("--pack", action="store_true", help=f"Bundle files under {PACK_FILE_MAX // 1024} KiB into compressed segments; old copies of changed files are not reclaimed.")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Serve Prometheus metrics on 127.0.0.1:PORT.")
+    parser.add_argument("--metrics-log", default=str(METRICS_LOG), help=f"Append per-cycle metrics as JSON lines here ('' = off, default: {METRICS_LOG}).")
+    parser.add_argument("--restore", nargs=2, metavar=("PATH", "TARGET"), help="Rebuild the packed or --chunked backup of ~/PATH at TARGET and exit.")
+    args = parser.parse_args()
+    pipeline_opts = {"workers": args.workers, "queue_size": args.queue_size, "bandwidth_limit": args.bwlimit * 1e6}
+    if args.chunked:
+        pipeline_opts["chunk_index"] = ChunkIndex()
+    if args.pack:
+        pipeline_opts["packer"] = Packer()
+    METRICS.log_path = args.metrics_log or None
+    if args.metrics_port:
+        serve_metrics(METRICS, args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    if args.fake_bucket:
+        bucket = FakeBucket(args.fake_bucket)
+    else:
+        print("Initializing B2 connection...")
+        try:
+            bucket = initialize_b2()
+        except Exception as e:
+            print(f"Error initializing B2: {e}")
+            return
+
+    # A trial run must not mark files uploaded in the real state, or the next
+    # B2 run would skip them; the fake bucket keeps its own.
+    state = StateStore(Path(args.fake_bucket) / "state.sqlite") if args.fake_bucket else load_state()
+
+    if args.restore:
+        try:
+            restore_file(bucket, state, args.restore[0], Path(args.restore[1]))
+        except ValueError as e:
+            print(f"Cannot restore: {e}")
         return
 
-    state = load_state()
+    if args.fake_bucket:
+        reconcile(bucket, state, **pipeline_opts)
+        state.close()
+        return
+
+    if args.watch:
+        try:
+            watch(bucket, state, **pipeline_opts)
+            return
+        except OSError as e:
+            print(f"Watch mode unavailable ({e}); polling instead.")
 
     while True:
-        print(f"Scanning for changes at {datetime.now().isoformat()}...")
-        all_files = get_all_files(DIRECTORIES_TO_BACKUP)
-        for file_path in all_files:
-            file_str = str(file_path.resolve())
-            stat = file_path.stat()
-            # If file not in state or has changed, upload it
-            if file_str not in state or file_has_changed(file_path, state[file_str]):
-                result = upload_file(bucket, file_path)
-                if result is not None:
-                    # Update state with new mtime and size
-                    state[file_str] = {"mtime": stat.st_mtime, "size": stat.st_size}
-        # Save the state to disk after each scan
-        save_state(state)
-        print(f"Scan complete. Sleeping for {SCAN_INTERVAL_SECONDS} seconds...\n")
+        reconcile(bucket, state, **pipeline_opts)
+        print(f"Sleeping for {SCAN_INTERVAL_SECONDS} seconds...\n")
         time.sleep(SCAN_INTERVAL_SECONDS)
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Per-cycle metrics for backup_home_b2.
+
+Counters (files scanned/changed/uploaded/failed, bytes) and latency
+histograms (scan, per-upload, upload lag behind the file's mtime, state
+save) accumulate as a cycle runs. end_cycle() appends the cycle's numbers as
+one JSON line and keeps running totals, which serve() exposes in the
+Prometheus text format on a local port.
+
+    ./backup_metrics.py [backup_metrics.jsonl]   # summarize a JSON-lines log
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence
+
+PREFIX = "backup_"
+COUNTERS = (
+    "files_scanned",
+    "files_changed",
+    "files_uploaded",
+    "files_failed",
+    "bytes_uploaded",
+)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+LAG_BUCKETS = (1, 10, 60, 300, 600, 1800, 3600, 6 * 3600, 24 * 3600, 7 * 86400)
+HISTOGRAMS = {
+    "scan_seconds": DURATION_BUCKETS,
+    "cycle_seconds": DURATION_BUCKETS,
+    "upload_seconds": DURATION_BUCKETS,
+    "upload_lag_seconds": LAG_BUCKETS,
+    "state_save_seconds": DURATION_BUCKETS,
+}
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str) -> str:
+        lines, cumulative = [f"# TYPE {name} histogram"], 0
+        for le, n in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum:.6f}")
+        lines.append(f"{name}_count {self.count}")
+        return "\n".join(lines)
+
+
+class BackupMetrics:
+    """Thread-safe; one instance per process, shared by scans and upload workers."""
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.totals: Counter = Counter()
+        self.histograms = {name: Histogram(b) for name, b in HISTOGRAMS.items()}
+        self.cycles = 0
+        self.last_cycle: Dict[str, float] = {}
+        self._new_cycle()
+
+    def _new_cycle(self):
+        self.cycle: Counter = Counter()
+        self.cycle_max: Dict[str, float] = {}
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.cycle[name] += n
+            self.totals[name] += n
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            self.histograms[name].observe(value)
+            self.cycle[f"{name}_sum"] += value
+            self.cycle[f"{name}_count"] += 1
+            self.cycle_max[name] = max(value, self.cycle_max.get(name, value))
+
+    def end_cycle(self, kind: str) -> dict:
+        """Close the current cycle: log it as a JSON line and return the record."""
+        with self.lock:
+            now = datetime.now().isoformat(timespec="seconds")
+            record = {"time": now, "kind": kind}
+            record.update({name: self.cycle[name] for name in COUNTERS})
+            for name in HISTOGRAMS:
+                n = self.cycle[f"{name}_count"]
+                if not n:
+                    continue
+                if n == 1:
+                    record[name] = round(self.cycle[f"{name}_sum"], 3)
+                else:
+                    record[f"{name}_mean"] = round(self.cycle[f"{name}_sum"] / n, 3)
+                    record[f"{name}_max"] = round(self.cycle_max[name], 3)
+            self.cycles += 1
+            self.last_cycle = {
+                k: v for k, v in record.items() if k not in ("time", "kind")
+            }
+            self.last_cycle["timestamp_seconds"] = time.time()
+            self._new_cycle()
+        if self.log_path:
+            try:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                print(
+                    f"Warning: cannot write metrics to {self.log_path}: {e}",
+                    file=sys.stderr,
+                )
+        return record
+
+    def render(self) -> str:
+        """Prometheus text exposition of totals, histograms and the last cycle."""
+        with self.lock:
+            out = [
+                f"# TYPE {PREFIX}cycles_total counter",
+                f"{PREFIX}cycles_total {self.cycles}",
+            ]
+            for name in COUNTERS:
+                out.append(f"# TYPE {PREFIX}{name}_total counter")
+                out.append(f"{PREFIX}{name}_total {self.totals[name]}")
+            for name, hist in self.histograms.items():
+                out.append(hist.render(PREFIX + name))
+            for name, value in self.last_cycle.items():
+                out.append(f"# TYPE {PREFIX}last_cycle_{name} gauge")
+                out.append(f"{PREFIX}last_cycle_{name} {value}")
+        return "\n".join(out) + "\n"
+
+
+def serve(
+    metrics: BackupMetrics, port: int, host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """Serve GET /metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize backup metrics JSON lines.")
+    parser.add_argument("log", nargs="?", default="backup_metrics.jsonl")
+    args = parser.parse_args()
+    cycles = []
+    with open(args.log) as f:
+        for line in f:
+            if line.strip():
+                cycles.append(json.loads(line))
+    if not cycles:
+        print("no cycles logged")
+        return
+    totals = Counter()
+    for c in cycles:
+        totals.update({k: c.get(k, 0) for k in COUNTERS})
+    print(f"{len(cycles)} cycles, {cycles[0]['time']} .. {cycles[-1]['time']}")
+    for name in COUNTERS:
+        print(f"  {name:16} {totals[name]}")
+    for name in ("cycle_seconds", "scan_seconds", "state_save_seconds"):
+        values = sorted(c[name] for c in cycles if name in c)
+        if values:
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            print(
+                f"  {name:20} median {values[len(values) // 2]:.2f}s "
+                f"p95 {p95:.2f}s max {values[-1]:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Transactional state for backup_home_b2: what was uploaded, keyed by path.
+
+Rows live in a WAL-mode SQLite table instead of one JSON dict that had to be
+loaded whole and rewritten after every scan. Writes are upserts buffered in
+memory and committed COMMIT_BATCH at a time (or on flush()), lookups go
+through the primary key in batches, and a crash loses at most the
+uncommitted batch, never the file. An existing backup_state.json is imported
+on first open. Files packed into a segment (file_pack) also record where,
+for single-file restores. Large files being sent in parts also record each finished
+part here, so an interrupted upload resumes where it stopped.
+
+    ./backup_state.py [PREFIX]   # print tracked files under PREFIX
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+STATE_DB = Path("backup_state.sqlite")
+COMMIT_BATCH = 5000  # buffered upserts per transaction
+LOOKUP_BATCH = 500  # SQLite host-parameter budget per IN (...) query
+
+
+def _key(path: str) -> bytes:
+    # Stored as bytes so undecodable (surrogate-escaped) names round-trip.
+    return os.fsencode(path)
+
+
+def _prefix_end(prefix: bytes) -> Optional[bytes]:
+    """Smallest key greater than every key starting with prefix."""
+    prefix = prefix.rstrip(b"\xff")
+    return prefix[:-1] + bytes([prefix[-1] + 1]) if prefix else None
+
+
+COLUMNS = "mtime, size, chunked, segment, offset, length, codec"
+PACK_FIELDS = ("segment", "offset", "length", "codec")
+
+
+def _entry(mtime, size, chunked, *pack) -> dict:
+    entry = {"mtime": mtime, "size": size}
+    if chunked:
+        entry["chunked"] = True
+    if pack[0] is not None:
+        entry["pack"] = dict(zip(PACK_FIELDS, pack))
+    return entry
+
+
+def _row(entry: dict) -> tuple:
+    pack = entry.get("pack") or {}
+    return (
+        entry["mtime"],
+        entry["size"],
+        int(entry.get("chunked", False)),
+        *(pack.get(k) for k in PACK_FIELDS),
+    )
+
+
+class StateStore:
+    """
+    Path -> {"mtime", "size"[, "chunked"][, "pack"]}; safe to share between
+    threads. "pack" is {"segment", "offset", "length", "codec"}.
+    """
+
+    def __init__(self, path=STATE_DB, import_json: Optional[Path] = None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path BLOB PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                chunked INTEGER NOT NULL DEFAULT 0,
+                segment TEXT,
+                offset INTEGER,
+                length INTEGER,
+                codec TEXT
+            )"""
+        )
+        have = {row[1] for row in self.db.execute("PRAGMA table_info(files)")}
+        for column, kind in [
+            ("segment", "TEXT"),
+            ("offset", "INTEGER"),
+            ("length", "INTEGER"),
+            ("codec", "TEXT"),
+        ]:
+            if column not in have:  # stores created before packing existed
+                self.db.execute(f"ALTER TABLE files ADD COLUMN {column} {kind}")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS large_uploads (
+                path BLOB PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                part_size INTEGER NOT NULL
+            )"""
+        )
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS large_parts (
+                path BLOB NOT NULL,
+                part INTEGER NOT NULL,
+                sha1 TEXT NOT NULL,
+                PRIMARY KEY (path, part)
+            )"""
+        )
+        self.lock = threading.RLock()
+        self.pending: Dict[str, tuple] = {}
+        if import_json is not None and import_json.exists() and not len(self):
+            self._import(import_json)
+
+    def _import(self, json_path: Path):
+        try:
+            with open(json_path, "r") as f:
+                old = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: cannot import {json_path}: {e}", file=sys.stderr)
+            return
+        with self.lock, self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO files (path, {COLUMNS}) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((_key(p), *_row(e)) for p, e in old.items()),
+            )
+        os.replace(json_path, json_path.with_name(json_path.name + ".imported"))
+        print(f"Imported {len(old)} entries from {json_path}.")
+
+    def get(self, path: str) -> Optional[dict]:
+        return self.get_many([path]).get(path)
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, dict]:
+        """Entries for the tracked paths among `paths` (untracked are left out)."""
+        paths = list(paths)
+        found = {}
+        with self.lock:
+            for i in range(0, len(paths), LOOKUP_BATCH):
+                batch = [_key(p) for p in paths[i : i + LOOKUP_BATCH]]
+                marks = ",".join("?" * len(batch))
+                for key, *row in self.db.execute(
+                    f"SELECT path, {COLUMNS} FROM files WHERE path IN ({marks})",
+                    batch,
+                ):
+                    found[os.fsdecode(key)] = _entry(*row)
+            for path in paths:
+                if path in self.pending:
+                    found[path] = _entry(*self.pending[path])
+        return found
+
+    def put(self, path: str, entry: dict):
+        with self.lock:
+            self.pending[path] = _row(entry)
+            if len(self.pending) >= COMMIT_BATCH:
+                self.flush()
+
+    def flush(self):
+        """Commit buffered upserts."""
+        with self.lock:
+            if not self.pending:
+                return
+            with self.db:
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO files (path, {COLUMNS}) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((_key(p), *row) for p, row in self.pending.items()),
+                )
+            self.pending.clear()
+
+    def under(self, prefix: str) -> Iterator[Tuple[str, dict]]:
+        """(path, entry) for tracked paths starting with prefix, in path order."""
+        self.flush()
+        # A range scan on the primary key rather than LIKE, which can't use it.
+        start = _key(prefix)
+        end = _prefix_end(start)
+        sql = f"SELECT path, {COLUMNS} FROM files WHERE path >= ?"
+        args = [start]
+        if end is not None:
+            sql += " AND path < ?"
+            args.append(end)
+        for key, *row in self.db.execute(sql + " ORDER BY path", args):
+            yield os.fsdecode(key), _entry(*row)
+
+    def large_upload(self, path: str) -> Optional[dict]:
+        """The unfinished large-file upload of path, with {part: sha1} sent so far."""
+        key = _key(path)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT file_id, mtime, size, part_size FROM large_uploads "
+                "WHERE path = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            parts = dict(
+                self.db.execute(
+                    "SELECT part, sha1 FROM large_parts WHERE path = ?", (key,)
+                )
+            )
+        file_id, mtime, size, part_size = row
+        return {
+            "file_id": file_id,
+            "mtime": mtime,
+            "size": size,
+            "part_size": part_size,
+            "parts": parts,
+        }
+
+    def start_large_upload(
+        self, path: str, file_id: str, mtime: float, size: int, part_size: int
+    ):
+        """Record a new upload of path, replacing any earlier one (the caller
+        cancels that on the B2 side first: this row is its only record)."""
+        key = _key(path)
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM large_parts WHERE path = ?", (key,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO large_uploads "
+                "(path, file_id, mtime, size, part_size) VALUES (?, ?, ?, ?, ?)",
+                (key, file_id, mtime, size, part_size),
+            )
+
+    def large_part_done(self, path: str, part: int, sha1: str):
+        # Committed right away: this is what a resumed upload trusts.
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO large_parts (path, part, sha1) "
+                "VALUES (?, ?, ?)",
+                (_key(path), part, sha1),
+            )
+
+    def end_large_upload(self, path: str):
+        key = _key(path)
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM large_parts WHERE path = ?", (key,))
+            self.db.execute("DELETE FROM large_uploads WHERE path = ?", (key,))
+
+    def __len__(self) -> int:
+        self.flush()
+        with self.lock:
+            (count,) = self.db.execute("SELECT COUNT(*) FROM files").fetchone()
+        return count
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect backup_home_b2 state.")
+    parser.add_argument("prefix", nargs="?", default="")
+    parser.add_argument("--db", default=str(STATE_DB))
+    args = parser.parse_args()
+    store = StateStore(args.db)
+    count = size = 0
+    try:
+        for path, entry in store.under(args.prefix):
+            print(f"{path}\t{entry['size']}\t{entry['mtime']}")
+            count += 1
+            size += entry["size"]
+    finally:
+        store.close()
+    print(f"{count} files, {size / 1e9:.2f} GB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Warm headless Chrome instances shared by the markdown scrapers.
+
+Starting Chrome costs more than loading most pages, so BrowserPool keeps up
+to `size` browsers running and opens a fresh tab in one of them per fetch.
+Instead of a fixed sleep, a page is ready once document.readyState is
+"complete" (and an optional wait_for XPath matches) and no new resources
+have finished loading for IDLE_WINDOW seconds, all capped at PAGE_TIMEOUT.
+
+    ./browser_pool.py URLS.txt [--browsers N]   # fetch a URL list, print timings
+    ./browser_pool.py --serve DIR [--port P]    # static server for local testing
+    ./browser_pool.py --bench [N]               # new browser + sleep(3) vs the pool
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+POOL_SIZE = 2  # warm browsers; each renders one page at a time
+PAGE_TIMEOUT = 15  # seconds before a slow page is taken as it is
+IDLE_WINDOW = 0.5  # "network idle": no resource finished for this long
+POLL_INTERVAL = 0.1
+RESOURCE_BUFFER = 5000  # resource-timing entries kept per page (default 250)
+
+
+def chrome_options() -> Options:
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    # Return from get() at DOMContentLoaded; wait_ready() decides the rest.
+    options.page_load_strategy = "eager"
+    return options
+
+
+def wait_ready(driver, timeout: float = PAGE_TIMEOUT, wait_for=None):
+    """
+    Block until the page in driver is ready or timeout passes. wait_for is
+    an XPath string or compiled etree.XPath that must match. Returns False
+    on timeout; the caller still gets whatever has rendered so far.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        WebDriverWait(driver, timeout, POLL_INTERVAL).until(
+            lambda d: d.execute_script("return document.readyState") == "complete"
+        )
+        driver.execute_script(
+            f"performance.setResourceTimingBufferSize({RESOURCE_BUFFER})"
+        )
+        if wait_for is not None:
+            xpath = getattr(wait_for, "path", wait_for)
+            WebDriverWait(
+                driver, max(0.0, deadline - time.monotonic()), POLL_INTERVAL
+            ).until(EC.presence_of_element_located((By.XPATH, xpath)))
+    except TimeoutException:
+        return False
+
+    # Resource timing only lists finished requests, so "idle" is a quiet
+    # period with no new entries rather than zero requests in flight.
+    count, quiet_since = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        n = driver.execute_script(
+            "return performance.getEntriesByType('resource').length"
+        )
+        now = time.monotonic()
+        if n != count:
+            count, quiet_since = n, now
+        elif now - quiet_since >= IDLE_WINDOW:
+            return True
+        time.sleep(POLL_INTERVAL)
+    return False
+
+
+class BrowserPool:
+    """
+    Up to `size` Chrome instances, started on demand and reused. fetch() is
+    safe to call from several threads; a browser that crashes is replaced.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = PAGE_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.idle: "queue.Queue" = queue.Queue()
+        self.drivers: List = []
+        self.lock = threading.Lock()
+        self.stats = {"pages": 0, "starts": 0, "timeouts": 0, "crashes": 0}
+
+    def _acquire(self):
+        # idle holds warm drivers and None for a free slot whose browser was
+        # discarded: whoever takes the None starts the replacement, so
+        # threads blocked here are woken by a crash as well as by a release.
+        try:
+            driver = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                start = len(self.drivers) < self.size
+                if start:
+                    self.drivers.append(None)  # reserve the slot
+            driver = None if start else self.idle.get()
+        if driver is not None:
+            return driver
+        try:
+            driver = webdriver.Chrome(options=chrome_options())
+            driver.set_page_load_timeout(self.timeout)
+        except Exception:
+            self.idle.put(None)  # hand the slot to the next caller
+            raise
+        with self.lock:
+            self.drivers[self.drivers.index(None)] = driver
+            self.stats["starts"] += 1
+        return driver
+
+    def _discard(self, driver):
+        with self.lock:
+            self.drivers[self.drivers.index(driver)] = None
+            self.stats["crashes"] += 1
+        self.idle.put(None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def fetch(self, url: str, wait_for=None) -> str:
+        """Rendered HTML of url, loaded in a new tab of a warm browser."""
+        driver = self._acquire()
+        try:
+            base = driver.current_window_handle
+            driver.switch_to.new_window("tab")
+        except WebDriverException:
+            self._discard(driver)
+            raise
+        try:
+            try:
+                driver.get(url)
+            except TimeoutException:
+                pass  # keep what loaded, as the fixed sleep used to
+            ready = wait_ready(driver, self.timeout, wait_for)
+            html_content = driver.page_source
+        finally:
+            # A page error leaves the browser usable; failing to close the
+            # tab means the browser itself is gone.
+            try:
+                driver.close()
+                driver.switch_to.window(base)
+            except WebDriverException:
+                self._discard(driver)
+            else:
+                self.idle.put(driver)
+        with self.lock:
+            self.stats["pages"] += 1
+            self.stats["timeouts"] += not ready
+        return html_content
+
+    def close(self):
+        with self.lock:
+            drivers, self.drivers = [d for d in self.drivers if d], []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_pool: Optional[BrowserPool] = None
+
+
+def fetch_html(url: str, wait_for=None) -> str:
+    """BrowserPool.fetch() on a process-wide pool, closed at exit."""
+    global _default_pool
+    if _default_pool is None:
+        import atexit
+
+        _default_pool = BrowserPool()
+        atexit.register(_default_pool.close)
+    return _default_pool.fetch(url, wait_for)
+
+
+def serve_static(
+    root: str, port: int = 0, delay: float = 0.0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Serve root over HTTP from a daemon thread; returns (server, base URL).
+    delay adds server think time to every response, like a remote site.
+    """
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), partial(QuietHandler, directory=root)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def write_fixture_pages(root: str, count: int) -> List[str]:
+    """
+    Documentation-like pages whose article is filled in by a script after
+    300 ms and that pull an image, so readiness waits have work to do.
+    """
+    paragraph = "Configure the interface, then commit the change. " * 30
+    names = []
+    for i in range(count):
+        name = f"page-{i}.html"
+        body = "".join(f"<h2>Step {j}</h2><p>{paragraph}</p>" for j in range(8))
+        page = f"""<!doctype html>
+<html><head><title>Page {i}</title></head>
+<body>
+<nav><a href="/">Home</a> <a href="page-{(i + 1) % count}.html">Next</a></nav>
+<article id="content">loading...</article>
+<img src="pixel.gif" alt="">
+<script>
+setTimeout(function () {{
+  document.getElementById("content").innerHTML = {body!r};
+}}, 300);
+</script>
+</body></html>
+"""
+        with open(os.path.join(root, name), "w") as f:
+            f.write(page)
+        names.append(name)
+    with open(os.path.join(root, "pixel.gif"), "wb") as f:
+        f.write(b"GIF89a\x01\x00\x01\x00\x00\x00\x00;")
+    return names
+
+
+def fetch_old_way(url: str, settle: float = 3.0) -> str:
+    """The scrapers' original fetch: a new browser per URL and a fixed sleep."""
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    driver = webdriver.Chrome(options=options)
+    try:
+        driver.get(url)
+        time.sleep(settle)
+        return driver.page_source
+    finally:
+        driver.quit()
+
+
+def run_batch(urls: List[str], browsers: int):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def one(url):
+        start = time.perf_counter()
+        try:
+            html_content = pool.fetch(url)
+        except WebDriverException as e:
+            print(f"FAIL {url}: {e.msg}", file=sys.stderr)
+            return None
+        print(f"{time.perf_counter() - start:6.2f}s {len(html_content):>8} {url}")
+        return html_content
+
+    start = time.perf_counter()
+    with BrowserPool(browsers) as pool, ThreadPoolExecutor(browsers) as ex:
+        done = sum(r is not None for r in ex.map(one, urls))
+    secs = time.perf_counter() - start
+    print(
+        f"{done}/{len(urls)} pages in {secs:.1f}s "
+        f"({60 * done / secs:.0f} pages/min), {pool.stats['starts']} browser starts, "
+        f"{pool.stats['timeouts']} timeouts"
+    )
+
+
+def run_benchmark(count: int, browsers: int):
+    with tempfile.TemporaryDirectory() as root:
+        names = write_fixture_pages(root, count)
+        server, base = serve_static(root)
+        urls = [base + n for n in names]
+        try:
+            start = time.perf_counter()
+            old = [fetch_old_way(u) for u in urls]
+            old_secs = time.perf_counter() - start
+            print(
+                f"new browser + sleep(3): {old_secs:.1f}s "
+                f"({old_secs / count:.2f}s/page)"
+            )
+            start = time.perf_counter()
+            with BrowserPool(browsers) as pool:
+                new = [pool.fetch(u) for u in urls]
+            new_secs = time.perf_counter() - start
+            print(
+                f"pool of {browsers}, readiness waits: {new_secs:.1f}s "
+                f"({new_secs / count:.2f}s/page, {old_secs / new_secs:.1f}x faster)"
+            )
+            print(
+                f"rendered articles: old {sum('Step 7' in h for h in old)}/{count}, "
+                f"pool {sum('Step 7' in h for h in new)}/{count}"
+            )
+        finally:
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm headless browser pool.")
+    parser.add_argument("urls", nargs="?", help="File with one URL per line.")
+    parser.add_argument("--browsers", type=int, default=POOL_SIZE)
+    parser.add_argument("--serve", metavar="DIR", help="Serve DIR over HTTP.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bench", type=int, nargs="?", const=10, metavar="N")
+    args = parser.parse_args()
+
+    if args.serve:
+        server, base = serve_static(args.serve, args.port)
+        print(f"Serving {args.serve} at {base} (Ctrl-C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.bench:
+        run_benchmark(args.bench, args.browsers)
+    elif args.urls:
+        with open(args.urls) as f:
+            urls = [line.strip() for line in f]
+        urls = [u for u in urls if u and not u.startswith("#")]
+        run_batch(urls, args.browsers)
+    else:
+        parser.error("give a URL file, --serve DIR or --bench")
+
+
+if __name__ == "__main__":
+    main()
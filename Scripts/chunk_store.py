@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Content-defined chunking and a chunk index for deduplicating backups.
+
+Files are cut where their content says so rather than at fixed offsets: a
+chunk ends after the first run of CUT_RUN bytes that all fall in a fixed
+pseudo-random half of the byte alphabet, at least CHUNK_MIN and at most
+CHUNK_MAX bytes in. That is a test on a sliding CUT_RUN-byte window, found
+with bytes.translate() + find() at C speed. Inserting or deleting bytes only
+moves the boundaries next to the edit, so the rest of the file still yields
+the same chunks.
+
+Chunks are named by their blake2b digest, and ChunkIndex (SQLite) records
+which ones the bucket already holds, so an edited file sends only the chunks
+around the edit and identical content anywhere in the tree is stored once.
+
+    ./chunk_store.py --bench [MB]   # bytes uploaded for common edit patterns
+"""
+import io
+import os
+import sys
+import time
+import random
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import BinaryIO, Iterator, Tuple
+
+CHUNK_DB = os.environ.get(
+    "BACKUP_CHUNK_DB", str(Path.home() / ".cache" / "backup_chunks.sqlite")
+)
+CHUNK_MIN = 512 << 10
+CHUNK_MAX = 4 << 20
+CUT_RUN = 19  # boundary odds are 2**-CUT_RUN per byte: ~1 MiB chunks on random data
+CUT_SEED = 0x5EED  # changing this (or the sizes) re-chunks every file
+
+_order = list(range(256))
+random.Random(CUT_SEED).shuffle(_order)
+CUT_TABLE = bytes(1 if b in _order[:128] else 0 for b in range(256))
+CUT_MARK = b"\x01" * CUT_RUN
+del _order
+
+
+def chunk_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def iter_chunks(f: BinaryIO) -> Iterator[bytes]:
+    """Content-defined chunks of a binary stream, in order."""
+    buf, marks, pos, eof = b"", b"", 0, False
+    while True:
+        if not eof and len(buf) - pos < CHUNK_MAX:
+            block = f.read(CHUNK_MAX)
+            eof = not block
+            # Keep CUT_RUN bytes of lookbehind so a run may straddle reads.
+            keep = max(0, pos - CUT_RUN)
+            buf = buf[keep:] + block
+            marks = marks[keep:] + block.translate(CUT_TABLE)
+            pos -= keep
+            continue
+        end = len(buf)
+        if pos >= end:
+            return
+        cut = end
+        if end - pos > CHUNK_MIN:
+            limit = min(end, pos + CHUNK_MAX)
+            i = marks.find(CUT_MARK, pos + CHUNK_MIN - CUT_RUN, limit)
+            cut = limit if i < 0 else i + CUT_RUN
+        yield buf[pos:cut]
+        pos = cut
+
+
+def chunk_file(path: str) -> Iterator[Tuple[str, bytes]]:
+    """(digest, data) for each chunk of a file."""
+    with open(path, "rb") as f:
+        for data in iter_chunks(f):
+            yield chunk_digest(data), data
+
+
+class ChunkIndex:
+    """
+    Digests of chunks already in the bucket. Safe to share between upload
+    threads: claim() hands each new chunk to exactly one of them and makes
+    the others wait until it is stored (or retry if that upload failed).
+    """
+
+    def __init__(self, path: str = CHUNK_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self.lock = threading.Lock()
+        self.sending = {}  # digest -> Event set when its upload finishes
+        self.stats = {"chunks": 0, "sent": 0, "sent_bytes": 0, "dedup_bytes": 0}
+
+    def claim(self, digest: str, size: int) -> bool:
+        """True if the caller must upload this chunk, then call release()."""
+        while True:
+            with self.lock:
+                event = self.sending.get(digest)
+                if event is None:
+                    self.stats["chunks"] += 1
+                    if self.db.execute(
+                        "SELECT 1 FROM chunks WHERE hash = ?", (digest,)
+                    ).fetchone():
+                        self.stats["dedup_bytes"] += size
+                        return False
+                    self.sending[digest] = threading.Event()
+                    return True
+            event.wait()
+
+    def release(self, digest: str, size: int, stored: bool):
+        with self.lock:
+            if stored:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO chunks (hash, size) VALUES (?, ?)",
+                        (digest, size),
+                    )
+                self.stats["sent"] += 1
+                self.stats["sent_bytes"] += size
+            else:
+                self.stats["chunks"] -= 1  # the retrying thread counts it again
+            self.sending.pop(digest).set()
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"{s['chunks']} chunks, {s['sent']} sent ({s['sent_bytes'] / 1e6:.1f} MB), "
+            f"{s['dedup_bytes'] / 1e6:.1f} MB already stored"
+        )
+
+    def close(self):
+        self.db.close()
+
+
+def _fixed_chunks(data: bytes, size: int = 1 << 20):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def _synthetic_file(mb: int) -> bytes:
+    """Mix of incompressible runs and repetitive text, like a media/doc tree."""
+    rng = random.Random(1)
+    parts, total = [], 0
+    while total < mb << 20:
+        if rng.random() < 0.7:
+            part = rng.randbytes(rng.randint(64 << 10, 2 << 20))
+        else:
+            line = f"row {rng.randint(0, 10**6)} value {rng.random():.6f}\n"
+            part = (line * rng.randint(2000, 40000)).encode()
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)[: mb << 20]
+
+
+def run_benchmark(mb: int):
+    base = _synthetic_file(mb)
+    mid = len(base) // 2
+    edits = {
+        "renamed/copied": base,
+        "1 byte overwritten": base[:mid] + b"X" + base[mid + 1 :],
+        "1 KiB inserted mid": base[:mid] + os.urandom(1024) + base[mid:],
+        "4 KiB deleted near start": base[:4096] + base[8192:],
+        "1 MiB appended": base + os.urandom(1 << 20),
+        "100 B prepended": os.urandom(100) + base,
+    }
+
+    start = time.perf_counter()
+    base_chunks = list(iter_chunks(io.BytesIO(base)))
+    secs = time.perf_counter() - start
+    assert b"".join(base_chunks) == base
+    known = {chunk_digest(c) for c in base_chunks}
+    known_fixed = {chunk_digest(c) for c in _fixed_chunks(base)}
+    sizes = [len(c) for c in base_chunks]
+    print(
+        f"{len(base) / 1e6:.0f} MB file: {len(base_chunks)} chunks "
+        f"(avg {sum(sizes) / len(sizes) / 1e6:.2f} MB, min {min(sizes) / 1e6:.2f}, "
+        f"max {max(sizes) / 1e6:.2f}), chunked at {len(base) / 1e6 / secs:.0f} MB/s"
+    )
+    print(
+        f"\n{'edit':26} {'whole file':>11} {'fixed 1 MiB':>12} "
+        f"{'content-defined':>16}"
+    )
+    for name, data in edits.items():
+        chunks = list(iter_chunks(io.BytesIO(data)))
+        assert b"".join(chunks) == data
+        cdc = sum(len(c) for c in chunks if chunk_digest(c) not in known)
+        fixed = sum(
+            len(c) for c in _fixed_chunks(data) if chunk_digest(c) not in known_fixed
+        )
+        print(
+            f"{name:26} {len(data) / 1e6:>9.1f}MB {fixed / 1e6:>10.1f}MB "
+            f"{cdc / 1e6:>14.1f}MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-defined chunking tools.")
+    parser.add_argument(
+        "--bench",
+        type=int,
+        nargs="?",
+        const=64,
+        metavar="MB",
+        help="Compare bytes uploaded per edit pattern on a synthetic file.",
+    )
+    parser.add_argument("files", nargs="*", help="Print the chunks of these files.")
+    args = parser.parse_args()
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+    if not args.files:
+        parser.error("give files to chunk, or --bench")
+    for path in args.files:
+        try:
+            for digest, data in chunk_file(path):
+                print(f"{path}\t{digest}\t{len(data)}")
+        except OSError as e:
+            print(f"Warning: cannot read {path}: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Content identity for media files, shared by the renamers (and backups).
+
+Duplicates are found in three rounds, each only for files still tied:
+equal size (no I/O), then a quick fingerprint of size + first and last
+FINGERPRINT_BYTES, then a full hash to confirm. Hashes are stored in SQLite
+keyed by path and reused while size and mtime are unchanged, so rescanning a
+library only reads new or modified files.
+
+    ./content_index.py [ROOT]   # print duplicate groups under ROOT
+"""
+import os
+import sys
+import sqlite3
+import hashlib
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from media_walk import walk_files
+
+CONTENT_DB = os.environ.get(
+    "CONTENT_INDEX_DB", str(Path.home() / ".cache" / "content_index.sqlite")
+)
+FINGERPRINT_BYTES = 1 << 20  # read from each end for the quick hash
+READ_BLOCK = 1 << 20
+HASH_WORKERS = 4  # files hashed concurrently (I/O bound)
+LOOKUP_BATCH = 500  # SQLite host-parameter budget per IN (...) query
+
+
+def quick_hash(path: str, size: int) -> str:
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            h.update(f.read(FINGERPRINT_BYTES))
+    return h.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while block := f.read(READ_BLOCK):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ContentIndex:
+    def __init__(self, path: str = CONTENT_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                quick TEXT,
+                full TEXT
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_full ON files (full)")
+        self.stats = {"files": 0, "quick": 0, "full": 0, "cached": 0}
+
+    def _load(self, paths: List[str]) -> Dict[str, tuple]:
+        rows = {}
+        for i in range(0, len(paths), LOOKUP_BATCH):
+            batch = paths[i : i + LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            for row in self.db.execute(
+                f"SELECT path, size, mtime_ns, quick, full FROM files "
+                f"WHERE path IN ({marks})",
+                batch,
+            ):
+                rows[row[0]] = row[1:]
+        return rows
+
+    def _hash_round(self, todo, fn, stat_key):
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            results = list(pool.map(lambda a: _try(fn, *a), todo))
+        self.stats[stat_key] += len(todo)
+        return results
+
+    def duplicates(self, files: Iterable[Tuple[str, int, int]]) -> List[List[str]]:
+        """
+        Groups (2+ paths, sorted) of files with identical content, given
+        (path, size, mtime_ns) for each candidate. Unreadable files are
+        left out.
+        """
+        by_size: Dict[int, List[Tuple[str, int]]] = defaultdict(list)
+        for path, size, mtime_ns in files:
+            self.stats["files"] += 1
+            by_size[size].append((path, mtime_ns))
+        tied = [(p, s, m) for s, ps in by_size.items() if len(ps) > 1 for p, m in ps]
+        if not tied:
+            return []
+
+        # Rows are keyed by absolute path so any caller's spelling/cwd hits.
+        keys = {p: os.path.abspath(p) for p, _, _ in tied}
+        known = self._load(list(keys.values()))
+        quick: Dict[str, Optional[str]] = {}
+        full: Dict[str, Optional[str]] = {}
+        todo = []
+        for path, size, mtime_ns in tied:
+            row = known.get(keys[path])
+            if row and row[0] == size and row[1] == mtime_ns and row[2]:
+                quick[path], full[path] = row[2], row[3]
+                self.stats["cached"] += 1
+            else:
+                todo.append((path, size))
+        for (path, _), digest in zip(todo, self._hash_round(todo, quick_hash, "quick")):
+            quick[path] = digest
+
+        by_quick: Dict[Tuple[int, str], List[str]] = defaultdict(list)
+        sizes = {p: s for p, s, _ in tied}
+        for path, digest in quick.items():
+            if digest:
+                by_quick[(sizes[path], digest)].append(path)
+
+        # Files that fit in the fingerprint were hashed whole already.
+        todo = [
+            (p,)
+            for (size, _), ps in by_quick.items()
+            if len(ps) > 1
+            for p in ps
+            if not full.get(p) and size > 2 * FINGERPRINT_BYTES
+        ]
+        for (path,), digest in zip(todo, self._hash_round(todo, full_hash, "full")):
+            full[path] = digest
+
+        groups = []
+        for (size, qd), ps in by_quick.items():
+            if len(ps) < 2:
+                continue
+            by_full = defaultdict(list)
+            for p in ps:
+                key = qd if size <= 2 * FINGERPRINT_BYTES else full.get(p)
+                if key:
+                    by_full[key].append(p)
+            groups.extend(sorted(g) for g in by_full.values() if len(g) > 1)
+
+        mtimes = {p: m for p, _, m in tied}
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, quick, full) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (keys[p], sizes[p], mtimes[p], quick[p], full.get(p))
+                    for p in quick
+                    if quick[p]
+                ],
+            )
+        return sorted(groups)
+
+    def duplicates_of_paths(self, paths: Iterable[str]) -> List[List[str]]:
+        """duplicates() for plain paths (one stat each)."""
+
+        def stat_all():
+            for p in paths:
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                yield p, st.st_size, st.st_mtime_ns
+
+        return self.duplicates(stat_all())
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"{s['files']} files, {s['quick']} fingerprinted, "
+            f"{s['full']} fully hashed, {s['cached']} from index"
+        )
+
+    def close(self):
+        self.db.close()
+
+
+def _try(fn, *args):
+    try:
+        return fn(*args)
+    except OSError as e:
+        print(f"Warning: cannot hash {args[0]}: {e}", file=sys.stderr)
+        return None
+
+
+def duplicate_map(groups: List[List[str]]) -> Dict[str, str]:
+    """{path: first path of its group} for every non-first group member."""
+    return {p: g[0] for g in groups for p in g[1:]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate files by content.")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument(
+        "--ext", action="append", help="Only files with this suffix (repeatable)."
+    )
+    args = parser.parse_args()
+
+    files = []
+    for entry in walk_files(args.root, args.ext):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        files.append((entry.path, st.st_size, st.st_mtime_ns))
+    index = ContentIndex()
+    try:
+        groups = index.duplicates(files)
+    finally:
+        index.close()
+    for g in groups:
+        print("\n".join(g) + "\n")
+    print(f"{len(groups)} duplicate groups ({index.summary()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Readability-style main-content pick in one pass over the tree.
+
+The keyword XPath in get_main_content matched every wrapper whose id or
+class mentions "content", "main", etc., then called text_content() on each
+inside max(). Every ancestor re-materializes the same text, so nested
+pages cost O(depth x size). score_tree() walks the tree once, bottom up,
+keeping per-subtree counts on a stack:
+- visible text length;
+- the part of it inside links;
+- content, meaning non-link text outside boilerplate (script/style, nav,
+  aside, footer, forms, and containers whose class or id reads like
+  navigation, comments or share widgets).
+main_content() then starts at <body> and steps into the child container
+holding most of the content while that child has at least DOMINANT of it,
+ending at the tightest element that still has nearly all of the page's
+prose.
+
+    ./content_score.py --bench [--corpus DIR]   # time and accuracy vs. the XPath pick
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lxml import etree, html
+
+MIN_CONTENT = 100  # characters; below this no element counts as main content
+DOMINANT = 0.75  # step into a child holding at least this share of the content
+CONTAINERS = frozenset(
+    {"body", "div", "main", "article", "section", "td", "blockquote", "center"}
+)
+SKIPPED = frozenset(
+    {"script", "style", "noscript", "template", "nav", "aside", "footer", "form",
+     "button", "select", "svg", "iframe", "head"}
+)  # fmt: skip
+UNLIKELY = re.compile(
+    r"nav|menu|footer|sidebar|breadcrumb|comment|share|social|related|promo|"
+    r"advert|cookie|popup|modal|subscribe|toc\b",
+    re.I,
+)
+LIKELY = re.compile(r"article|content|main|post|entry|question|answer|body", re.I)
+HINTED = frozenset({"div", "section", "ul", "ol", "table", "header"})
+
+
+class Counts(NamedTuple):
+    text: int  # visible characters in the subtree
+    links: int  # of which inside <a>
+    content: int  # non-link characters outside boilerplate
+
+    @property
+    def link_density(self) -> float:
+        return self.links / self.text if self.text else 0.0
+
+
+def _strip_len(s: Optional[str]) -> int:
+    return len(s.strip()) if s else 0
+
+
+def _boilerplate(el) -> bool:
+    if el.tag in SKIPPED:
+        return True
+    if el.tag in HINTED:
+        hint = f"{el.get('class', '')} {el.get('id', '')}"
+        return bool(UNLIKELY.search(hint)) and not LIKELY.search(hint)
+    return False
+
+
+def score_tree(root) -> Dict[object, Counts]:
+    """Counts for every container element under root, from a single walk."""
+    counts: Dict[object, Counts] = {}
+    # One [text, links, content] accumulator per open element.
+    stack: List[list] = [[0, 0, 0]]
+    walker = etree.iterwalk(root, events=("start", "end"))
+    for event, el in walker:
+        tag = el.tag
+        if event == "start":
+            if tag in SKIPPED:
+                walker.skip_subtree()
+                stack.append(None)
+                continue
+            n = _strip_len(el.text)
+            for child in el:
+                if not isinstance(child.tag, str):  # comments aren't walked
+                    n += _strip_len(child.tail)
+            stack.append([n, 0, n])
+            continue
+        acc = stack.pop()
+        parent = stack[-1]
+        tail = _strip_len(el.tail)
+        if parent is None:
+            continue
+        parent[0] += tail
+        parent[2] += tail
+        if acc is None:  # skipped subtree
+            continue
+        text, links, content = acc
+        if tag == "a":
+            links, content = text, 0
+        elif _boilerplate(el):
+            content = 0
+        if tag in CONTAINERS:
+            counts[el] = Counts(text, links, content)
+        parent[0] += text
+        parent[1] += links
+        parent[2] += content
+    return counts
+
+
+def main_content(tree) -> Tuple[Optional[object], Optional[Counts]]:
+    """(element, counts) of the main content, or (None, None) if too little."""
+    counts = score_tree(tree)
+    body = tree.find(".//body") if tree.tag != "body" else tree
+    node = body if body is not None else tree
+    best = counts.get(node)
+    if best is None or best.content < MIN_CONTENT:
+        return None, None
+    while True:
+        children = [(counts[c], c) for c in node if c in counts]
+        if not children:
+            break
+        child_counts, child = max(children, key=lambda pair: pair[0].content)
+        if child_counts.content < DOMINANT * best.content:
+            break
+        node, best = child, child_counts
+    return node, best
+
+
+def describe(el) -> str:
+    """A readable XPath-ish locator for log lines."""
+    return el.getroottree().getpath(el)
+
+
+# --- Benchmark ---
+
+
+def legacy_main_content(tree):
+    """The get_main_content() XPath cascade this module replaces."""
+
+    def text_len(el):
+        return len(el.text_content().strip())
+
+    for xpath in (
+        "//article",
+        "//div[@id='___gatsby']//article//div[contains(@class, 'Grid')]"
+        "//div[contains(@class, 'Cell')]",
+    ):
+        matches = tree.xpath(xpath)
+        if matches:
+            best = max(matches, key=text_len)
+            if text_len(best) > 100:
+                return best
+    keywords = ["article", "main", "body", "content", "maincontent"]
+    keywords += ["question", "answer", "forum"]
+    lower = "'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'"
+    conditions = []
+    for kw in keywords:
+        conditions.append(f"contains(translate(@id, {lower}), '{kw}')")
+        conditions.append(f"contains(translate(@class, {lower}), '{kw}')")
+    matches = tree.xpath("//*[" + " or ".join(conditions) + "]")
+    if matches:
+        best = max(matches, key=text_len)
+        if text_len(best) > 100:
+            return best
+    body = tree.xpath("//body")
+    return body[0] if body else None
+
+
+def _words(el) -> Counter:
+    if el is None:
+        return Counter()
+    el = html.fromstring(html.tostring(el))
+    etree.strip_elements(el, "script", "style", with_tail=False)
+    return Counter(el.text_content().split())
+
+
+def overlap_f1(picked, gold) -> float:
+    """Word-level F1 between the picked element's text and the gold element's."""
+    got, want = _words(picked), _words(gold)
+    common = sum((got & want).values())
+    if not common:
+        return 0.0
+    precision = common / sum(got.values())
+    recall = common / sum(want.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def _prose(rng, words, sentences):
+    return " ".join(
+        " ".join(rng.choices(words, k=rng.randint(8, 20))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def _links(rng, words, n, cls=""):
+    items = "".join(
+        f'<li><a href="/{w}">{w.title()} {rng.choice(words)}</a></li>'
+        for w in rng.choices(words, k=n)
+    )
+    return f'<ul class="{cls}">{items}</ul>'
+
+
+def synthetic_corpus(count: int) -> List[Tuple[str, str]]:
+    """(kind, page) pairs; the expected main element carries data-gold."""
+    rng = random.Random(23)
+    words = [
+        "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9)))
+        for _ in range(2000)
+    ]
+
+    def paras(n):
+        return "".join(
+            f"<p>{_prose(rng, words, rng.randint(2, 6))}</p>" for _ in range(n)
+        )
+
+    def docs():
+        sections = "".join(
+            f"<section><h2>{_prose(rng, words, 1)}</h2>{paras(3)}"
+            f"<pre><code>{_prose(rng, words, 2)}</code></pre>"
+            f"{_links(rng, words, 4)}</section>"
+            for _ in range(rng.randint(3, 8))
+        )
+        return (
+            f'<header><div class="navbar">{_links(rng, words, 30)}</div></header>'
+            f'<div class="layout"><div class="sidebar-toc">{_links(rng, words, 60)}'
+            f'</div><main><article data-gold="1"><h1>Title</h1>{sections}</article>'
+            f'<div class="page-nav">{_links(rng, words, 2)}</div></main></div>'
+            f"<footer>{_links(rng, words, 20)}</footer>"
+        )
+
+    def blog():
+        comments = "".join(
+            f'<div class="comment"><div class="comment-body">{paras(2)}</div></div>'
+            for _ in range(rng.randint(3, 12))
+        )
+        return (
+            f'<div id="wrapper"><div class="top-menu">{_links(rng, words, 15)}</div>'
+            f'<div class="post-content" data-gold="1"><h1>Post</h1>{paras(12)}</div>'
+            f'<div id="comments">{comments}</div>'
+            f'<aside class="related">{paras(3)}</aside></div>'
+        )
+
+    def forum():
+        answers = "".join(
+            f'<div class="ResponseDetail_container">{paras(2)}'
+            f'<span class="votes">{rng.randint(0, 99)}</span></div>'
+            for _ in range(rng.randint(1, 6))
+        )
+        return (
+            f'<div class="site-menu">{_links(rng, words, 25)}</div>'
+            f'<div id="qa" data-gold="1"><div class="QuestionDetail_banner">'
+            f"<h1>Question</h1>{paras(2)}</div><div class=\"answers\">{answers}</div>"
+            f'</div><div class="related-questions">{_links(rng, words, 10)}</div>'
+        )
+
+    def gatsby():
+        return (
+            f'<div id="___gatsby"><div><header>{_links(rng, words, 20)}</header>'
+            f'<article><div class="Grid"><div class="Cell">{_links(rng, words, 40)}'
+            f'</div><div class="Cell" data-gold="1"><h1>Guide</h1>{paras(10)}</div>'
+            f"</div></article></div></div>"
+        )
+
+    def deep():
+        depth = rng.randint(40, 200)  # libxml2 stops nesting at 256 levels
+        opening = "".join(
+            f'<div class="content-wrap level-{i}">' for i in range(depth)
+        )
+        return (
+            f'<div class="header-links">{_links(rng, words, 20)}</div>'
+            f'{opening}<div class="text" data-gold="1">{paras(15)}</div>'
+            + "</div>" * depth
+        )
+
+    def tables():
+        return (
+            f'<table width="100%"><tr><td class="menu">{_links(rng, words, 30)}</td>'
+            f'<td data-gold="1"><h1>Page</h1>{paras(8)}</td></tr></table>'
+        )
+
+    kinds = [docs, blog, forum, gatsby, deep, tables]
+    pages = []
+    for i in range(count):
+        make = kinds[i % len(kinds)]
+        head = f"<head><title>p{i}</title></head>"
+        pages.append((make.__name__, f"<html>{head}<body>{make()}</body></html>"))
+    return pages
+
+
+def load_corpus(directory: str) -> List[Tuple[str, str]]:
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "rb") as f:
+                pages.append((name, f.read().decode("utf-8", errors="replace")))
+    return pages
+
+
+def run_benchmark(pages: List[Tuple[str, str]], repeat: int):
+    rows: Dict[str, list] = {}
+    for kind, page in pages:
+        tree = html.fromstring(page)
+        gold = tree.xpath("//*[@data-gold]")
+        gold = gold[0] if gold else None
+        timings = []
+        picks = []
+        for pick in (legacy_main_content, lambda t: main_content(t)[0]):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                el = pick(tree)
+            timings.append((time.perf_counter() - start) / repeat)
+            picks.append(el)
+        f1 = [overlap_f1(el, gold) if gold is not None else None for el in picks]
+        row = rows.setdefault(kind, [0, 0.0, 0.0, 0.0, 0.0, 0])
+        row[0] += 1
+        row[1] += timings[0]
+        row[2] += timings[1]
+        if gold is not None:
+            row[3] += f1[0]
+            row[4] += f1[1]
+            row[5] += 1
+        elif picks[0] is not picks[1]:
+            print(
+                f"{kind}: XPath picked {describe(picks[0])}, "
+                f"scorer {describe(picks[1]) if picks[1] is not None else None}"
+            )
+
+    print(
+        f"{'pages':14} {'n':>4} {'XPath ms':>9} {'scorer ms':>10} "
+        f"{'XPath F1':>9} {'scorer F1':>10}"
+    )
+    total = [0, 0.0, 0.0, 0.0, 0.0, 0]
+    for kind, row in rows.items():
+        total = [a + b for a, b in zip(total, row)]
+        _print_row(kind, row)
+    if len(rows) > 1:
+        _print_row("all", total)
+
+
+def _print_row(label, row):
+    n, legacy, scored, legacy_f1, scored_f1, graded = row
+    f1 = (
+        f"{legacy_f1 / graded:>9.2f} {scored_f1 / graded:>10.2f}"
+        if graded
+        else f"{'-':>9} {'-':>10}"
+    )
+    print(
+        f"{label[:14]:14} {n:>4} {1000 * legacy / n:>9.2f} "
+        f"{1000 * scored / n:>10.2f} {f1}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Main-content scoring tools.")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument(
+        "--corpus",
+        metavar="DIR",
+        help="Saved .html pages (mark the expected element with data-gold).",
+    )
+    parser.add_argument("--pages", type=int, default=60, help="Synthetic page count.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not args.bench:
+        parser.error("nothing to do (try --bench)")
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.pages)
+    if not pages:
+        sys.exit(f"no .html files in {args.corpus}")
+    run_benchmark(pages, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
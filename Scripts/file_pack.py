@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Packs small files into compressed segments for backup_home_b2.
+
+Tens of thousands of tiny files cost one request each when uploaded one by
+one. The Packer appends them to a segment instead, each member compressed on
+its own (zstd if the zstandard package is installed, zlib otherwise) or
+stored as-is when its format is already compressed or compression doesn't
+pay. Restoring one file is then a ranged read of [offset, offset + length)
+from its segment plus one decompress. Each segment carries a JSON index of
+its members so the bucket stays restorable without the local state.
+
+Segments are write-once. A file that changes is packed again into a new
+segment and the state points at the new copy, but the old bytes stay in
+their segment: space held by superseded members is not reclaimed, so a
+bucket backing up often-edited small files grows until it is re-uploaded
+from scratch.
+
+    ./file_pack.py --bench [DIR]   # requests and bytes vs one upload per file
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from media_walk import walk_files
+
+PACK_FILE_MAX = 1 << 20  # files smaller than this are packed
+SEGMENT_SIZE = 64 << 20  # close a segment once it holds this much
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+STORED_SUFFIXES = frozenset(
+    {
+        # images, audio, video
+        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+        ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+        ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+        # archives and zip-based documents
+        ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar",
+        ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".epub", ".jar", ".apk",
+        ".pdf",
+    }
+)  # fmt: skip
+
+
+def compress(data: bytes, suffix: str) -> Tuple[str, bytes]:
+    """(codec, payload) for one member."""
+    if suffix.lower() in STORED_SUFFIXES:
+        return "store", data
+    if zstandard is not None:
+        codec = "zstd"
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        codec, payload = "zlib", zlib.compress(data, ZLIB_LEVEL)
+    if len(payload) >= len(data):
+        return "store", data
+    return codec, payload
+
+
+def decompress(codec: str, payload: bytes) -> bytes:
+    if codec == "store":
+        return payload
+    if codec == "zlib":
+        return zlib.decompress(payload)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("this member is zstd-compressed: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+class Segment:
+    def __init__(self):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.data = bytearray()
+        # (path, state key, stat, offset, length, codec) per member
+        self.members: List[tuple] = []
+        self.raw_bytes = 0
+
+    def add(
+        self, path: str, stat: os.stat_result, data: bytes, key: Optional[str] = None
+    ):
+        codec, payload = compress(data, os.path.splitext(path)[1])
+        member = (path, key or path, stat, len(self.data), len(payload), codec)
+        self.members.append(member)
+        self.data += payload
+        self.raw_bytes += len(data)
+
+    def index_json(self) -> bytes:
+        return json.dumps(
+            {
+                "segment": self.id,
+                "members": [
+                    {
+                        "path": path,
+                        "offset": offset,
+                        "length": length,
+                        "codec": codec,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                    }
+                    for path, _, stat, offset, length, codec in self.members
+                ],
+            },
+            ensure_ascii=False,
+        ).encode("utf-8", "surrogateescape")
+
+
+class Packer:
+    """Collects small files; add() and flush() hand back segments ready to upload."""
+
+    def __init__(self, segment_size: int = SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.segment = Segment()
+
+    def add(
+        self, path: str, stat: os.stat_result, key: Optional[str] = None
+    ) -> Optional[Segment]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Warning: cannot pack {path}: {e}", file=sys.stderr)
+            return None
+        self.segment.add(path, stat, data, key)
+        if len(self.segment.data) >= self.segment_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Segment]:
+        """The current segment if it has members, and start a new one."""
+        full, self.segment = self.segment, Segment()
+        return full if full.members else None
+
+
+def _synthetic_home(root: Path, files: int):
+    """Notes, code, configs and photos in the proportions of a Documents tree."""
+    rng = random.Random(7)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = [
+        "".join(rng.choices(letters, k=rng.randint(2, 9))) for _ in range(3000)
+    ]
+    for i in range(files):
+        d = root / f"dir{i % 97}" / f"sub{i % 7}"
+        d.mkdir(parents=True, exist_ok=True)
+        kind = rng.random()
+        if kind < 0.5:
+            text = " ".join(rng.choices(words, k=rng.randint(50, 3000)))
+            (d / f"note{i}.md").write_text(text)
+        elif kind < 0.75:
+            rows = [
+                {"id": j, "name": rng.choice(words), "v": rng.random()}
+                for j in range(rng.randint(5, 400))
+            ]
+            (d / f"data{i}.json").write_text(json.dumps(rows, indent=2))
+        elif kind < 0.95:
+            lines = [
+                f"    x_{j} = compute({rng.choice(words)!r}, {j})"
+                for j in range(rng.randint(10, 600))
+            ]
+            (d / f"mod{i}.py").write_text("def f():\n" + "\n".join(lines) + "\n")
+        else:
+            size = rng.randint(20_000, 400_000)
+            (d / f"photo{i}.jpg").write_bytes(rng.randbytes(size))
+
+
+def run_benchmark(root: Optional[str], files: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        if root is None:
+            root = tmp
+            _synthetic_home(Path(tmp), files)
+        entries = []
+        for entry in walk_files(root):
+            try:
+                entries.append((entry.path, entry.stat()))
+            except OSError:
+                continue
+
+        start = time.perf_counter()
+        packer = Packer()
+        segments, unpacked = [], []
+        for path, stat in entries:
+            if stat.st_size >= PACK_FILE_MAX:
+                unpacked.append(stat.st_size)
+                continue
+            segment = packer.add(path, stat)
+            if segment:
+                segments.append(segment)
+        if segment := packer.flush():
+            segments.append(segment)
+        secs = time.perf_counter() - start
+
+    raw = sum(stat.st_size for _, stat in entries)
+    packed = sum(len(s.data) + len(s.index_json()) for s in segments) + sum(unpacked)
+    requests = 2 * len(segments) + len(unpacked)
+    members = sum(len(s.members) for s in segments)
+    codec = "zstd" if zstandard is not None else "zlib"
+    print(f"{len(entries)} files, {raw / 1e6:.1f} MB ({members} packed, {codec})")
+    print(f"{'':12} {'requests':>9} {'bytes':>11}")
+    print(f"{'per file':12} {len(entries):>9} {raw / 1e6:>9.1f}MB")
+    print(f"{'packed':12} {requests:>9} {packed / 1e6:>9.1f}MB")
+    print(
+        f"{len(entries) / max(requests, 1):.0f}x fewer requests, "
+        f"{100 * (1 - packed / max(raw, 1)):.0f}% fewer bytes; packed in {secs:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Small-file packing tools.")
+    parser.add_argument(
+        "--bench",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="Compare packing with per-file uploads on DIR (default: synthetic).",
+    )
+    parser.add_argument(
+        "--files", type=int, default=10000, help="Synthetic file count."
+    )
+    args = parser.parse_args()
+    if args.bench is None:
+        parser.error("nothing to do (try --bench)")
+    run_benchmark(args.bench or None, args.files)
+
+
+if __name__ == "__main__":
+    main()
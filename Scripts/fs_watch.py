@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Recursive inotify watcher with debouncing (Linux, no dependencies).
+
+Every directory under the roots gets an inotify watch (pruned with the same
+skip globs as media_walk). File writes, moves in and new directories queue
+the affected paths; a path is handed out only once it has been quiet for
+`debounce` seconds, so a file being written in many chunks is reported once.
+Waiting blocks in poll(), so an idle watcher uses no CPU.
+
+If the kernel queue overflows or a watch can't be added (fs.inotify.
+max_user_watches), `needs_rescan` is set and the caller should fall back to
+a full scan. Running out of watches also sets `unwatched`, which stays set:
+changes in the directories left out are never reported, so the caller
+should keep scanning at its polling interval.
+
+    ./fs_watch.py DIR [DIR ...]   # print debounced changes
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import argparse
+from typing import Dict, Iterable, List, Optional
+
+from media_walk import DEFAULT_SKIP_DIRS, compile_globs
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is Linux-only")
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+    return _libc
+
+
+class TreeWatcher:
+    def __init__(
+        self,
+        roots: Iterable[str],
+        skip_dirs: Iterable[str] = DEFAULT_SKIP_DIRS,
+        debounce: float = 2.0,
+    ):
+        self.libc = _inotify()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.skip = compile_globs(skip_dirs)
+        self.debounce = debounce
+        self.dirs: Dict[int, str] = {}  # wd -> directory path
+        self.pending: Dict[str, float] = {}  # path -> last event (monotonic)
+        self.needs_rescan = False
+        self.unwatched = False  # some directories have no watch (ENOSPC)
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+        for root in roots:
+            self.add_tree(os.path.abspath(root))
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def _add_watch(self, d: str) -> bool:
+        mask = WATCH_MASK | IN_ONLYDIR
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                if not self.unwatched:
+                    print(
+                        "Warning: inotify watch limit reached "
+                        "(raise fs.inotify.max_user_watches); falling back to scans.",
+                        file=sys.stderr,
+                    )
+                self.unwatched = True
+                self.needs_rescan = True
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                msg = os.strerror(err)
+                print(f"Warning: cannot watch {d}: {msg}", file=sys.stderr)
+            return False
+        self.dirs[wd] = d
+        return True
+
+    def add_tree(self, root: str, queue_files: bool = False):
+        """
+        Watch root and every directory below it. With queue_files, files
+        already inside are queued too (a directory moved or created with
+        content before its watch existed).
+        """
+        stack = [root]
+        now = time.monotonic()
+        while stack:
+            d = stack.pop()
+            if not self._add_watch(d):
+                continue
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not (self.skip and self.skip.match(entry.name)):
+                                    stack.append(entry.path)
+                            elif queue_files and entry.is_file():
+                                self.pending[entry.path] = now
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _read_events(self):
+        while True:
+            try:
+                buf = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            now = time.monotonic()
+            off = 0
+            while off < len(buf):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buf, off)
+                off += EVENT_HEADER.size
+                name = os.fsdecode(buf[off : off + length].rstrip(b"\0"))
+                off += length
+                if mask & IN_Q_OVERFLOW:
+                    self.needs_rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                d = self.dirs.get(wd)
+                if d is None or not name:
+                    continue
+                path = os.path.join(d, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and (
+                        self.skip is None or not self.skip.match(name)
+                    ):
+                        self.add_tree(path, queue_files=True)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.pending[path] = now
+
+    def wait(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Block until at least one path has been quiet for `debounce` seconds
+        or `timeout` (seconds, None = forever) passes, and return the ready
+        paths. Returns early with whatever is ready if needs_rescan is set.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            ready = [p for p, t in self.pending.items() if now - t >= self.debounce]
+            if ready or self.needs_rescan:
+                for p in ready:
+                    del self.pending[p]
+                return ready
+            waits = []
+            if self.pending:
+                waits.append(min(self.pending.values()) + self.debounce - now)
+            if deadline is not None:
+                if now >= deadline:
+                    return []
+                waits.append(deadline - now)
+            ms = None if not waits else max(0, int(min(waits) * 1000) + 1)
+            if self.poller.poll(ms):
+                self._read_events()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print debounced file changes.")
+    parser.add_argument("roots", nargs="+")
+    parser.add_argument("--debounce", type=float, default=2.0)
+    args = parser.parse_args()
+
+    w = TreeWatcher(args.roots, debounce=args.debounce)
+    print(f"Watching {len(w.dirs)} directories.", flush=True)
+    try:
+        while True:
+            for p in w.wait():
+                print(p, flush=True)
+            if w.needs_rescan:
+                print("(event queue overflowed; a full rescan is needed)", flush=True)
+                w.needs_rescan = False
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+
+
+if __name__ == "__main__":
+    main()
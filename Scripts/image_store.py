@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Downloads the images a page references, once each, for the markdown scrapers.
+
+ImageStore fans the <img> URLs of a page out to a thread pool sharing one
+keep-alive session. Each body is streamed to a temporary file while it is
+hashed, then renamed to <blake2b digest><ext>, so two different images
+called logo.png no longer overwrite each other and the same image under
+two URLs is stored once. A URL is fetched at most once per store: pages
+of a crawl that reference it wait on the same download.
+
+    ./image_store.py --bench [PAGES]   # serial requests.get vs the store
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from tiered_fetch import new_session
+
+IMAGES_DIR = "images"
+IMAGE_WORKERS = 8
+IMAGE_TIMEOUT = 30
+READ_CHUNK = 64 << 10
+IMAGE_SUFFIXES = frozenset(
+    {".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".avif", ".bmp", ".ico"}
+)
+
+
+def _suffix(url: str, content_type: str) -> str:
+    suffix = os.path.splitext(urlparse(url).path)[1].lower()
+    if suffix in IMAGE_SUFFIXES:
+        return suffix
+    guessed = mimetypes.guess_extension(content_type.split(";")[0].strip())
+    return guessed or ""
+
+
+class ImageStore:
+    def __init__(self, images_dir: str = IMAGES_DIR, workers: int = IMAGE_WORKERS):
+        self.images_dir = images_dir
+        self.session = new_session(workers)
+        self.executor = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.downloads: Dict[str, Future] = {}
+        self.stats = {"fetched": 0, "reused": 0, "duplicates": 0, "failed": 0}
+
+    def _download(self, img_url: str) -> Optional[str]:
+        """Stream img_url to disk; the stored file name, or None on failure."""
+        try:
+            with self.session.get(img_url, stream=True, timeout=IMAGE_TIMEOUT) as r:
+                if r.status_code != 200:
+                    status = r.status_code
+                    print(f"Failed to download image {img_url} (status {status})")
+                    self._count("failed")
+                    return None
+                digest = hashlib.blake2b(digest_size=16)
+                fd, tmp = tempfile.mkstemp(dir=self.images_dir, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        for block in r.iter_content(READ_CHUNK):
+                            digest.update(block)
+                            f.write(block)
+                    name = digest.hexdigest() + _suffix(
+                        img_url, r.headers.get("Content-Type", "")
+                    )
+                    path = os.path.join(self.images_dir, name)
+                    if os.path.exists(path):
+                        os.remove(tmp)
+                        self._count("duplicates")
+                    else:
+                        os.replace(tmp, path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+        except (requests.RequestException, OSError) as e:
+            print(f"Error downloading image {img_url}: {e}")
+            self._count("failed")
+            return None
+        print(f"Downloaded image: {name}")
+        return name
+
+    def _count(self, stat: str):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def fetch(self, img_url: str) -> Future:
+        """Future of the stored name for img_url, shared by every caller."""
+        with self.lock:
+            future = self.downloads.get(img_url)
+            if future is None:
+                future = self.downloads[img_url] = self.executor.submit(
+                    self._download, img_url
+                )
+                self.stats["fetched"] += 1
+            else:
+                self.stats["reused"] += 1
+        return future
+
+    def localize(self, element, page_url: str):
+        """
+        Download every <img> under element and point its src at the local
+        copy. Images that fail keep an absolute URL.
+        """
+        os.makedirs(self.images_dir, exist_ok=True)
+        pending = []
+        for img in element.iter("img"):
+            src = img.get("src")
+            if not src or src.startswith("data:"):
+                continue
+            img_url = urljoin(page_url, src)
+            pending.append((img, img_url, self.fetch(img_url)))
+        for img, img_url, future in pending:
+            name = future.result()
+            if name is None:
+                img.set("src", img_url)
+            else:
+                img.set("src", f"./{self.images_dir}/{name}")
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+_default_store: Optional[ImageStore] = None
+_default_lock = threading.Lock()
+
+
+def localize_images(element, page_url: str):
+    """ImageStore.localize() on a process-wide store, so a crawl shares it."""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ImageStore()
+    _default_store.localize(element, page_url)
+
+
+def _serial_download(element, page_url: str, images_dir: str):
+    """The scrapers' original loop, for comparison."""
+    for img in element.iter("img"):
+        src = img.get("src")
+        if not src:
+            continue
+        img_url = urljoin(page_url, src)
+        filename = os.path.basename(urlparse(img_url).path)
+        local_path = os.path.join(images_dir, filename)
+        if not os.path.exists(local_path):
+            try:
+                img_response = requests.get(img_url)
+                if img_response.status_code == 200:
+                    with open(local_path, "wb") as f:
+                        f.write(img_response.content)
+            except Exception as e:
+                print(f"Error downloading image {img_url}: {e}")
+        img.set("src", f"./images/{filename}")
+
+
+def run_benchmark(pages: int, per_page: int, distinct: int, delay: float):
+    """
+    Pages that each show per_page of `distinct` images, from a local server
+    with `delay` latency. Half the images share a file name with another
+    image in a different directory, as icons and screenshots often do.
+    """
+    import io
+    import random
+    from contextlib import redirect_stdout
+    from lxml import html
+    from browser_pool import serve_static
+
+    rng = random.Random(25)
+    with tempfile.TemporaryDirectory() as root:
+        site = os.path.join(root, "site")
+        for i in range(distinct):
+            d = os.path.join(site, f"section{i % 2}")
+            os.makedirs(d, exist_ok=True)
+            with open(os.path.join(d, f"figure{i // 2}.png"), "wb") as f:
+                f.write(rng.randbytes(rng.randint(20_000, 200_000)))
+        server, base = serve_static(site, delay=delay)
+        page_html = [
+            "<div>"
+            + "".join(
+                f'<img src="/section{i % 2}/figure{i // 2}.png">'
+                for i in rng.sample(range(distinct), per_page)
+            )
+            + "</div>"
+            for _ in range(pages)
+        ]
+        try:
+            for label in ("serial", "store"):
+                out = os.path.join(root, label)
+                os.makedirs(out)
+                store = ImageStore(out) if label == "store" else None
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    for i, markup in enumerate(page_html):
+                        element = html.fromstring(markup)
+                        url = f"{base}page{i}.html"
+                        if store is None:
+                            _serial_download(element, url, out)
+                        else:
+                            store.localize(element, url)
+                secs = time.perf_counter() - start
+                files = len(os.listdir(out))
+                print(
+                    f"{label:7} {secs:6.2f}s  {files:4} files for {distinct} distinct "
+                    f"images ({pages} pages x {per_page})"
+                )
+                if store is not None:
+                    print(f"        {store.stats}")
+                    store.close()
+        finally:
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image download tools.")
+    parser.add_argument("--bench", type=int, nargs="?", const=20, metavar="PAGES")
+    parser.add_argument("--per-page", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.05, help="Server latency.")
+    args = parser.parse_args()
+    if not args.bench:
+        parser.error("nothing to do (try --bench)")
+    if args.per_page > args.distinct:
+        sys.exit("--per-page cannot exceed --distinct")
+    run_benchmark(args.bench, args.per_page, args.distinct, args.delay)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""
+Token-budgeted, concurrent batching for "map these basenames" LLM calls.
+
+Names are packed into chunks that fit LLM_CHUNK_TOKENS, chunks run on a
+bounded thread pool, transient HTTP errors (429/5xx/timeouts) are retried
+with backoff, and a chunk the model can't answer (unparseable JSON, a 400/413
+context overflow) is bisected until the offending names are isolated.
+Partial results from every chunk are merged. Any other refusal (bad key,
+unknown model, wrong URL) would refuse every chunk alike, so it stops the
+run with FatalError instead.
+
+Requests go to any OpenAI-compatible /chat/completions endpoint over a
+shared keep-alive connection pool (HTTPPool) with a streamed, chunked request
+body and socket timeouts. A stub server of that shape is included for
+benchmarking and end-to-end runs:
+
+    ./llm_batch.py --serve 8765        # then point OPENROUTER_BASE_URL at
+                                       # http://127.0.0.1:8765/v1
+    ./llm_batch.py --bench 5000        # single request vs batched, on the stub
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LLM_CHUNK_TOKENS = 3000  # estimated prompt + completion tokens per request
+LLM_CONCURRENCY = 4  # requests in flight
+LLM_MAX_RETRIES = 3  # per chunk, for transient errors only
+LLM_TIMEOUT = 120  # seconds per connect / socket read
+POOL_MAXSIZE = 16  # idle keep-alive connections kept per host
+BODY_BUFFER = 64 * 1024  # bytes per chunk of a streamed request body
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# A 400 whose error mentions these, or any 413, means the prompt was too long.
+OVERFLOW_RE = re.compile(
+    r"context|too long|too large|too many tokens|maximum.{0,40}tokens", re.I
+)
+
+FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.I)
+
+
+class BadResponse(Exception):
+    """The request went through but the answer is unusable; bisect, don't retry."""
+
+
+class TransientError(Exception):
+    """Worth retrying as-is (rate limit, 5xx, network)."""
+
+
+class FatalError(Exception):
+    """Every request would fail the same way (auth, model, URL); stop the run."""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars/token for Latin text; only used to size chunks.
+    return len(text) // 4 + 1
+
+
+def name_cost(name: str) -> int:
+    # JSON-quoted name in the prompt plus ~twice that in an {old: new} reply.
+    return 3 * estimate_tokens(json.dumps(name)) + 2
+
+
+def chunk_by_tokens(
+    names: List[str],
+    budget: int = LLM_CHUNK_TOKENS,
+    overhead: int = 0,
+    cost: Callable[[str], int] = name_cost,
+) -> List[List[str]]:
+    """
+    Greedy packing in input order so each chunk's overhead + sum(cost) stays
+    within budget. A single name over budget still gets a chunk of its own.
+    """
+    chunks, cur, used = [], [], overhead
+    for name in names:
+        cost_ = cost(name)
+        if cur and used + cost_ > budget:
+            chunks.append(cur)
+            cur, used = [], overhead
+        cur.append(name)
+        used += cost_
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def parse_mapping(content: Optional[str]) -> Dict[str, str]:
+    """Model output -> dict, tolerating ```json fences. Raises BadResponse."""
+    try:
+        mapping = json.loads(FENCE_RE.sub("", content or ""))
+    except ValueError as e:
+        raise BadResponse(f"invalid JSON: {e}") from None
+    if not isinstance(mapping, dict):
+        raise BadResponse(f"expected object, got {type(mapping).__name__}")
+    return mapping
+
+
+def _buffered(pieces: Iterable[str], size: int = BODY_BUFFER) -> Iterator[bytes]:
+    buf, n = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        n += len(piece)
+        if n >= size:
+            yield "".join(buf).encode("utf-8")
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+class HTTPPool:
+    """
+    Thread-safe keep-alive connections per (scheme, host, port). A request
+    takes an idle connection or opens one, and gives it back afterwards
+    unless the server asked to close. A request that fails on a reused
+    connection (server dropped it while idle) is retried once on a new one.
+    """
+
+    def __init__(self, maxsize: int = POOL_MAXSIZE, timeout: float = LLM_TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return cls(host, port, timeout=self.timeout), False
+
+    def _put(self, key, conn):
+        with self._lock:
+            if len(self._idle[key]) < self.maxsize:
+                self._idle[key].append(conn)
+                return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[Callable[[], Iterable[bytes]]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bytes]:
+        """
+        Send a request and read the whole response. body is a factory for
+        an iterable of byte chunks (sent with chunked transfer encoding),
+        called again if the request has to be retried.
+        """
+        u = urllib.parse.urlsplit(url)
+        key = (u.scheme, u.hostname, u.port or (443 if u.scheme == "https" else 80))
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        for attempt in (0, 1):
+            conn, reused = self._get(key)
+            try:
+                conn.request(
+                    method,
+                    path,
+                    body=body() if body else None,
+                    headers=headers or {},
+                    encode_chunked=body is not None,
+                )
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+            return resp.status, data
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+POOL = HTTPPool()
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def chat_completion(
+    base_url: str,
+    api_key: str,
+    payload: dict,
+    headers: Optional[Dict[str, str]] = None,
+    pool: HTTPPool = POOL,
+) -> dict:
+    """POST {base_url}/chat/completions and return the decoded response."""
+    try:
+        status, data = pool.request(
+            "POST",
+            base_url.rstrip("/") + "/chat/completions",
+            body=lambda: _buffered(_ENCODER.iterencode(payload)),
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Authorization": f"Bearer {api_key}",
+                **(headers or {}),
+            },
+        )
+    except (OSError, http.client.HTTPException) as e:
+        # Covers refused/reset connections and socket timeouts.
+        raise TransientError(f"{type(e).__name__}: {e}") from None
+    if status >= 400:
+        text = data[:2000].decode("utf-8", "replace")
+        detail = text[:200]
+        if status in RETRY_STATUSES:
+            raise TransientError(f"HTTP {status}: {detail}")
+        if status == 413 or (status == 400 and OVERFLOW_RE.search(text)):
+            raise BadResponse(f"HTTP {status}: {detail}")
+        raise FatalError(f"HTTP {status}: {detail}")
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        raise BadResponse(f"non-JSON body: {e}") from None
+
+
+class BatchStats:
+    def __init__(self, names: int):
+        self.names = names
+        self.resolved = 0
+        self.requests = 0
+        self.retries = 0
+        self.bisections = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.failed: List[str] = []
+        self.errors: List[str] = []
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_usage(self, usage: Optional[dict]):
+        usage = usage or {}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage.get("completion_tokens") or 0
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def summary(self) -> str:
+        rate = self.names / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{self.resolved}/{self.names} names in {self.elapsed:.2f}s "
+            f"({rate:.0f} names/s), {self.requests} requests, "
+            f"{self.retries} retries, {self.bisections} bisections, "
+            f"{self.tokens} tokens ({self.prompt_tokens} prompt + "
+            f"{self.completion_tokens} completion)"
+        )
+
+
+# A request function sends one chunk and returns (content, usage).
+RequestFn = Callable[[List[str]], Tuple[str, Optional[dict]]]
+
+
+def run_batches(
+    names: List[str],
+    request_fn: RequestFn,
+    budget: int = LLM_CHUNK_TOKENS,
+    overhead: int = 0,
+    concurrency: int = LLM_CONCURRENCY,
+    max_retries: int = LLM_MAX_RETRIES,
+    backoff: float = 1.0,
+    cost: Callable[[str], int] = name_cost,
+    parse: Callable[[Optional[str]], Dict[str, str]] = parse_mapping,
+) -> Tuple[Dict[str, str], BatchStats]:
+    """
+    Resolve names through request_fn in token-budgeted chunks. parse turns
+    a reply into {name: result} (raising BadResponse if it can't). Returns
+    the merged results for every name the model answered (keys outside the
+    chunk are ignored) and stats; names that could not be answered are in
+    stats.failed. A FatalError from request_fn cancels the chunks not yet
+    sent and is raised to the caller.
+    """
+    names = list(dict.fromkeys(names))
+    stats = BatchStats(len(names))
+    merged: Dict[str, str] = {}
+    t0 = time.perf_counter()
+
+    def attempt(chunk: List[str]) -> Dict[str, str]:
+        for i in range(max_retries + 1):
+            try:
+                content, usage = request_fn(chunk)
+                stats.add_usage(usage)
+                return parse(content)
+            except TransientError:
+                if i == max_retries:
+                    raise
+                with stats._lock:
+                    stats.retries += 1
+                time.sleep(backoff * 2**i * (0.5 + random.random()))
+
+    # The pool size bounds requests in flight; bisected halves are resubmitted
+    # to the same pool so they queue behind the original chunks.
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        pending = {
+            pool.submit(attempt, c): c
+            for c in chunk_by_tokens(names, budget, overhead, cost)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                chunk = pending.pop(fut)
+                try:
+                    mapping = fut.result()
+                except FatalError:
+                    for queued in pending:
+                        queued.cancel()
+                    raise
+                except BadResponse as e:
+                    if len(chunk) > 1:
+                        stats.bisections += 1
+                        mid = len(chunk) // 2
+                        for half in (chunk[:mid], chunk[mid:]):
+                            pending[pool.submit(attempt, half)] = half
+                        continue
+                    stats.failed.extend(chunk)
+                    stats.errors.append(f"{chunk[0]}: {e}")
+                    continue
+                except Exception as e:
+                    stats.failed.extend(chunk)
+                    stats.errors.append(f"chunk of {len(chunk)} failed: {e}")
+                    continue
+                for name in chunk:
+                    new = mapping.get(name)
+                    if isinstance(new, str) and new:
+                        merged[name] = new
+    stats.resolved = len(merged)
+    stats.elapsed = time.perf_counter() - t0
+    return merged, stats
+
+
+# Stub OpenAI-compatible server
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /v1/chat/completions that answers {"basenames": [...]} prompts with
+    {name: "STUB " + name}, and show_renamer's {"items": [...]} prompts with
+    {"mappings": [{"old", "new": proposed}]}. Knobs (attributes on the
+    server): context_tokens (400 above it), fail_rate (random 503s), latency
+    per request, and names containing "POISON" make the reply invalid JSON.
+    Accepts chunked request bodies and counts connections to show reuse.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; don't let Nagle hold the
+    # body back for the client's delayed ACK on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _read_body(self) -> bytes:
+        if "chunked" not in (self.headers.get("Transfer-Encoding") or "").lower():
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        parts = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+            if not size:
+                # Trailer section ends with an empty line.
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(parts)
+            parts.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        srv = self.server
+        body = self._read_body()
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._reply(404, {"error": {"message": "not found"}})
+        try:
+            req = json.loads(body)
+            prompt = "".join(m.get("content") or "" for m in req["messages"])
+            user = json.loads(req["messages"][-1]["content"])
+            items = user.get("items")
+            names = [it["old"] for it in items] if items else user["basenames"]
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            return self._reply(400, {"error": {"message": f"bad request: {e}"}})
+        with srv.lock:
+            srv.requests += 1
+        time.sleep(srv.latency)
+        if random.random() < srv.fail_rate:
+            return self._reply(503, {"error": {"message": "overloaded"}})
+        prompt_tokens = estimate_tokens(prompt)
+        if prompt_tokens > srv.context_tokens:
+            return self._reply(
+                400,
+                {"error": {"message": f"context length exceeded: {prompt_tokens}"}},
+            )
+        if any("POISON" in n for n in names):
+            content = '{"truncated": '
+        elif items:
+            mappings = [{"old": it["old"], "new": it["proposed"]} for it in items]
+            content = json.dumps({"mappings": mappings})
+        else:
+            content = json.dumps({n: "STUB " + n for n in names})
+        self._reply(
+            200,
+            {
+                "id": f"stub-{srv.requests}",
+                "object": "chat.completion",
+                "model": req.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": estimate_tokens(content),
+                    "total_tokens": prompt_tokens + estimate_tokens(content),
+                },
+            },
+        )
+
+
+def start_stub_server(
+    port: int = 0,
+    context_tokens: int = 16000,
+    fail_rate: float = 0.0,
+    latency: float = 0.05,
+) -> ThreadingHTTPServer:
+    """Serve StubHandler on 127.0.0.1 in a daemon thread; see .server_port."""
+    srv = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    srv.daemon_threads = True
+    srv.context_tokens = context_tokens
+    srv.fail_rate = fail_rate
+    srv.latency = latency
+    srv.requests = 0
+    srv.connections = 0
+    srv.lock = threading.Lock()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def stub_request_fn(base_url: str) -> RequestFn:
+    def send(chunk: List[str]):
+        resp = chat_completion(
+            base_url,
+            "stub",
+            {
+                "model": "stub",
+                "messages": [
+                    {"role": "system", "content": "Map basenames."},
+                    {"role": "user", "content": json.dumps({"basenames": chunk})},
+                ],
+            },
+        )
+        return resp["choices"][0]["message"]["content"], resp.get("usage")
+
+    return send
+
+
+def run_benchmark(n: int, concurrency: int, budget: int, fail_rate: float):
+    rng = random.Random(0)
+    names = [
+        f"Show.S{rng.randint(1, 9):02d}E{i % 99 + 1:02d}.Ep{i}.1080p.WEB-DL-GRP.mkv"
+        for i in range(n)
+    ]
+    for i in range(0, n, 997):
+        names[i] = names[i].replace("GRP", "POISON")
+    poisoned = {x for x in names if "POISON" in x}
+    srv = start_stub_server(fail_rate=fail_rate)
+    base_url = f"http://127.0.0.1:{srv.server_port}/v1"
+    send = stub_request_fn(base_url)
+    print(
+        f"{n} names ({len(poisoned)} poison), stub context 16000 tokens, "
+        f"fail_rate={fail_rate}"
+    )
+
+    def report(label, mapping, summary):
+        wrong = sum(1 for k, v in mapping.items() if v != "STUB " + k)
+        missing = len(set(names) - poisoned - set(mapping))
+        print(f"  {label:<15} {summary}")
+        print(f"  {'':<15} wrong={wrong} missing(non-poison)={missing}")
+
+    try:
+        # Old behaviour: everything in one request, any failure loses it all.
+        t0 = time.perf_counter()
+        try:
+            content, usage = send(names)
+            mapping = parse_mapping(content)
+        except Exception as e:
+            mapping, usage = {}, {"error": str(e)[:60]}
+        dt = time.perf_counter() - t0
+        report("single request", mapping, f"{len(mapping)}/{n} names in {dt:.2f}s, {usage}")
+
+        mapping, stats = run_batches(
+            names, send, budget=budget, concurrency=concurrency, backoff=0.05
+        )
+        report("batched", mapping, stats.summary())
+        print(f"  {'':<15} connections: {srv.connections} for {srv.requests} requests")
+    finally:
+        srv.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM batching helpers.")
+    parser.add_argument(
+        "--serve", type=int, metavar="PORT", help="Run the stub server in foreground."
+    )
+    parser.add_argument(
+        "--bench", type=int, metavar="N", help="Benchmark N names against the stub."
+    )
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY)
+    parser.add_argument("--chunk-tokens", type=int, default=LLM_CHUNK_TOKENS)
+    parser.add_argument(
+        "--fail-rate", type=float, default=0.0, help="Stub: fraction of 503s."
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        srv = start_stub_server(args.serve, fail_rate=args.fail_rate)
+        print(f"Stub listening on http://127.0.0.1:{srv.server_port}/v1", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            srv.shutdown()
+        return
+    if args.bench:
+        run_benchmark(args.bench, args.concurrency, args.chunk_tokens, args.fail_rate)
+        return
+    parser.print_help(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
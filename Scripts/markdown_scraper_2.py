@@ -2,14 +2,13 @@
 
 import sys
 import os
-import time
 import re
-import requests
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 from lxml import html
 from markdownify import markdownify as md
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+
+from image_store import localize_images
+from page_extract import fetch_page, get_main_content, strip_boilerplate
 
 
 def generate_filename(url):
@@ -31,82 +30,25 @@ if len(sys.argv) != 2:
 
 url = sys.argv[1]
 
-# Set up Selenium with headless Chrome.
-chrome_options = Options()
-chrome_options.add_argument("--headless")
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
-driver = webdriver.Chrome(options=chrome_options)
-driver.get(url)
-
-# Wait for the page to load completely.
-time.sleep(3)
-html_content = driver.page_source
-driver.quit()
+# Fetch over HTTP, or render in a headless browser if the page needs JavaScript.
+html_content = fetch_page(url)
 
 # Parse HTML using lxml.
 tree = html.fromstring(html_content)
 
-# Build a dynamic XPath expression based on keywords.
-keywords = ["main", "body", "content", "article", "maincontent"]
-conditions = []
-for kw in keywords:
-    conditions.append(
-        f"contains(translate(@id, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-    )
-    conditions.append(
-        f"contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-    )
-xpath_expr = "//*[" + " or ".join(conditions) + "]"
-print(f"Dynamic XPath expression: {xpath_expr}")
-
-# Find all matching elements.
-matches = tree.xpath(xpath_expr)
-if not matches:
-    print("Error: No elements found matching dynamic XPath.")
-    sys.exit(1)
-
-
-# Choose the candidate with the most text content as a simple heuristic.
-def score_element(el):
-    return len(el.text_content().strip())
-
-
-best_element = max(matches, key=score_element)
-print("Best matching element selected based on text length.")
+# Pick the main content: a site rule if one matches, else the best-scoring
+# container, else <body>.
+best_element, used_selector = get_main_content(tree, url)
+print(f"Using selector: {used_selector}")
+strip_boilerplate(best_element, url)
 
 # Convert the best element to an HTML string and then to Markdown.
 element_html = html.tostring(best_element, encoding="unicode")
 markdown_text = md(element_html)
 
-# Process images: download them and update their src attributes.
-images_dir = "images"
-if not os.path.exists(images_dir):
-    os.makedirs(images_dir)
-
-# Update img tags in the best_element
-for img in best_element.xpath(".//img"):
-    src = img.get("src")
-    if not src:
-        continue
-    img_url = urljoin(url, src)
-    filename = os.path.basename(urlparse(img_url).path)
-    local_path = os.path.join(images_dir, filename)
-    if not os.path.exists(local_path):
-        try:
-            img_response = requests.get(img_url)
-            if img_response.status_code == 200:
-                with open(local_path, "wb") as f:
-                    f.write(img_response.content)
-                print(f"Downloaded image: {filename}")
-            else:
-                print(
-                    f"Failed to download image {img_url} (status {img_response.status_code})"
-                )
-        except Exception as e:
-            print(f"Error downloading image {img_url}: {e}")
-    # Update image src to local path.
-    img.set("src", f"./images/{filename}")
+# Download images concurrently, once per URL, named by content hash,
+# and point their src attributes at the local copies.
+localize_images(best_element, url)
 
 # Convert the updated best element to Markdown again.
 element_html = html.tostring(best_element, encoding="unicode")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Main-content extraction shared by the markdown scrapers.
+
+Site-specific handling is data: SITE_RULES maps a domain to XPath rules,
+compiled once at import into etree.XPath objects. SCRAPER_RULES may name a
+JSON file of the same shape to add or override sites without touching
+code. A URL's rule is found by dict lookup on its host and then each
+parent domain, so docs.example.com falls back to example.com.
+
+    content   XPaths tried in order; the first that matches is the main
+              content (several matches are kept together, in page order)
+    strip     XPaths (relative to the content) removed before conversion
+    wait      XPath the browser waits for, and that a plain HTTP response
+              must contain, before the page counts as rendered
+
+Pages without a matching rule go to content_score's one-pass scorer, then
+to <body>.
+
+    ./page_extract.py URL [URL ...]   # show the rule and pick for each page
+    ./page_extract.py --rules         # list the registered sites
+"""
+import os
+import sys
+import copy
+import json
+import argparse
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from lxml import etree, html
+
+from content_score import MIN_CONTENT, describe, main_content
+
+SITE_RULES = {
+    "repost.aws": {
+        "content": [
+            "//div[contains(@class, 'QuestionDetail_banner')]"
+            " | //div[contains(@class, 'ResponseDetail_container')]",
+        ],
+        "wait": "//div[contains(@class, 'QuestionDetail_banner')]",
+    },
+}
+DEFAULT_STRIP = [
+    ".//script",
+    ".//style",
+    ".//noscript",
+    ".//template",
+    ".//button",
+]
+RULES_FILE = os.environ.get("SCRAPER_RULES")
+
+
+class SiteRule(NamedTuple):
+    content: Tuple[etree.XPath, ...] = ()
+    strip: Tuple[etree.XPath, ...] = ()
+    wait: Optional[etree.XPath] = None
+
+
+def compile_rule(spec: dict) -> SiteRule:
+    return SiteRule(
+        content=tuple(etree.XPath(x) for x in spec.get("content", ())),
+        strip=tuple(etree.XPath(x) for x in spec.get("strip", ())),
+        wait=etree.XPath(spec["wait"]) if spec.get("wait") else None,
+    )
+
+
+def load_rules(path: Optional[str] = RULES_FILE) -> Dict[str, SiteRule]:
+    specs = dict(SITE_RULES)
+    if path:
+        try:
+            with open(path) as f:
+                specs.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring rules file {path}: {e}", file=sys.stderr)
+    rules = {}
+    for domain, spec in specs.items():
+        try:
+            rules[domain.lower()] = compile_rule(spec)
+        except etree.XPathSyntaxError as e:
+            print(f"Warning: bad XPath in rule for {domain}: {e}", file=sys.stderr)
+    return rules
+
+
+RULES = load_rules()
+NO_RULE = SiteRule()
+STRIP = etree.XPath(" | ".join(DEFAULT_STRIP))
+
+
+def rule_for(url: str) -> SiteRule:
+    host = (urlparse(url).hostname or "").lower()
+    while host:
+        rule = RULES.get(host)
+        if rule is not None:
+            return rule
+        host = host.partition(".")[2]
+    return NO_RULE
+
+
+def wait_for(url: str) -> Optional[etree.XPath]:
+    return rule_for(url).wait
+
+
+def _matched(xpath: etree.XPath, tree):
+    matches = [el for el in xpath(tree) if etree.iselement(el)]
+    if len(matches) <= 1:
+        return matches[0] if matches else None
+    # Keep question-and-answers style matches together in one container.
+    wrapper = html.Element("div")
+    for el in matches:
+        wrapper.append(copy.deepcopy(el))
+    return wrapper
+
+
+def get_main_content(tree, url):
+    """
+    (element, description) of the page's main content: the site rule if one
+    matches, else the highest-scoring container, else <body>.
+    """
+    for xpath in rule_for(url).content:
+        element = _matched(xpath, tree)
+        if element is not None:
+            print(f"Main content found using site rule {xpath.path}")
+            return element, xpath.path
+
+    element, counts = main_content(tree)
+    if element is not None:
+        print(
+            f"Main content found by scoring: {counts.content} characters, "
+            f"link density {counts.link_density:.2f}."
+        )
+        return element, describe(element)
+    print(f"Scoring found no element with {MIN_CONTENT} characters of content.")
+
+    print("Falling back to the <body> element.")
+    body = tree.find(".//body") if tree.tag != "body" else tree
+    if body is None:
+        raise ValueError("page has no <body> element")
+    return body, "//body"
+
+
+def main_text(tree, url: str) -> Optional[str]:
+    """
+    tiered_fetch's content_check: the text get_main_content() would pick,
+    without the <body> fallback. "" when the site rule matches nothing
+    yet; None (no opinion) when scoring finds no main content either.
+    """
+    rule = rule_for(url)
+    for xpath in rule.content:
+        element = _matched(xpath, tree)
+        if element is not None:
+            return element.text_content()
+    if rule.content:
+        return ""
+    element, _ = main_content(tree)
+    return None if element is None else element.text_content()
+
+
+def strip_boilerplate(element, url: str):
+    """Remove scripts, buttons and the site's strip matches from element."""
+    doomed = STRIP(element)
+    for xpath in rule_for(url).strip:
+        doomed += xpath(element)
+    for el in doomed:
+        if el.getparent() is not None:
+            el.drop_tree()  # keeps the tail text
+
+
+def fetch_page(url: str) -> str:
+    """tiered_fetch.fetch_html() with the site's wait condition."""
+    from tiered_fetch import fetch_html
+
+    return fetch_html(url, wait_for(url))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Main-content extraction.")
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--rules", action="store_true", help="List site rules.")
+    args = parser.parse_args()
+    if args.rules:
+        for domain, rule in sorted(RULES.items()):
+            print(domain)
+            for kind in ("content", "strip"):
+                for xpath in getattr(rule, kind):
+                    print(f"  {kind:8} {xpath.path}")
+            if rule.wait is not None:
+                print(f"  {'wait':8} {rule.wait.path}")
+    elif args.urls:
+        for url in args.urls:
+            tree = html.fromstring(fetch_page(url))
+            element, used = get_main_content(tree, url)
+            text = " ".join(element.text_content().split())
+            print(f"{url}\n  {used}\n  {len(text)} characters: {text[:120]}")
+    else:
+        parser.error("give URLs or --rules")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of filename normalization results, shared by the renamers.
+
+Rows are keyed by (kind, basename) and tagged with a hash of the rules that
+produced them ("local" parser tables, LLM prompt/model, ...). A lookup only
+hits rows whose hash matches the current rules, so editing one rule set
+invalidates that kind's entries and nothing else; stale rows are overwritten
+as names are re-resolved and otherwise age out through LRU eviction.
+
+Invalidation is per kind, not per rule table: adding one provider to the
+"local" tables misses every cached "local" name, even those without a
+provider token, and the next run re-parses them all. A cached name can't
+tell which tables its result depended on (a new key may start matching a
+name that matched nothing before), so anything finer could serve stale
+results.
+"""
+import os
+import time
+import types
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+CACHE_DB = os.environ.get(
+    "RENAME_CACHE_DB", str(Path.home() / ".cache" / "rename_cache.sqlite")
+)
+CACHE_MAX_ENTRIES = 500_000
+LOOKUP_BATCH = 500  # SQLite host-parameter budget per IN (...) query
+
+
+def rules_hash(*parts) -> str:
+    """Stable hash of rule tables. Compiled patterns and functions are hashed
+    by their pattern text / bytecode, constants and names so a changed lambda
+    invalidates too.
+    All parts go into one hash, so a change to any of them invalidates every
+    entry cached under it."""
+    h = hashlib.sha1()
+
+    def feed(obj):
+        if hasattr(obj, "pattern") and hasattr(obj, "flags"):
+            feed(("re", obj.pattern, obj.flags))
+        elif isinstance(obj, types.CodeType):
+            h.update(obj.co_code)
+            feed(obj.co_consts)
+            # Global/attribute and local names: bytecode only indexes them.
+            feed(obj.co_names)
+            feed(obj.co_varnames)
+        elif callable(obj) and hasattr(obj, "__code__"):
+            feed(obj.__code__)
+        elif isinstance(obj, dict):
+            for k, v in obj.items():
+                feed(k)
+                feed(v)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            items = sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj
+            h.update(b"[")
+            for item in items:
+                feed(item)
+            h.update(b"]")
+        else:
+            h.update(repr(obj).encode("utf-8"))
+        h.update(b"\0")
+
+    for part in parts:
+        feed(part)
+    return h.hexdigest()[:16]
+
+
+def _today() -> int:
+    return int(time.time() // 86400)
+
+
+class RenameCache:
+    def __init__(self, path: str = CACHE_DB, max_entries: int = CACHE_MAX_ENTRIES):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS renames (
+                kind TEXT NOT NULL,
+                basename TEXT NOT NULL,
+                rules TEXT NOT NULL,
+                result TEXT,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (kind, basename)
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS renames_used ON renames (used)")
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(
+        self, kind: str, rules: str, basenames: Iterable[str]
+    ) -> Dict[str, Optional[str]]:
+        """
+        Cached results for basenames under the given rules hash. A hit may map
+        to None (the resolver already failed on that name under these rules).
+        """
+        names = list(dict.fromkeys(basenames))
+        today = _today()
+        hits: Dict[str, Optional[str]] = {}
+        touch = []
+        for i in range(0, len(names), LOOKUP_BATCH):
+            batch = names[i : i + LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            rows = self.db.execute(
+                f"SELECT basename, result, used FROM renames "
+                f"WHERE kind = ? AND rules = ? AND basename IN ({marks})",
+                [kind, rules, *batch],
+            )
+            for basename, result, used in rows:
+                hits[basename] = result
+                if used < today:
+                    touch.append((today, kind, basename))
+        if touch:
+            # Recency is tracked per day; same-day reruns write nothing.
+            with self.db:
+                self.db.executemany(
+                    "UPDATE renames SET used = ? WHERE kind = ? AND basename = ?", touch
+                )
+        self.hits += len(hits)
+        self.misses += len(names) - len(hits)
+        return hits
+
+    def put_many(self, kind: str, rules: str, results: Dict[str, Optional[str]]):
+        today = _today()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO renames (kind, basename, rules, result, used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(kind, b, rules, r, today) for b, r in results.items()],
+            )
+
+    def evict(self) -> int:
+        """Drop least recently used rows beyond max_entries."""
+        (count,) = self.db.execute("SELECT COUNT(*) FROM renames").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        with self.db:
+            self.db.execute(
+                "DELETE FROM renames WHERE rowid IN "
+                "(SELECT rowid FROM renames ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+        return excess
+
+    def close(self):
+        self.evict()
+        self.db.close()
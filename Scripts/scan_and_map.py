@@ -3,14 +3,31 @@ import os
 import re
 import csv
 import json
+import time
+import random
+import argparse
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Optional, Tuple, Dict, List
 
+from media_walk import DEFAULT_SKIP_DIRS, walk_paths
+from content_index import ContentIndex, duplicate_map
+from llm_batch import FatalError, chat_completion, estimate_tokens, run_batches
+from rename_cache import RenameCache, rules_hash
+
 # Config
 SHOW_NAME = "The Office (US)"
 MEDIA_EXTS = {".mkv", ".mp4", ".m4v"}
+SKIP_DIRS = DEFAULT_SKIP_DIRS  # directory globs never scanned (.git, @eaDir, ...)
 OUTPUT_CSV = "rename_map.csv"
 ERROR_LOG = "rename_errors.log"
+DUPES_CSV = "rename_duplicates.csv"
+PARSE_CHUNK_SIZE = 2000  # most basenames per worker task with --jobs
+PARSE_MIN_CHUNK = 200  # fewer than this per task isn't worth the IPC
+STREAM_BLOCK = 5000  # paths resolved and flushed to the CSV at a time
+NORMALIZER_VERSION = 1  # bump when local_normalize logic changes (drops cached results)
 
 # Extras output style is fixed to bracketed tokens as requested:
 # e.g., [PCOK][WEB-DL][DDP5.1][x264][FLUX]
@@ -28,6 +45,9 @@ OPENROUTER_MODEL = os.environ.get(
 OPENROUTER_HTTP_REFERER = os.environ.get("OPENROUTER_HTTP_REFERER", "http://localhost")
 OPENROUTER_X_TITLE = os.environ.get("OPENROUTER_X_TITLE", "Filename Normalizer")
 OPENROUTER_TEMPERATURE = float(os.environ.get("OPENROUTER_TEMPERATURE", "0.0"))
+LLM_CHUNK_TOKENS = int(os.environ.get("LLM_CHUNK_TOKENS", "3000"))  # per request
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))  # requests in flight
+BENCH_ROUNDS = 3  # --bench: best of this many alternating runs
 
 # Provider dictionary (extend as needed). We’ll capture uppercase canonical keys.
 PROVIDERS = {
@@ -80,27 +100,57 @@ AUDIO_PATTERNS = [
 ]
 
 
+# Video codec patterns, in the order extras_from_right strips them.
+CODEC_PATTERNS = [
+    re.compile(r"\bx?264\b", re.IGNORECASE),
+    re.compile(r"\bx?265\b", re.IGNORECASE),
+    re.compile(r"\bAV1\b", re.IGNORECASE),
+    re.compile(r"\bH[\.\s]?264\b", re.IGNORECASE),
+    re.compile(r"\bH[\.\s]?265\b", re.IGNORECASE),
+    re.compile(r"\bHEVC\b", re.IGNORECASE),
+    re.compile(r"\bAVC\b", re.IGNORECASE),
+]
+
+EXT_RE = re.compile(r"\.(mkv|mp4|m4v)$", re.IGNORECASE)
+SHOW_PREFIX_RE = re.compile(
+    r"^\s*The Office( Superfan Episodes| US|)\s*", re.IGNORECASE
+)
+EPISODE_RE = re.compile(
+    r"\bS(\d{1,2})E(\d{1,2})(?:[-\. ]?E?(\d{1,2}))?\b", re.IGNORECASE
+)
+WEB_RE = re.compile(r"\bWEB[- ]?(DL|Rip)\b", re.IGNORECASE)
+GROUP_RE = re.compile(r"-([A-Za-z0-9]{2,12})\s*$")
+EDGE_NONWORD_RE = re.compile(r"^\W+|\W+$")
+PART_RE = re.compile(r"\bPart\.?(\d)\b", re.IGNORECASE)
+K_INITIAL_RE = re.compile(r"\bK\b(?=\s)")
+TRAILING_H_RE = re.compile(r"\s+[Hh]$")
+
+_X265_RE = re.compile(r"\bx?265\b|\bH[\.\s]?265\b")
+_X264_RE = re.compile(r"\bx?264\b|\bH[\.\s]?264\b")
+_AV1_RE = re.compile(r"\bAV1\b")
+
+
 # Codec normalization to your preference:
 # - HEVC family -> x265
 # - AVC family -> x264
 # - AV1 -> AV1
 def normalize_codec_token(s: str) -> Optional[str]:
     u = s.upper()
-    if re.search(r"\bx?265\b", u) or re.search(r"\bH[\.\s]?265\b", u) or "HEVC" in u:
+    if _X265_RE.search(u) or "HEVC" in u:
         return "x265"
-    if re.search(r"\bx?264\b", u) or re.search(r"\bH[\.\s]?264\b", u) or "AVC" in u:
+    if _X264_RE.search(u) or "AVC" in u:
         return "x264"
-    if re.search(r"\bAV1\b", u):
+    if _AV1_RE.search(u):
         return "AV1"
     return None
 
 
 def dedup_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", s).strip()
+    return " ".join(s.split())
 
 
 def strip_ext(basename: str) -> Tuple[str, str]:
-    m = re.search(r"\.(mkv|mp4|m4v)$", basename, re.IGNORECASE)
+    m = EXT_RE.search(basename)
     if not m:
         return basename, ""
     ext = m.group(0)
@@ -117,15 +167,14 @@ def clean_trackers(s: str) -> str:
 
 def normalize_title_spacing(title: str) -> str:
     title = title.replace(".", " ")
-    title = re.sub(r"\bPart\.?(\d)\b", r"Part \1", title, flags=re.IGNORECASE)
-    title = re.sub(r"\bPart(\d)\b", r"Part \1", title, flags=re.IGNORECASE)
-    title = re.sub(r"\bK\b(?=\s)", "K.", title)  # Dwight K -> K.
+    title = PART_RE.sub(r"Part \1", title)
+    title = K_INITIAL_RE.sub("K.", title)  # Dwight K -> K.
     title = title.replace("WUPHF com", "WUPHF.com")
     title = dedup_spaces(title)
     # Guard against stray standalone H at end
     if title == "H":
         return ""
-    title = re.sub(r"\s+[Hh]$", "", title)
+    title = TRAILING_H_RE.sub("", title)
     return title
 
 
@@ -134,9 +183,7 @@ def parse_season_episode(name: str) -> Optional[Tuple[int, int, Optional[int], s
     Detects SxxEyy, optional range SxxEyy-Ezz or SxxEyyEzz or SxxEyy.Ezz
     Returns (season, ep_start, ep_end_or_None, remainder)
     """
-    m = re.search(
-        r"\bS(\d{1,2})E(\d{1,2})(?:[-\. ]?E?(\d{1,2}))?\b", name, re.IGNORECASE
-    )
+    m = EPISODE_RE.search(name)
     if not m:
         return None
     s = int(m.group(1))
@@ -172,12 +219,501 @@ def rstrip_token(s: str) -> str:
     return s.strip(" -._")
 
 
+def normalize_web_tokens(s: str) -> str:
+    # Unify WEB DL / WEBDL / WEB Rip spellings so source and group see one form
+    return WEB_RE.sub(
+        lambda m: "WEB-DL" if m.group(1).upper() == "DL" else "WEBRip", s
+    )
+
+
+# Tokenizer engine
+#
+# A basename is split once into typed tokens by a single alternation compiled
+# from EPISODE_RE, the edition words, CODEC_PATTERNS, AUDIO_PATTERNS and the
+# SOURCES/PROVIDERS keys. Picking which token fills each comps slot then only
+# looks at the token list, following the same precedence the old chain of
+# re.search calls had (codec patterns in order, first audio pattern, first
+# dictionary key, leftmost resolution).
+Token = namedtuple("Token", "kind rank start end")
+
+
+def _rank_table(table: Dict[str, str]) -> Dict[str, Tuple[int, str]]:
+    return {k.upper(): (i, v) for i, (k, v) in enumerate(table.items())}
+
+
+SOURCE_RANKS = _rank_table(SOURCES)
+PROVIDER_RANKS = _rank_table(PROVIDERS)
+
+
+def _keys_alternation(keys) -> str:
+    # Longest first so e.g. WEBRIP is never cut short by a shorter key.
+    return "|".join(re.escape(k) for k in sorted(keys, key=len, reverse=True))
+
+
+def _after_boundary(pattern: str) -> str:
+    # Every alternative starts on a word boundary; TOKEN_RE checks it once.
+    assert pattern.startswith(r"\b"), pattern
+    return pattern[2:]
+
+
+def build_token_re() -> Tuple[re.Pattern, Dict[str, Tuple[str, int]]]:
+    """
+    Compile one alternation over every token type. Returns the pattern and a
+    map from its group names to (kind, rank), rank being the index of the
+    pattern within its table (CODEC_PATTERNS, AUDIO_PATTERNS).
+    """
+    alts = [
+        ("episode", 0, EPISODE_RE.pattern),
+        ("edition", 0, r"\b(?:Extended Cut|EXTENDED|Superfan(?: Episodes)?)\b"),
+    ]
+    alts += [("codec", i, p.pattern) for i, p in enumerate(CODEC_PATTERNS)]
+    alts += [("audio", i, p.pattern) for i, (p, _fn) in enumerate(AUDIO_PATTERNS)]
+    alts += [
+        ("source", 0, rf"\b(?:{_keys_alternation(SOURCES)})\b"),
+        ("provider", 0, rf"\b(?:{_keys_alternation(PROVIDERS)})\b"),
+        ("res", 0, r"\b\d{3,4}p\b"),
+    ]
+    kinds = {}
+    branches = []
+    for kind, rank, pattern in alts:
+        name = f"{kind}{rank}"
+        kinds[name] = (kind, rank)
+        branches.append(f"(?P<{name}>{_after_boundary(pattern)})")
+    return re.compile(r"\b(?:" + "|".join(branches) + ")", re.IGNORECASE), kinds
+
+
+TOKEN_RE, TOKEN_KINDS = build_token_re()
+
+
+def tokenize(s: str, pos: int = 0, endpos: Optional[int] = None) -> List[Token]:
+    """Split s[pos:endpos] into typed tokens with a single regex scan."""
+    if endpos is None:
+        endpos = len(s)
+    tokens = []
+    for m in TOKEN_RE.finditer(s, pos, endpos):
+        kind, rank = TOKEN_KINDS[m.lastgroup]
+        tokens.append(Token(kind, rank, m.start(), m.end()))
+    return tokens
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+def _splice(s: str, lo: int, hi: int, spans) -> str:
+    """s[lo:hi] with the given (start, end) spans cut out, spaces deduped."""
+    out = []
+    pos = lo
+    for a, b in sorted(spans):
+        out.append(s[pos:a])
+        pos = b
+    out.append(s[pos:hi])
+    return dedup_spaces("".join(out))
+
+
+def _strip_bounds(s: str, lo: int, hi: int) -> Tuple[int, int]:
+    """Bounds of rstrip_token(s[lo:hi]) within s."""
+    part = s[lo:hi]
+    left = part.lstrip(" -._")
+    lo += len(part) - len(left)
+    return lo, lo + len(left.rstrip(" -._"))
+
+
+def _orphan_h(s: str, lo: int, hi: int, spans) -> Optional[Tuple[int, int]]:
+    """
+    Span of a standalone 'H' left at the end of s[lo:hi] once spans are
+    removed (what remains of "H 264" after the bare 264 is stripped).
+    """
+    if "H" not in s[lo:hi]:
+        return None
+    dead = set()
+    for a, b in spans:
+        dead.update(range(a, b))
+    i = hi - 1
+    while i >= lo and (i in dead or s[i].isspace()):
+        i -= 1
+    if i < lo or s[i] != "H":
+        return None
+    j = i - 1
+    while j >= lo and j in dead:
+        j -= 1
+    if j >= lo and _is_word_char(s[j]):
+        return None
+    return i, i + 1
+
+
+def extras_from_tokens(
+    s: str,
+    tokens: List[Token],
+    lo: int = 0,
+    hi: Optional[int] = None,
+    removed: List[Tuple[int, int]] = (),
+) -> Tuple[Dict[str, Optional[str]], str]:
+    """
+    Fill comps from the tokens of s[lo:hi] (WEB tokens already normalized),
+    treating the spans in removed (editions) as already cut out.
+    Returns comps and the remaining title-ish text.
+    """
+    if hi is None:
+        hi = len(s)
+    comps: Dict[str, Optional[str]] = {
+        "res": None,
+        "provider": None,
+        "source": None,
+        "audio": None,
+        "video": None,
+        "group": None,
+    }
+    spans = list(removed)
+
+    # 1) Group: only a -GROUP at the very end; everything after the dash goes.
+    end = hi
+    for a, b in sorted(spans, reverse=True):
+        if not s[b:end].strip():
+            end = a
+    mg = GROUP_RE.search(s, lo, end)
+    if mg:
+        comps["group"] = mg.group(1)
+        lo, hi = _strip_bounds(s, lo, mg.start())
+        spans = [(a, b) for a, b in spans if b <= hi]
+    live: Dict[str, List[Token]] = {}
+    for t in tokens:
+        if lo <= t.start and t.end <= hi:
+            live.setdefault(t.kind, []).append(t)
+        elif t.start < hi < t.end:
+            # A token cut in half by the dash (DTS-HD -> DTS) is scanned again.
+            for part in tokenize(s, t.start, hi):
+                live.setdefault(part.kind, []).append(part)
+
+    # 2) Video codec: each pattern strips its leftmost match; the last one
+    # that matched decides the normalized value.
+    codecs = live.get("codec")
+    if codecs:
+        taken = set()
+        for pat in CODEC_PATTERNS:
+            for idx, t in enumerate(codecs):
+                if idx in taken:
+                    continue
+                mv = pat.search(s, t.start, t.end)
+                if mv:
+                    taken.add(idx)
+                    norm = normalize_codec_token(mv.group(0))
+                    if norm:
+                        comps["video"] = norm
+                    spans.append(mv.span())
+                    break
+    orphan = _orphan_h(s, lo, hi, spans)
+    if orphan:
+        spans.append(orphan)
+
+    # 3) Audio: first pattern that matches anywhere, leftmost occurrence.
+    audio = live.get("audio")
+    if audio:
+        t = min(audio, key=lambda t: (t.rank, t.start))
+        pat, fn = AUDIO_PATTERNS[t.rank]
+        comps["audio"] = fn(pat.match(s, t.start, t.end))
+        spans.append((t.start, t.end))
+
+    # 4) Source and 5) provider: first dictionary key present wins.
+    for kind, ranks in (("source", SOURCE_RANKS), ("provider", PROVIDER_RANKS)):
+        found = [(ranks[s[t.start : t.end].upper()], t) for t in live.get(kind, ())]
+        if found:
+            (_rank, value), t = min(found, key=lambda f: (f[0][0], f[1].start))
+            comps[kind] = value
+            spans.append((t.start, t.end))
+
+    # 6) Resolution: leftmost 720p/1080p/2160p etc.
+    res = live.get("res")
+    if res:
+        t = res[0]
+        comps["res"] = s[t.start : t.end]
+        spans.append((t.start, t.end))
+
+    title_rem = rstrip_token(_splice(s, lo, hi, spans))
+    return comps, title_rem
+
+
 def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
     """
     Consume extras from the right using dictionaries/patterns.
     Returns comps dict and the remaining string (title-ish).
     comps keys: res, provider, source, audio, video, group
     """
+    work = normalize_web_tokens(s)
+    return extras_from_tokens(work, tokenize(work))
+
+
+def build_extras_brackets(c: Dict[str, Optional[str]]) -> str:
+    """
+    Build bracketed extras block in order: [provider][source][audio][video][group?]
+    Omit unknown/empty. If nothing, return empty string.
+    """
+    tokens: List[str] = []
+    if c.get("provider"):
+        tokens.append(c["provider"])
+    if c.get("source"):
+        tokens.append(c["source"])
+    if c.get("audio"):
+        tokens.append(c["audio"])
+    if c.get("video"):
+        tokens.append(c["video"])
+    if c.get("group"):
+        tokens.append(c["group"])
+
+    if not tokens and not c.get("res"):
+        return ""
+
+    extras = "".join(f"[{t}]" for t in tokens)
+    # Place after resolution, with a leading " - "
+    if c.get("res"):
+        return f" - {c['res']} - {extras}" if extras else f" - {c['res']}"
+    else:
+        # No resolution detected; still return extras as a block
+        return f" - {extras}" if extras else ""
+
+
+def local_normalize(old_basename: str) -> Optional[str]:
+    base, _ext = strip_ext(old_basename)
+
+    # Working copy: unify separators for detection only
+    work = base.replace("_", " ")
+    work = work.replace(".", " ")
+    work = dedup_spaces(work)
+
+    # Normalize known show prefixes at start to a common form for title extraction
+    work = SHOW_PREFIX_RE.sub("The Office ", work)
+    work = normalize_web_tokens(work)
+
+    tokens = tokenize(work)
+    for ep in tokens:
+        if ep.kind == "episode":
+            break
+    else:
+        return None
+    m = EPISODE_RE.match(work, ep.start, ep.end)
+    s, e1 = int(m.group(1)), int(m.group(2))
+    e2 = int(m.group(3)) if m.group(3) else None
+
+    # Remainder after the episode token, as parse_season_episode returns it
+    lo, hi = _strip_bounds(work, ep.end, len(work))
+
+    # Editions: every occurrence is dropped from the title
+    editions = [
+        (t.start, t.end) for t in tokens if t.kind == "edition" and t.start >= lo
+    ]
+    extended = bool(editions)
+
+    # Extras from the same token list
+    comps, title_raw = extras_from_tokens(work, tokens, lo, hi, editions)
+
+    # Episode token
+    if e2:
+        ep_token = f"S{s:02d}E{e1:02d}-E{e2:02d}"
+    else:
+        ep_token = f"S{s:02d}E{e1:02d}"
+
+    # Title cleanup
+    title = EDGE_NONWORD_RE.sub("", title_raw).strip()
+    title = normalize_title_spacing(title)
+
+    # Build name
+    parts = [SHOW_NAME, ep_token]
+    if title:
+        parts.append(title)
+    if extended:
+        parts.append("Extended")
+
+    # Extras block
+    extras = build_extras_brackets(comps)
+
+    new_base = " - ".join(parts) + extras
+    new_base = dedup_spaces(new_base)
+    return new_base
+
+
+LLM_SYSTEM = "You normalize TV episode filenames to a strict format. Output JSON mapping: {old_basename: new_basename}."
+
+
+def llm_instructions(basenames):
+    return {
+        "target_format": " -  -  -  -  - [provider][source][audio][video][group?]",
+        "rules": [
+            "Keep the original extension.",
+            "Normalize audio: DD 5 1 / DDP5 1 / DDP5.1 -> DDP5.1; also allow AC3, EAC3, DTS, DTS-HD MA, TrueHD, Atmos.",
+            "Normalize codec: h264/H.264/x264/AVC -> x264; h265/H.265/HEVC/x265 -> x265; AV1 -> AV1.",
+            "Strip [..], (..), {..} tracker tags.",
+            "Preserve release group when explicitly present as trailing -GROUP; omit if unknown.",
+            "Use WEB-DL/WEBRip/BluRay/BDRip/HDTV as present.",
+            "If there is an explicit episode range (e.g., S07E11-E12), keep that in the episode token.",
+            "Output extras as [provider][source][audio][video][group?] after the resolution segment.",
+        ],
+        "examples": [
+            [
+                "The Office US S07E11-E12 Classy Christmas Extended Cut 1080p PCOK WEB-DL DDP5 1 H 264-FLUX.mkv",
+                "The Office (US) - S07E11-E12 - Classy Christmas - Extended - 1080p - [PCOK][WEB-DL][DDP5.1][x264][FLUX].mkv",
+            ],
+            [
+                "The.Office.US.S03E10.Part1.Part2.EXTENDED.1080p.PCOK.WEB-DL.DDP5.1.H.264-TEPES.mkv",
+                "The Office (US) - S03E10 - Part 1 Part 2 - Extended - 1080p - [PCOK][WEB-DL][DDP5.1][x264][TEPES].mkv",
+            ],
+        ],
+        "basenames": basenames,
+    }
+
+
+def call_llm_bulk(basenames):
+    """
+    Map basenames through the LLM in token-budgeted chunks run concurrently
+    (see llm_batch). Returns (mapping, stats); names the model could not
+    answer are simply absent from mapping.
+    """
+    if not OPENROUTER_API_KEY:
+        raise RuntimeError("OPENROUTER_API_KEY not set but USE_LLM=1")
+
+    def send(chunk):
+        resp = chat_completion(
+            OPENROUTER_BASE_URL,
+            OPENROUTER_API_KEY,
+            {
+                "model": OPENROUTER_MODEL,
+                "messages": [
+                    {"role": "system", "content": LLM_SYSTEM},
+                    {"role": "user", "content": json.dumps(llm_instructions(chunk))},
+                ],
+                "temperature": OPENROUTER_TEMPERATURE,
+            },
+            headers={
+                "HTTP-Referer": OPENROUTER_HTTP_REFERER,
+                "X-Title": OPENROUTER_X_TITLE,
+            },
+        )
+        choice = resp["choices"][0]
+        content = (choice.get("message") or {}).get("content") or choice.get("text")
+        return content, resp.get("usage")
+
+    overhead = estimate_tokens(LLM_SYSTEM + json.dumps(llm_instructions([])))
+    return run_batches(
+        basenames,
+        send,
+        budget=LLM_CHUNK_TOKENS,
+        overhead=overhead,
+        concurrency=LLM_CONCURRENCY,
+    )
+
+
+def local_rules_hash() -> str:
+    # One hash over every table: editing any of them re-parses all cached names.
+    return rules_hash(
+        NORMALIZER_VERSION,
+        SHOW_NAME,
+        PROVIDERS,
+        SOURCES,
+        AUDIO_PATTERNS,
+        CODEC_PATTERNS,
+    )
+
+
+def llm_rules_hash() -> str:
+    return rules_hash(
+        OPENROUTER_MODEL, OPENROUTER_TEMPERATURE, LLM_SYSTEM, llm_instructions([])
+    )
+
+
+def normalize_batch(basenames: List[str]) -> List[Optional[str]]:
+    return [local_normalize(b) for b in basenames]
+
+
+def normalize_all(
+    basenames: List[str],
+    pool: Optional[ProcessPoolExecutor] = None,
+    jobs: int = 1,
+) -> List[Optional[str]]:
+    """
+    local_normalize every basename, fanning chunks out to pool (created once
+    by the caller, with `jobs` workers) if one is given. Chunks are sized so
+    every worker gets one. Results come back in input order either way.
+    """
+    if pool is None or len(basenames) < 2 * PARSE_MIN_CHUNK:
+        return normalize_batch(basenames)
+    size = -(-len(basenames) // max(jobs, 1))
+    size = max(PARSE_MIN_CHUNK, min(PARSE_CHUNK_SIZE, size))
+    chunks = [basenames[i : i + size] for i in range(0, len(basenames), size)]
+    results: List[Optional[str]] = []
+    for part in pool.map(normalize_batch, chunks):
+        results.extend(part)
+    return results
+
+
+# Benchmark: tokenizer vs. the original regex chain. The _reference_*
+# functions are the pre-tokenizer code verbatim, helpers included, so --bench
+# times what the script used to do and can check the outputs are identical.
+def _reference_normalize_codec_token(s: str) -> Optional[str]:
+    u = s.upper()
+    if re.search(r"\bx?265\b", u) or re.search(r"\bH[\.\s]?265\b", u) or "HEVC" in u:
+        return "x265"
+    if re.search(r"\bx?264\b", u) or re.search(r"\bH[\.\s]?264\b", u) or "AVC" in u:
+        return "x264"
+    if re.search(r"\bAV1\b", u):
+        return "AV1"
+    return None
+
+
+def _reference_dedup_spaces(s: str) -> str:
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def _reference_strip_ext(basename: str) -> Tuple[str, str]:
+    m = re.search(r"\.(mkv|mp4|m4v)$", basename, re.IGNORECASE)
+    if not m:
+        return basename, ""
+    ext = m.group(0)
+    return basename[: -len(ext)], ext
+
+
+def _reference_normalize_title_spacing(title: str) -> str:
+    title = title.replace(".", " ")
+    title = re.sub(r"\bPart\.?(\d)\b", r"Part \1", title, flags=re.IGNORECASE)
+    title = re.sub(r"\bPart(\d)\b", r"Part \1", title, flags=re.IGNORECASE)
+    title = re.sub(r"\bK\b(?=\s)", "K.", title)  # Dwight K -> K.
+    title = title.replace("WUPHF com", "WUPHF.com")
+    title = _reference_dedup_spaces(title)
+    # Guard against stray standalone H at end
+    if title == "H":
+        return ""
+    title = re.sub(r"\s+[Hh]$", "", title)
+    return title
+
+
+def _reference_parse_season_episode(
+    name: str,
+) -> Optional[Tuple[int, int, Optional[int], str]]:
+    m = re.search(
+        r"\bS(\d{1,2})E(\d{1,2})(?:[-\. ]?E?(\d{1,2}))?\b", name, re.IGNORECASE
+    )
+    if not m:
+        return None
+    s = int(m.group(1))
+    e1 = int(m.group(2))
+    e2 = int(m.group(3)) if m.group(3) else None
+    remainder = name[m.end() :].strip(" -._")
+    return s, e1, e2, remainder
+
+
+def _reference_extract_editions(s: str) -> Tuple[bool, str]:
+    extended = False
+    if re.search(
+        r"\b(EXTENDED|Extended Cut|Superfan(?: Episodes)?)\b", s, re.IGNORECASE
+    ):
+        extended = True
+        s = re.sub(r"\bExtended Cut\b", "", s, flags=re.IGNORECASE)
+        s = re.sub(r"\bEXTENDED\b", "", s, flags=re.IGNORECASE)
+        s = re.sub(r"\bSuperfan(?: Episodes)?\b", "", s, flags=re.IGNORECASE)
+    return extended, _reference_dedup_spaces(s)
+
+
+def _reference_extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
+    """The pre-tokenizer chain of re.search/re.sub calls."""
+    dedup = _reference_dedup_spaces
     comps = {
         "res": None,
         "provider": None,
@@ -193,22 +729,18 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
     work = re.sub(r"\bWEB[- ]?DL\b", "WEB-DL", work, flags=re.IGNORECASE)
     work = re.sub(r"\bWEB[- ]?Rip\b", "WEBRip", work, flags=re.IGNORECASE)
 
-    # 1) Group: attempt to capture trailing -GROUP or trailing token after a dash/dot/space near the end
-    # Prefer a -GROUP at the end
+    # 1) Group: prefer a -GROUP at the end
     mg = re.search(r"-([A-Za-z0-9]{2,12})\s*$", work)
     if mg:
         comps["group"] = mg.group(1)
         work = work[: work.rfind("-")]
         work = rstrip_token(work)
     else:
-        # Sometimes group is last bare token; capture cautiously only if it follows a hyphen or is clearly last segment
-        mg2 = re.search(r"(?:^|[\s\.\-])([A-Za-z0-9]{2,12})\s*$", work)
-        # We will NOT capture a group this way for now to avoid false positives. Only -GROUP at end.
-        pass
+        # The original also ran this lookup and discarded the result.
+        re.search(r"(?:^|[\s\.\-])([A-Za-z0-9]{2,12})\s*$", work)
 
     # 2) Video codec: x264/x265/AV1/H 264/H.264/H 265/H.265/HEVC/AVC
     mv = None
-    # Find any of the codec forms anywhere; we'll strip the rightmost occurrence
     codec_patterns = [
         r"\bx?264\b",
         r"\bx?265\b",
@@ -221,13 +753,11 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
     for pat in codec_patterns:
         mv = re.search(pat, work, flags=re.IGNORECASE)
         if mv:
-            # Normalize to your preference
-            norm = normalize_codec_token(mv.group(0))
+            norm = _reference_normalize_codec_token(mv.group(0))
             if norm:
                 comps["video"] = norm
-            # Remove the matched token
             work = work[: mv.start()] + work[mv.end() :]
-            work = dedup_spaces(work)
+            work = dedup(work)
     # Remove any orphan standalone 'H' created by space splits around codec
     work = re.sub(r"\bH\b$", "", work).strip()
 
@@ -237,7 +767,7 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
         if m:
             comps["audio"] = fn(m)
             work = work[: m.start()] + work[m.end() :]
-            work = dedup_spaces(work)
+            work = dedup(work)
             break
 
     # 4) Source: WEB-DL/WEBRip/BluRay/BDRip/HDTV
@@ -246,7 +776,7 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
         if ms:
             comps["source"] = v
             work = work[: ms.start()] + work[ms.end() :]
-            work = dedup_spaces(work)
+            work = dedup(work)
             break
 
     # 5) Provider: from PROVIDERS keys
@@ -255,7 +785,7 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
         if mp:
             comps["provider"] = v
             work = work[: mp.start()] + work[mp.end() :]
-            work = dedup_spaces(work)
+            work = dedup(work)
             break
 
     # 6) Resolution: 720p/1080p/2160p etc.
@@ -263,48 +793,20 @@ def extras_from_right(s: str) -> Tuple[Dict[str, Optional[str]], str]:
     if mr:
         comps["res"] = mr.group(1)
         work = work[: mr.start()] + work[mr.end() :]
-        work = dedup_spaces(work)
+        work = dedup(work)
 
     title_rem = rstrip_token(work)
     return comps, title_rem
 
 
-def build_extras_brackets(c: Dict[str, Optional[str]]) -> str:
-    """
-    Build bracketed extras block in order: [provider][source][audio][video][group?]
-    Omit unknown/empty. If nothing, return empty string.
-    """
-    tokens: List[str] = []
-    if c.get("provider"):
-        tokens.append(c["provider"])
-    if c.get("source"):
-        tokens.append(c["source"])
-    if c.get("audio"):
-        tokens.append(c["audio"])
-    if c.get("video"):
-        tokens.append(c["video"])
-    if c.get("group"):
-        tokens.append(c["group"])
-
-    if not tokens and not c.get("res"):
-        return ""
-
-    extras = "".join(f"[{t}]" for t in tokens)
-    # Place after resolution, with a leading " - "
-    if c.get("res"):
-        return f" - {c['res']} - {extras}" if extras else f" - {c['res']}"
-    else:
-        # No resolution detected; still return extras as a block
-        return f" - {extras}" if extras else ""
-
-
-def local_normalize(old_basename: str) -> Optional[str]:
-    base, _ext = strip_ext(old_basename)
+def _reference_local_normalize(old_basename: str) -> Optional[str]:
+    """local_normalize as it was before the tokenizer, for --bench."""
+    base, _ext = _reference_strip_ext(old_basename)
 
     # Working copy: unify separators for detection only
     work = base.replace("_", " ")
     work = work.replace(".", " ")
-    work = dedup_spaces(work)
+    work = _reference_dedup_spaces(work)
 
     # Normalize known show prefixes at start to a common form for title extraction
     work = re.sub(
@@ -314,16 +816,16 @@ def local_normalize(old_basename: str) -> Optional[str]:
         flags=re.IGNORECASE,
     )
 
-    parsed = parse_season_episode(work)
+    parsed = _reference_parse_season_episode(work)
     if not parsed:
         return None
     s, e1, e2, remainder = parsed
 
     # Editions
-    extended, remainder = extract_editions(remainder)
+    extended, remainder = _reference_extract_editions(remainder)
 
     # Extras via right-to-left tokenization
-    comps, title_raw = extras_from_right(remainder)
+    comps, title_raw = _reference_extras_from_right(remainder)
 
     # Episode token
     if e2:
@@ -333,7 +835,7 @@ def local_normalize(old_basename: str) -> Optional[str]:
 
     # Title cleanup
     title = re.sub(r"^\W+|\W+$", "", title_raw).strip()
-    title = normalize_title_spacing(title)
+    title = _reference_normalize_title_spacing(title)
 
     # Build name
     parts = [SHOW_NAME, ep_token]
@@ -346,92 +848,120 @@ def local_normalize(old_basename: str) -> Optional[str]:
     extras = build_extras_brackets(comps)
 
     new_base = " - ".join(parts) + extras
-    new_base = dedup_spaces(new_base)
+    new_base = _reference_dedup_spaces(new_base)
     return new_base
 
 
-def call_llm_bulk(basenames):
-    if not OPENROUTER_API_KEY:
-        raise RuntimeError("OPENROUTER_API_KEY not set but USE_LLM=1")
-    from openai import OpenAI
-
-    client = OpenAI(base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY)
-    system = "You normalize TV episode filenames to a strict format. Output JSON mapping: {old_basename: new_basename}."
-    user_instr = {
-        "target_format": " -  -  -  -  - [provider][source][audio][video][group?]",
-        "rules": [
-            "Keep the original extension.",
-            "Normalize audio: DD 5 1 / DDP5 1 / DDP5.1 -> DDP5.1; also allow AC3, EAC3, DTS, DTS-HD MA, TrueHD, Atmos.",
-            "Normalize codec: h264/H.264/x264/AVC -> x264; h265/H.265/HEVC/x265 -> x265; AV1 -> AV1.",
-            "Strip [..], (..), {..} tracker tags.",
-            "Preserve release group when explicitly present as trailing -GROUP; omit if unknown.",
-            "Use WEB-DL/WEBRip/BluRay/BDRip/HDTV as present.",
-            "If there is an explicit episode range (e.g., S07E11-E12), keep that in the episode token.",
-            "Output extras as [provider][source][audio][video][group?] after the resolution segment.",
-        ],
-        "examples": [
-            [
-                "The Office US S07E11-E12 Classy Christmas Extended Cut 1080p PCOK WEB-DL DDP5 1 H 264-FLUX.mkv",
-                "The Office (US) - S07E11-E12 - Classy Christmas - Extended - 1080p - [PCOK][WEB-DL][DDP5.1][x264][FLUX].mkv",
-            ],
-            [
-                "The.Office.US.S03E10.Part1.Part2.EXTENDED.1080p.PCOK.WEB-DL.DDP5.1.H.264-TEPES.mkv",
-                "The Office (US) - S03E10 - Part 1 Part 2 - Extended - 1080p - [PCOK][WEB-DL][DDP5.1][x264][TEPES].mkv",
-            ],
-        ],
-        "basenames": basenames,
-    }
-    resp = client.chat.completions.create(
-        extra_headers={
-            "HTTP-Referer": OPENROUTER_HTTP_REFERER,
-            "X-Title": OPENROUTER_X_TITLE,
-        },
-        model=OPENROUTER_MODEL,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user_instr)},
-        ],
-        temperature=OPENROUTER_TEMPERATURE,
-    )
-    # OpenAI SDK returns list of choices; access message.content
-    content = (
-        resp.choices[0].message.content
-        if hasattr(resp.choices[0], "message")
-        else resp.choices[0].text
-    )
-    try:
-        mapping = json.loads(content)
-        return mapping if isinstance(mapping, dict) else {}
-    except Exception:
-        return {}
-
-
-def main():
-    root = Path(".")
-    media = []
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in MEDIA_EXTS:
-            media.append(p)
-
-    if not media:
-        print("No media files found.")
-        return
-
+def synthetic_corpus(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    prefixes = ["The Office US", "The.Office.US", "The Office", "The_Office"]
+    titles = ["Pilot", "Diversity Day", "Dwight K Schrute", "WUPHF com", "Part1 Part2", ""]
+    editions = ["", "", "EXTENDED", "Extended Cut", "Superfan Episodes"]
+    res = ["", "720p", "1080p", "2160p"]
+    providers = ["", "PCOK", "AMZN", "NF", "iTunes", "Peacock"]
+    sources = ["", "WEB-DL", "WEB DL", "WEBRip", "BluRay", "HDTV"]
+    audio = ["", "DDP5 1", "DDP5.1", "DD 5 1", "AC3", "EAC3", "DTS-HD MA", "TrueHD Atmos"]
+    codecs = ["", "x264", "x265", "H 264", "H.265", "HEVC", "AVC", "AV1"]
+    groups = ["", "-FLUX", "-TEPES", "-NTb", "-GRP"]
+    seps = [" ", "."]
+    names = []
+    for _ in range(n):
+        s, e = rng.randint(1, 9), rng.randint(1, 26)
+        ep = f"S{s:02d}E{e:02d}" + rng.choice(["", "", f"-E{e + 1:02d}"])
+        words = [
+            rng.choice(prefixes),
+            ep,
+            rng.choice(titles),
+            rng.choice(editions),
+            rng.choice(res),
+            rng.choice(providers),
+            rng.choice(sources),
+            rng.choice(audio),
+            rng.choice(codecs),
+        ]
+        sep = rng.choice(seps)
+        name = sep.join(w.replace(" ", sep) for w in words if w)
+        names.append(name + rng.choice(groups) + rng.choice([".mkv", ".mp4"]))
+    return names
+
+
+def run_benchmark(n: int):
+    names = synthetic_corpus(n)
+    print(f"Benchmarking local_normalize on {n} synthetic names...")
+    results = {}
+    best = {}
+    # Alternate the two and keep each one's fastest round, so a noisy
+    # neighbour or a cold cache doesn't decide the comparison.
+    for _round in range(BENCH_ROUNDS):
+        for label, fn in (
+            ("regex chain", _reference_local_normalize),
+            ("tokenizer", local_normalize),
+        ):
+            t0 = time.perf_counter()
+            results[label] = [fn(name) for name in names]
+            dt = time.perf_counter() - t0
+            best[label] = min(dt, best.get(label, dt))
+    for label, dt in best.items():
+        print(f"  {label:<12} {dt:8.3f}s  {n / dt:12,.0f} files/s")
+    print(f"Speedup: {best['regex chain'] / best['tokenizer']:.2f}x")
+    mismatches = [
+        (name, a, b)
+        for name, a, b in zip(names, results["regex chain"], results["tokenizer"])
+        if a != b
+    ]
+    print(f"Mismatches: {len(mismatches)}")
+    for name, a, b in mismatches[:10]:
+        print(f"  {name}\n    regex:     {a}\n    tokenizer: {b}")
+
+
+def map_block(
+    media: List[Path],
+    cache: Optional[RenameCache],
+    local_rules: str,
+    llm_rules: Optional[str],
+    pool: Optional[ProcessPoolExecutor],
+    jobs: int,
+    timings: Dict[str, float],
+) -> Tuple[List[List[str]], List[str], bool]:
+    """
+    Resolve one block of walked paths to CSV rows [old_path, new_basename]
+    (local parser first, LLM for the rest when enabled) plus error lines.
+    The flag is False once the LLM endpoint refused the run outright (bad
+    key, unknown model), so the caller stops sending later blocks to it.
+    """
     old_to_new: Dict[str, str] = {}
     errs = []
     need_llm = []
 
+    t0 = time.perf_counter()
+    names = list(dict.fromkeys(p.name for p in media))
+    local = cache.get_many("local", local_rules, names) if cache else {}
+    todo = [n for n in names if n not in local]
+    fresh = dict(zip(todo, normalize_all(todo, pool, jobs)))
+    if cache and fresh:
+        cache.put_many("local", local_rules, fresh)
+    local.update(fresh)
     for p in media:
-        ob = p.name
-        nb_base = local_normalize(ob)
+        nb_base = local[p.name]
         if nb_base:
             old_to_new[str(p)] = nb_base + p.suffix
         else:
-            need_llm.append(ob)
-
-    if USE_LLM and need_llm:
+            need_llm.append(p.name)
+    timings["parse"] += time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    llm_ok = True
+    if llm_rules and need_llm:
+        llm_map = cache.get_many("llm", llm_rules, need_llm) if cache else {}
+        todo = [n for n in dict.fromkeys(need_llm) if not llm_map.get(n)]
         try:
-            llm_map = call_llm_bulk(need_llm)
+            if todo:
+                fresh, stats = call_llm_bulk(todo)
+                print(f"LLM: {stats.summary()}")
+                errs.extend(f"LLM error: {e}" for e in stats.errors)
+                if cache and fresh:
+                    cache.put_many("llm", llm_rules, fresh)
+                llm_map.update(fresh)
             for p in media:
                 if str(p) in old_to_new:
                     continue
@@ -441,22 +971,136 @@ def main():
                     old_to_new[str(p)] = nb
                 else:
                     errs.append(f"LLM could not map: {p}")
+        except FatalError as e:
+            llm_ok = False
+            errs.append(f"LLM error, not used for the rest of the run: {e}")
         except Exception as e:
             errs.append(f"LLM error: {e}")
+    timings["llm"] += time.perf_counter() - t0
 
-    # Write CSV with header and quoting
-    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+    return [[old, new] for old, new in old_to_new.items()], errs, llm_ok
+
+
+def flag_duplicates():
+    """
+    Write DUPES_CSV listing planned files whose content is identical to
+    another planned file, so they can be dropped before renaming/backups.
+    """
+    with open(OUTPUT_CSV, newline="", encoding="utf-8") as f:
+        plan = {row["old_path"]: row["new_basename"] for row in csv.DictReader(f)}
+    index = ContentIndex()
+    try:
+        groups = index.duplicates_of_paths(plan)
+    finally:
+        index.close()
+    dup_of = duplicate_map(groups)
+    with open(DUPES_CSV, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f, quoting=csv.QUOTE_ALL)
-        w.writerow(["old_path", "new_basename"])
-        for old_path, new_base in sorted(old_to_new.items()):
-            w.writerow([old_path, new_base])
+        w.writerow(["old_path", "new_basename", "duplicate_of"])
+        for g in groups:
+            for p in g:
+                w.writerow([p, plan[p], dup_of.get(p, "")])
+    print(
+        f"Duplicates: {len(dup_of)} files in {len(groups)} groups "
+        f"(see {DUPES_CSV}); {index.summary()}"
+    )
 
-    if errs:
-        with open(ERROR_LOG, "w", encoding="utf-8") as ef:
-            ef.write("\n".join(errs) + "\n")
 
-    print(f"Wrote {OUTPUT_CSV} with {len(old_to_new)} entries.")
-    print(f"Errors: {len(errs)} (see {ERROR_LOG} if > 0)")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bench",
+        type=int,
+        metavar="N",
+        help="Benchmark local_normalize on N synthetic names and exit.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Parse filenames in N worker processes (default: 1).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore and don't update the normalization cache.",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help=f"Find planned files with identical content; list them in {DUPES_CSV}.",
+    )
+    args = parser.parse_args()
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+
+    timings = dict.fromkeys(("walk", "parse", "llm", "csv"), 0.0)
+    walker = walk_paths(".", MEDIA_EXTS, SKIP_DIRS)
+    t0 = time.perf_counter()
+    first = next(walker, None)
+    timings["walk"] += time.perf_counter() - t0
+    if first is None:
+        print("No media files found.")
+        return
+
+    cache = None if args.no_cache else RenameCache()
+    local_rules = local_rules_hash()
+    llm_rules = llm_rules_hash() if USE_LLM else None
+    n_media = n_rows = n_errs = 0
+    err_f = None
+    walker = itertools.chain([first], walker)
+    # One pool for the whole run; starting workers per block would cost more
+    # than a block takes to parse.
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    try:
+        with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, quoting=csv.QUOTE_ALL)
+            w.writerow(["old_path", "new_basename"])
+            while True:
+                t0 = time.perf_counter()
+                block = list(itertools.islice(walker, STREAM_BLOCK))
+                timings["walk"] += time.perf_counter() - t0
+                if not block:
+                    break
+                rows, errs, llm_ok = map_block(
+                    block, cache, local_rules, llm_rules, pool, args.jobs, timings
+                )
+                if not llm_ok:
+                    llm_rules = None
+                t0 = time.perf_counter()
+                w.writerows(rows)
+                f.flush()
+                if errs:
+                    if err_f is None:
+                        err_f = open(ERROR_LOG, "w", encoding="utf-8")
+                    err_f.write("\n".join(errs) + "\n")
+                    err_f.flush()
+                timings["csv"] += time.perf_counter() - t0
+                n_media += len(block)
+                n_rows += len(rows)
+                n_errs += len(errs)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if err_f is not None:
+            err_f.close()
+
+    if args.dedup:
+        t0 = time.perf_counter()
+        flag_duplicates()
+        timings["dedup"] = time.perf_counter() - t0
+
+    print(f"Wrote {OUTPUT_CSV} with {n_rows} entries.")
+    print(f"Errors: {n_errs} (see {ERROR_LOG} if > 0)")
+    if cache:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+    print(
+        f"Timings ({n_media} files, jobs={args.jobs}): "
+        + ", ".join(f"{stage} {secs:.3f}s" for stage, secs in timings.items())
+    )
 
 
 if __name__ == "__main__":
@@ -1,13 +1,12 @@
 #!/home/dusts/.miniconda3/bin/python3
 
 import sys
-import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from lxml import html
 from markdownify import markdownify as md
 from openai import OpenAI
 
+from page_extract import fetch_page, get_main_content, strip_boilerplate
+
 # Initialize the OpenAI client (ensure your API key is set in your environment)
 client = OpenAI()
 
@@ -33,55 +32,18 @@ if len(sys.argv) != 2:
 
 url = sys.argv[1]
 
-# Set up Selenium with headless Chrome
-chrome_options = Options()
-chrome_options.add_argument("--headless")
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
-
-# Initialize webdriver (ensure chromedriver is in PATH or specify its location)
-driver = webdriver.Chrome(options=chrome_options)
-driver.get(url)
-
-# Optional: wait for the page to load completely
-time.sleep(3)  # adjust the sleep time as needed
-
-# Get the page source
-html_content = driver.page_source
-driver.quit()
+# Fetch over HTTP, falling back to headless Chrome (ensure chromedriver is in
+# PATH) for pages rendered by JavaScript.
+html_content = fetch_page(url)
 
 # Parse HTML using lxml
 tree = html.fromstring(html_content)
 
-# Build a dynamic XPath expression based on keywords.
-keywords = ["main", "body", "content", "article", "maincontent"]
-conditions = []
-for kw in keywords:
-    # For case-insensitive search, we use translate() on the attributes.
-    conditions.append(
-        f"contains(translate(@id, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-    )
-    conditions.append(
-        f"contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{kw.lower()}')"
-    )
-
-xpath_expr = "//*[" + " or ".join(conditions) + "]"
-print(f"Dynamic XPath expression: {xpath_expr}")
-
-# Find all matching elements.
-matches = tree.xpath(xpath_expr)
-if not matches:
-    print("Error: No elements found matching dynamic XPath.")
-    sys.exit(1)
-
-
-# Choose the candidate with the most text content as a simple heuristic.
-def score_element(el):
-    return len(el.text_content().strip())
-
-
-best_element = max(matches, key=score_element)
-print("Best matching element selected based on text length.")
+# Pick the main content: a site rule if one matches, else the best-scoring
+# container, else <body>.
+best_element, used_selector = get_main_content(tree, url)
+print(f"Using selector: {used_selector}")
+strip_boilerplate(best_element, url)
 
 # Convert the best element to HTML string and then to Markdown.
 element_html = html.tostring(best_element, encoding="unicode")
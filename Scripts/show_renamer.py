@@ -1,11 +1,45 @@
 #!/usr/bin/env python3
 import os
 import re
+import csv
 import json
+import time
+import random
 import argparse
-import subprocess
+import itertools
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+from media_walk import DEFAULT_SKIP_DIRS, walk_files
+from rename_cache import RenameCache, rules_hash
+from content_index import ContentIndex, duplicate_map
+from llm_batch import (
+    BadResponse,
+    chat_completion,
+    estimate_tokens,
+    parse_mapping,
+    run_batches,
+)
+
+MISTRAL_BASE_URL = os.environ.get("MISTRAL_BASE_URL", "https://api.mistral.ai/v1")
+MISTRAL_MODEL = "mistral-small-latest"
+MISTRAL_CHUNK_TOKENS = 6000  # estimated prompt + completion tokens per request
+MISTRAL_CONCURRENCY = 4  # chunk requests in flight
+# Only names parsed below this confidence go to the LLM (see scene_confidence).
+LLM_CONFIDENCE_THRESHOLD = 0.8
+# Weight of each field found by the local parser; sums to 1.0.
+CONFIDENCE_WEIGHTS = {
+    "se": 0.35,
+    "show": 0.2,
+    "resolution": 0.15,
+    "source": 0.1,
+    "video": 0.1,
+    "audio": 0.05,
+    "group": 0.05,
+}
+
 VIDEO_EXTS = {
     ".mkv",
     ".mp4",
@@ -86,7 +120,348 @@ def norm_audio_codec(text):
     return ""
 
 
+SCENE_FIELDS = (
+    "show",
+    "se",
+    "resolution",
+    "source",
+    "source_type",
+    "audio",
+    "video",
+    "group",
+)
+
+# One alternation for every field that parse_scene_name used to search for
+# separately, inside a lookahead so matches don't consume text and overlapping
+# tokens ("dvddts") are all seen. No two fields can match at the same
+# position, so the first hit per group name is that field's first match.
+SCENE_TOKEN_RE = re.compile(
+    r"(?=(?P<se>[Ss](?P<season>\d{1,2})[Ee](?P<episode>\d{1,3}))"
+    r"|(?P<res>4320p|2160p|1440p|1080p|720p|4320|2160|1440|1080|720|4K|8K)"
+    r"|(?P<bluray>blu[- ]?ray|bdrip|brrip)"
+    r"|(?P<web>web)"
+    r"|(?P<hdtv>hdtv|hdrip)"
+    r"|(?P<dvd>dvd)"
+    r"|(?P<video>hevc|h\.?265|x265|avc|h\.?264|x264)"
+    r"|(?P<audio>eac3|e[-_ ]?ac-?3|ddp|dd\+|ac3|dd|dts[-_ ]?hd|dts[-_ ]?ma|dts"
+    r"|true[-_ ]?hd|truehd|aac|flac))",
+    re.I,
+)
+YEAR_RE = re.compile(r"[12][09]\d{2}")
+SEPARATORS_RE = re.compile(r"[._]+")
+COUNTRY_CODES = ("US", "UK", "AU", "CA", "JP", "KR")
+COUNTRY_RE = re.compile(r"(.*)\b(US|UK|AU|CA|JP|KR)$")
+GROUP_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+KNOWN_GROUPS = ("RARBG", "TGx", "YIFY", "NTb", "CAKES", "AMZN", "NF", "WEB")
+
+# Matched tokens repeat endlessly across a library; normalize each text once.
+_norm_resolution = lru_cache(maxsize=None)(normalize_resolution)
+_norm_video = lru_cache(maxsize=None)(norm_video_codec)
+_norm_audio = lru_cache(maxsize=None)(norm_audio_codec)
+
+
+def trailing_group(name):
+    """Release group from "-GRP" / "[GRP]" / a known tag at the very end."""
+    i = len(name)
+    while i and name[i - 1] in GROUP_CHARS:
+        i -= 1
+    if i < len(name) and i and name[i - 1] == "-":
+        return name[i:]
+    if name.endswith("]"):
+        j = len(name) - 1
+        while j and name[j - 1] in GROUP_CHARS:
+            j -= 1
+        if j < len(name) - 1 and j and name[j - 1] == "[":
+            return name[j:-1]
+    low = name.lower()
+    for tag in KNOWN_GROUPS:
+        if low.endswith(tag.lower()):
+            return name[-len(tag) :]
+    return ""
+
+
+def parse_many(names):
+    """
+    Parse scene names in one regex pass each. Returns columns: a dict of
+    SCENE_FIELDS + "confidence" -> list, parallel to names (row i is
+    parse_scene_name(names[i])).
+    """
+    cols = {f: [] for f in SCENE_FIELDS + ("confidence",)}
+    show_col, se_col, res_col = cols["show"], cols["se"], cols["resolution"]
+    src_col, type_col = cols["source"], cols["source_type"]
+    audio_col, video_col, group_col = cols["audio"], cols["video"], cols["group"]
+    finditer = SCENE_TOKEN_RE.finditer
+    for name in names:
+        first = {}
+        for m in finditer(name):
+            first.setdefault(m.lastgroup, m)
+
+        se = ""
+        m = first.get("se")
+        if m:
+            se = f"S{int(m.group('season')):02d}E{int(m.group('episode')):02d}"
+
+        # Show name candidate (before SxxEyy or before a year)
+        if se and se in name:
+            show_raw = name.split(se, 1)[0]
+        else:
+            m = YEAR_RE.search(name)
+            show_raw = name[: m.start()] if m else name
+        show_raw = SEPARATORS_RE.sub(" ", show_raw).strip(" -._")
+        m = show_raw.endswith(COUNTRY_CODES) and COUNTRY_RE.search(show_raw)
+        show_col.append(f"{m.group(1).rstrip()} ({m.group(2)})" if m else show_raw)
+        se_col.append(se)
+
+        m = first.get("res")
+        res_col.append(_norm_resolution(m.group("res")) if m else "")
+
+        # Later checks won, as in the original if-chain.
+        if "dvd" in first:
+            src_col.append("DVD")
+        elif "hdtv" in first:
+            src_col.append("HDTV")
+        elif "web" in first:
+            src_col.append("WEB")
+        elif "bluray" in first:
+            src_col.append("BluRay")
+        else:
+            src_col.append("")
+        type_col.append("DL" if "web" in first else "")
+
+        m = first.get("audio")
+        audio_col.append(_norm_audio(m.group("audio")) if m else "")
+        m = first.get("video")
+        video_col.append(_norm_video(m.group("video")) if m else "")
+        group_col.append(trailing_group(name))
+        cols["confidence"].append(
+            scene_confidence(name, {f: cols[f][-1] for f in CONFIDENCE_WEIGHTS})
+        )
+    return cols
+
+
+def scene_confidence(name, meta):
+    """
+    0..1 from the fields the local parser found. A season/episode that does
+    not appear verbatim in the name means the show title came from the
+    year-split fallback, so the show weight is not counted.
+    """
+    score = 0.0
+    for field, weight in CONFIDENCE_WEIGHTS.items():
+        if meta[field]:
+            score += weight
+    if meta["se"] and meta["se"] not in name:
+        score -= CONFIDENCE_WEIGHTS["show"]
+    return round(max(score, 0.0), 2)
+
+
+def column_row(cols, i):
+    """Row i of parse_many() columns as a parse_scene_name() dict."""
+    return {f: cols[f][i] for f in SCENE_FIELDS + ("confidence",)}
+
+
+def diff_columns(a, b):
+    """{field: [row indices]} where two parse_many() results of equal length differ."""
+    return {
+        f: idx
+        for f in SCENE_FIELDS
+        if (idx := [i for i, (x, y) in enumerate(zip(a[f], b[f])) if x != y])
+    }
+
+
 def parse_scene_name(name):
+    return column_row(parse_many([name]), 0)
+
+
+def build_target(meta, ext):
+    # Omit empty fields; omit “Extra Info” by design
+    parts = [meta["show"]]
+    if meta["se"]:
+        parts.append(meta["se"])
+    if meta["resolution"]:
+        parts.append(meta["resolution"])
+    bracket = ""
+    if meta["source"]:
+        bracket += f"[{meta['source']}]"
+        if meta["source_type"]:
+            bracket += f"[{meta['source_type']}]"
+    if meta["audio"]:
+        bracket += f"[{meta['audio']}]"
+    if meta["video"]:
+        bracket += f"[{meta['video']}]"
+    if meta["group"]:
+        bracket += f"[{meta['group']}]"
+    if bracket:
+        parts.append(bracket)
+    return " - ".join(parts) + ext
+
+
+def list_library(root):
+    """{directory: [video basenames]} for every directory under root."""
+    print(f"Listing videos under {root} ...")
+    by_dir = defaultdict(list)
+    for entry in walk_files(root, VIDEO_EXTS, DEFAULT_SKIP_DIRS):
+        by_dir[os.path.dirname(entry.path)].append(entry.name)
+    n = sum(map(len, by_dir.values()))
+    print(f"Found {n} videos in {len(by_dir)} directories.")
+    return by_dir
+
+
+def plan_directory(d, names):
+    """Local plan for one directory -> (d, items, seconds spent)."""
+    t0 = time.perf_counter()
+    names = sorted(names, key=natural_sort_key)
+    cols = parse_many(names)
+    items = []
+    for i, name in enumerate(names):
+        meta = column_row(cols, i)
+        ext = os.path.splitext(name)[1]
+        items.append(
+            {"dir": d, "old": name, "parsed": meta, "proposed": build_target(meta, ext)}
+        )
+    return d, items, time.perf_counter() - t0
+
+
+def plan_library(by_dir, jobs=1):
+    """plan_directory over every directory, in a process pool when jobs > 1."""
+    dirs = sorted(by_dir, key=natural_sort_key)
+    if jobs <= 1 or len(dirs) < 2:
+        return [plan_directory(d, by_dir[d]) for d in dirs]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(1, len(dirs) // (jobs * 8))
+        return list(
+            pool.map(plan_directory, dirs, [by_dir[d] for d in dirs], chunksize=chunksize)
+        )
+
+
+def print_dir_stats(results, jobs, wall, top=10):
+    times = sorted(((secs, d, len(items)) for d, items, secs in results), reverse=True)
+    total = sum(t for t, _, _ in times)
+    print(
+        f"Planned {len(results)} directories in {wall:.2f}s wall (jobs={jobs}); "
+        f"per-directory parse total {total:.2f}s, "
+        f"mean {1000 * total / max(1, len(times)):.1f} ms, "
+        f"max {1000 * (times[0][0] if times else 0):.1f} ms"
+    )
+    for secs, d, n in times[:top]:
+        print(f"  {1000 * secs:8.1f} ms  {n:6d} files  {d}")
+
+
+def item_path(it, name):
+    return name if it["dir"] == "." else os.path.join(it["dir"], name)
+
+
+LLM_POLICY = """
+You are given a list of video filenames with a locally proposed name. Normalize to:
+<show name> - <season info> <parts of episodes if relevant> <editions or releases if relevant> - <resolution> - [<source>][<source type>][<audio codec>][<video codec>][<release group>].<ext>
+
+Rules:
+- Normalize video codecs: hevc/h265/x265 -> x265; avc/h264/x264 -> x264.
+- Normalize audio codecs to: E-AC-3, AC-3, DTS-HD, DTS, TrueHD, AAC, FLAC when detected; else omit.
+- Resolution normalization: ≥2160p -> 4K; ≥1440p -> 2K; ≥1080p -> 1080p; ≥720p -> 720p.
+- Omit extra tracker/website/bitrate and unrelated info.
+- Preserve extension.
+- Convert suffix country code in show title to parentheses: "The Office US" -> "The Office (US)".
+- Season/episode as SxxEyy; support multi-episodes like S01E01E02 -> S01E01-02 if needed.
+- If a field is unknown, omit it rather than guessing.
+
+Return strictly JSON: {"mappings": [{"old": "<oldname>", "new": "<newname>"}]}
+"""
+LLM_EXAMPLES = [
+    {
+        "old": "The.Office.US.S09E23.1080p.BluRay.x265-RARBG.mp4",
+        "new": "The Office (US) - S09E23 - 1080p - [BluRay][x265][RARBG].mp4",
+    }
+]
+
+
+def make_llm_prompt(items):
+    # Policy and examples plus only what the model needs per file, compact.
+    payload = {
+        "policy": LLM_POLICY,
+        "examples": LLM_EXAMPLES,
+        "items": [{"old": it["old"], "proposed": it["proposed"]} for it in items],
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def full_prompt_tokens(items):
+    """Estimated size of the previous prompt: every item, parsed, indent=2."""
+    payload = {"policy": LLM_POLICY, "examples": LLM_EXAMPLES, "items": items}
+    return estimate_tokens(json.dumps(payload, ensure_ascii=False, indent=2))
+
+
+def llm_rules_hash():
+    # Parser and target format shape "proposed"; prompt and model the reply.
+    return rules_hash(
+        MISTRAL_MODEL, LLM_POLICY, LLM_EXAMPLES, SCENE_TOKEN_RE, build_target
+    )
+
+
+def mistral_chat(prompt_json, model=MISTRAL_MODEL):
+    """One chat request over the shared keep-alive pool -> (content, usage)."""
+    api_key = os.environ.get("MISTRAL_API_KEY", "")
+    if not api_key:
+        raise RuntimeError("MISTRAL_API_KEY is not set in environment.")
+    data = {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a precise filename normalization assistant.",
+            },
+            {"role": "user", "content": prompt_json},
+        ],
+        "response_format": {"type": "json_object"},
+    }
+    # The API returns { choices: [ { message: { content: "<json>" } } ] }
+    obj = chat_completion(MISTRAL_BASE_URL, api_key, data)
+    return obj["choices"][0]["message"]["content"], obj.get("usage")
+
+
+def parse_mistral_mappings(content):
+    """{"mappings": [{"old", "new"}, ...]} reply -> {old: new}."""
+    obj = parse_mapping(content)
+    mappings = obj.get("mappings")
+    if not isinstance(mappings, list):
+        raise BadResponse("reply has no mappings list")
+    return {
+        m["old"]: m["new"]
+        for m in mappings
+        if isinstance(m, dict) and isinstance(m.get("old"), str) and m.get("new")
+    }
+
+
+def refine_with_llm(items, model=MISTRAL_MODEL):
+    """
+    Send items to the LLM in token-budgeted chunks, MISTRAL_CONCURRENCY at a
+    time, and return ({old: new}, stats) for the names it answered.
+    """
+    by_name = {it["old"]: it for it in items}
+
+    def cost(name):
+        it = by_name[name]
+        item = json.dumps([it["old"], it["proposed"]], ensure_ascii=False)
+        return estimate_tokens(item) + 2 * estimate_tokens(json.dumps(name))
+
+    def send(chunk):
+        return mistral_chat(make_llm_prompt([by_name[n] for n in chunk]), model)
+
+    return run_batches(
+        list(by_name),
+        send,
+        budget=MISTRAL_CHUNK_TOKENS,
+        overhead=estimate_tokens(make_llm_prompt([])),
+        concurrency=MISTRAL_CONCURRENCY,
+        cost=cost,
+        parse=parse_mistral_mappings,
+    )
+
+
+# Benchmark
+
+
+def _reference_parse_scene_name(name):
+    # Pre-parse_many implementation, kept for --bench parity checks.
     # Extract season/episode
     se = ""
     m = re.search(r"[Ss](\d{1,2})[Ee](\d{1,3})", name)
@@ -161,92 +536,38 @@ def parse_scene_name(name):
     }
 
 
-def build_target(meta, ext):
-    # Omit empty fields; omit “Extra Info” by design
-    parts = [meta["show"]]
-    if meta["se"]:
-        parts.append(meta["se"])
-    if meta["resolution"]:
-        parts.append(meta["resolution"])
-    bracket = ""
-    if meta["source"]:
-        bracket += f"[{meta['source']}]"
-        if meta["source_type"]:
-            bracket += f"[{meta['source_type']}]"
-    if meta["audio"]:
-        bracket += f"[{meta['audio']}]"
-    if meta["video"]:
-        bracket += f"[{meta['video']}]"
-    if meta["group"]:
-        bracket += f"[{meta['group']}]"
-    if bracket:
-        parts.append(bracket)
-    return " - ".join(parts) + ext
-
-
-def make_llm_prompt(items):
-    # Provide policy and examples; ask model to return a clean JSON mapping
-    policy = """
-You are given a list of video filenames with extracted metadata. Normalize to:
-<show name> - <season info> <parts of episodes if relevant> <editions or releases if relevant> - <resolution> - [<source>][<source type>][<audio codec>][<video codec>][<release group>].<ext>
-
-Rules:
-- Normalize video codecs: hevc/h265/x265 -> x265; avc/h264/x264 -> x264.
-- Normalize audio codecs to: E-AC-3, AC-3, DTS-HD, DTS, TrueHD, AAC, FLAC when detected; else omit.
-- Resolution normalization: ≥2160p -> 4K; ≥1440p -> 2K; ≥1080p -> 1080p; ≥720p -> 720p.
-- Omit extra tracker/website/bitrate and unrelated info.
-- Preserve extension.
-- Convert suffix country code in show title to parentheses: "The Office US" -> "The Office (US)".
-- Season/episode as SxxEyy; support multi-episodes like S01E01E02 -> S01E01-02 if needed.
-- If a field is unknown, omit it rather than guessing.
-
-Return strictly JSON: {"mappings": [{"old": "<oldname>", "new": "<newname>"}]}
-"""
-    examples = [
-        {
-            "old": "The.Office.US.S09E23.1080p.BluRay.x265-RARBG.mp4",
-            "new": "The Office (US) - S09E23 - 1080p - [BluRay][x265][RARBG].mp4",
-        }
-    ]
-    payload = {"policy": policy, "examples": examples, "items": items}
-    return json.dumps(payload, ensure_ascii=False, indent=2)
-
-
-def call_mistral(prompt_json, model="mistral-small-latest"):
-    api_key = os.environ.get("MISTRAL_API_KEY", "")
-    if not api_key:
-        raise RuntimeError("MISTRAL_API_KEY is not set in environment.")
-    data = {
-        "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": "You are a precise filename normalization assistant.",
-            },
-            {"role": "user", "content": prompt_json},
-        ],
-        "response_format": {"type": "json_object"},
-    }
-    # Use curl to minimize dependency; you can switch to requests if preferred
-    cmd = [
-        "curl",
-        "-sS",
-        "--location",
-        "https://api.mistral.ai/v1/chat/completions",
-        "--header",
-        "Content-Type: application/json",
-        "--header",
-        "Accept: application/json",
-        "--header",
-        f"Authorization: Bearer {api_key}",
-        "--data-binary",
-        json.dumps(data),
-    ]
-    out = subprocess.check_output(cmd, text=True)
-    # The API returns { choices: [ { message: { content: "<json>" } } ] }
-    obj = json.loads(out)
-    content = obj["choices"][0]["message"]["content"]
-    return json.loads(content)
+def synthetic_scene_names(n, seed=0):
+    rng = random.Random(seed)
+    shows = ["The.Office.US", "Breaking Bad", "Middle_Earth", "Dark.UK", "Webster"]
+    extras = (
+        "1080p 720p 2160p 4K WEB-DL WEBRip BluRay HDTV DVDRip x264 H.264 x265 HEVC "
+        "DDP5.1 DD5.1 AAC2.0 DTS-HD.MA TrueHD EAC3 FLAC AMZN NF 2019 REPACK"
+    ).split()
+    tails = ["-RARBG", "-NTb", "[YIFY]", "", "-CAKES", ".TGx", "-Grp1"]
+    names = []
+    for i in range(n):
+        se = rng.choice(["S{:02d}E{:02d}", "s{:02d}e{:02d}", "S{}E{}", "{}x{:02d}"])
+        parts = [rng.choice(shows), se.format(rng.randint(1, 12), rng.randint(1, 30))]
+        parts += rng.sample(extras, rng.randint(0, 6))
+        sep = rng.choice([".", " ", "_"])
+        name = sep.join(parts) + rng.choice(tails)
+        names.append(name + rng.choice(["", ".mkv", ".mp4"]))
+    return names
+
+
+def run_benchmark(n):
+    names = synthetic_scene_names(n)
+    t0 = time.perf_counter()
+    ref = [_reference_parse_scene_name(x) for x in names]
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    cols = parse_many(names)
+    t_new = time.perf_counter() - t0
+    ref_cols = {f: [r[f] for r in ref] for f in SCENE_FIELDS}
+    diff = diff_columns(ref_cols, cols)
+    print(f"parse_scene_name x{n}: {t_ref:.3f}s ({n / t_ref:,.0f} names/s)")
+    print(f"parse_many:          {t_new:.3f}s ({n / t_new:,.0f} names/s)")
+    print(f"mismatches: {sum(map(len, diff.values()))} {sorted(diff)}")
 
 
 def main():
@@ -257,39 +578,144 @@ def main():
     parser.add_argument(
         "--no-llm", action="store_true", help="Skip LLM refinement; use local mapping."
     )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        nargs="?",
+        const=".",
+        metavar="ROOT",
+        help="Plan every directory under ROOT (default: .) in one run.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="With --recursive, plan directories in N worker processes.",
+    )
+    parser.add_argument(
+        "--plan-csv",
+        metavar="PATH",
+        help="Also write the plan as old_path,new_basename CSV (apply_renames.py).",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Flag files whose content duplicates another file in the plan.",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=LLM_CONFIDENCE_THRESHOLD,
+        help="Send names parsed below this confidence to the LLM "
+        f"(default: {LLM_CONFIDENCE_THRESHOLD}; 1.1 sends everything).",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Ignore and don't update the LLM cache."
+    )
+    parser.add_argument(
+        "--bench",
+        type=int,
+        metavar="N",
+        help="Benchmark parse_many against the old parser on N synthetic names.",
+    )
     args = parser.parse_args()
+    if args.bench:
+        run_benchmark(args.bench)
+        return
 
-    print("Scanning for videos...")
-    files = list_videos()
-    items = []
-    local_mappings = []
-    print("Parsing listing...")
-    for p in files:
-        name = p.name
-        stem, ext = os.path.splitext(name)
-        meta = parse_scene_name(name)
-        newname = build_target(meta, ext)
-        items.append({"old": name, "parsed": meta, "proposed": newname})
-        if name != newname:
-            local_mappings.append({"old": name, "new": newname})
+    if args.recursive:
+        by_dir = list_library(args.recursive)
+        print("Planning directories...")
+        t0 = time.perf_counter()
+        results = plan_library(by_dir, args.jobs)
+        print_dir_stats(results, args.jobs, time.perf_counter() - t0)
+        items = list(itertools.chain.from_iterable(r[1] for r in results))
+    else:
+        print("Scanning for videos...")
+        files = list_videos()
+        print("Parsing listing...")
+        items = plan_directory(".", [p.name for p in files])[1]
+    confidence = [it["parsed"]["confidence"] for it in items]
+    local_mappings = [
+        {"old": item_path(it, it["old"]), "new": item_path(it, it["proposed"])}
+        for it in items
+        if it["old"] != it["proposed"]
+    ]
 
     print("Finished parsing, created local mapping..")
     mappings = local_mappings
     if not args.no_llm:
         print("Refining with LLM...")
-        prompt_json = make_llm_prompt(items)
+        t0 = time.perf_counter()
+        low = [it for it, c in zip(items, confidence) if c < args.min_confidence]
+        cache = None if args.no_cache else RenameCache()
+        rules = llm_rules_hash()
+        llm = {}
+        if cache and low:
+            hits = cache.get_many("mistral", rules, [it["old"] for it in low])
+            llm = {k: v for k, v in hits.items() if v}
+        send = [it for it in low if it["old"] not in llm]
+        print(
+            f"LLM: {len(items) - len(low)} confident, {len(llm)} cached, "
+            f"{len(send)} to send"
+        )
         try:
-            print("Calling LLM...")
-            llm = call_mistral(prompt_json)
-            print("LLM call succeeded.")
-            mappings = llm.get("mappings", local_mappings)
-            print("Parsing LLM results...")
+            if send:
+                print("Calling LLM...")
+                fresh, stats = refine_with_llm(send)
+                print(f"LLM: {stats.summary()}")
+                for err in stats.errors:
+                    print(f"LLM chunk failed, keeping local mapping: {err}")
+                if cache and fresh:
+                    cache.put_many("mistral", rules, fresh)
+                llm.update(fresh)
+                # Reported usage (incl. retries); estimated if the API omits it.
+                sent = stats.prompt_tokens or estimate_tokens(make_llm_prompt(send))
+                full = full_prompt_tokens(items)
+                print(
+                    f"LLM prompt: {sent} tokens vs ~{full} for every name with "
+                    f"indent=2 metadata (saved {100 * (1 - sent / full):.0f}%)"
+                )
+            # Names the LLM didn't answer keep their local proposal.
+            mappings = []
+            for it in items:
+                new = llm.get(it["old"], it["proposed"])
+                if new != it["old"]:
+                    mappings.append(
+                        {"old": item_path(it, it["old"]), "new": item_path(it, new)}
+                    )
         except Exception as e:
             print(f"LLM call failed, falling back to local mapping: {e}")
+        finally:
+            if cache:
+                cache.close()
+        print(f"LLM latency: {time.perf_counter() - t0:.2f}s")
+
+    dup_of = {}
+    if args.dedup:
+        index = ContentIndex()
+        try:
+            groups = index.duplicates_of_paths(item_path(it, it["old"]) for it in items)
+        finally:
+            index.close()
+        dup_of = duplicate_map(groups)
+        print(
+            f"Duplicates: {len(dup_of)} files in {len(groups)} groups; "
+            f"{index.summary()}"
+        )
 
     print("Proposed rename plan:")
     for m in mappings:
-        print(f"  {m['old']}\n  -> {m['new']}\n")
+        dup = f"\n     (duplicate of {dup_of[m['old']]})" if m["old"] in dup_of else ""
+        print(f"  {m['old']}\n  -> {m['new']}{dup}\n")
+    if args.plan_csv:
+        with open(args.plan_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, quoting=csv.QUOTE_ALL)
+            w.writerow(["old_path", "new_basename"])
+            for m in mappings:
+                w.writerow([m["old"], os.path.basename(m["new"])])
+        print(f"Wrote {len(mappings)} renames to {args.plan_csv}.")
 
     if not args.apply:
         print("(Dry-run) Use --apply to rename.")
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Convert a whole list of pages to Markdown in one process.
+
+Targets come from a file of URLs or a sitemap (a sitemap index is followed).
+An asyncio loop schedules the pages under a per-host concurrency limit,
+spaces requests to a host by its robots.txt Crawl-delay (or Request-rate),
+and only then takes one of the global slots for the fetch and conversion.
+Pages robots.txt disallows are skipped, and each Markdown file is written
+as soon as its page is done. The blocking fetch (tiered_fetch) and
+conversion (markdown_scraper_3) run in a thread pool sized to the global
+limit. The run ends with pages/min and per-stage latency.
+
+    ./site_crawl.py SOURCE [--out DIR]   # SOURCE: URL list or sitemap (file or URL)
+    ./site_crawl.py --bench [N]          # crawl N fixture pages from a local server
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from lxml import etree
+
+from browser_pool import POOL_SIZE, serve_static
+from page_extract import main_text, wait_for
+from tiered_fetch import (
+    USER_AGENT,
+    TierCache,
+    TieredFetcher,
+    new_session,
+    write_static_pages,
+)
+
+CONCURRENCY = 16  # pages in flight overall
+PER_HOST = 4  # pages in flight per host
+STAGES = ("fetch", "convert", "write")
+
+
+def _lines(text: str) -> List[str]:
+    urls = (line.strip() for line in text.splitlines())
+    return [u for u in urls if u and not u.startswith("#")]
+
+
+def read_targets(source: str, session: requests.Session) -> List[str]:
+    """URLs from a URL list or sitemap, given as a path or URL, deduplicated."""
+    if urlparse(source).scheme in ("http", "https"):
+        response = session.get(source, timeout=30)
+        response.raise_for_status()
+        data = response.content
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    if b"<urlset" in data[:2048] or b"<sitemapindex" in data[:2048]:
+        root = etree.fromstring(data)
+        locs = [
+            urljoin(source, loc.strip())
+            for loc in root.xpath("//*[local-name()='loc']/text()")
+        ]
+        if etree.QName(root).localname == "sitemapindex":
+            urls = []
+            for sitemap in locs:
+                urls += read_targets(sitemap, session)
+        else:
+            urls = locs
+    else:
+        urls = _lines(data.decode("utf-8", errors="replace"))
+    return list(dict.fromkeys(urls))
+
+
+def output_name(url: str, used: Set[str]) -> str:
+    """generate_filename(url), made unique within the crawl."""
+    from markdown_scraper_3 import generate_filename
+
+    name = generate_filename(url)
+    if name == ".md" or name in used:
+        parsed = urlparse(url)
+        stem = (parsed.netloc + parsed.path).strip("/").replace("/", "_")
+        name = os.path.splitext(stem)[0].replace("-", "_") + ".md"
+        base, n = name[:-3], 1
+        while name in used:
+            n += 1
+            name = f"{base}_{n}.md"
+    used.add(name)
+    return name
+
+
+class Host:
+    """Per-host concurrency limit and request spacing."""
+
+    def __init__(self, per_host: int):
+        self.slots = asyncio.Semaphore(per_host)
+        self.spacing = asyncio.Lock()
+        self.robots: Optional[RobotFileParser] = None
+        self.delay = 0.0
+        self.next_start = 0.0
+
+    async def turn(self):
+        """Wait until the host's crawl delay allows another request."""
+        if not self.delay:
+            return
+        async with self.spacing:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+            self.next_start = time.monotonic() + self.delay
+
+
+class Crawl:
+    def __init__(
+        self,
+        fetcher: TieredFetcher,
+        out_dir: str = ".",
+        concurrency: int = CONCURRENCY,
+        per_host: int = PER_HOST,
+    ):
+        self.fetcher = fetcher
+        self.out_dir = out_dir
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.hosts: Dict[str, Host] = {}
+        self.used_names: Set[str] = set()
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.counts = {"saved": 0, "failed": 0, "disallowed": 0}
+        self.tiers_before = dict(fetcher.stats)
+
+    def _load_robots(self, origin: str) -> RobotFileParser:
+        robots = RobotFileParser(origin + "/robots.txt")
+        try:
+            response = self.fetcher.session.get(robots.url, timeout=10)
+        except requests.RequestException:
+            response = None
+        if response is None or response.status_code >= 400:
+            robots.parse([])  # no robots.txt: everything allowed
+        else:
+            robots.parse(response.text.splitlines())
+        return robots
+
+    async def _host(self, url: str, loop) -> Host:
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        host = self.hosts.get(origin)
+        if host is None:
+            host = self.hosts[origin] = Host(self.per_host)
+        if host.robots is None:
+            async with host.spacing:  # one robots.txt fetch per host
+                if host.robots is None:
+                    robots = await loop.run_in_executor(
+                        self.executor, self._load_robots, origin
+                    )
+                    rate = robots.request_rate(USER_AGENT)
+                    delay = robots.crawl_delay(USER_AGENT)
+                    if delay is None and rate is not None:
+                        delay = rate.seconds / rate.requests
+                    host.delay = float(delay or 0)
+                    host.robots = robots
+        return host
+
+    def _convert(self, url: str, html_content: str) -> str:
+        from markdown_scraper_3 import page_to_markdown
+
+        return page_to_markdown(url, html_content)
+
+    def _write(self, name: str, markdown_text: str):
+        with open(os.path.join(self.out_dir, name), "w") as f:
+            f.write(markdown_text)
+
+    async def _page(self, url: str, pages: asyncio.Semaphore, loop):
+        host = await self._host(url, loop)
+        if not host.robots.can_fetch(USER_AGENT, url):
+            self.counts["disallowed"] += 1
+            print(f"Skipping {url}: disallowed by robots.txt")
+            return
+        # Wait for the host before taking a global slot, so a host with a
+        # long crawl delay doesn't hold slots other hosts could use.
+        async with host.slots:
+            await host.turn()
+            try:
+                async with pages:
+                    start = time.perf_counter()
+                    html_content = await loop.run_in_executor(
+                        self.executor, self.fetcher.fetch, url, wait_for(url)
+                    )
+                    fetched = time.perf_counter()
+                    markdown_text = await loop.run_in_executor(
+                        self.executor, self._convert, url, html_content
+                    )
+                    converted = time.perf_counter()
+                name = output_name(url, self.used_names)
+                await loop.run_in_executor(
+                    self.executor, self._write, name, markdown_text
+                )
+                written = time.perf_counter()
+            except (Exception, SystemExit) as e:
+                self.counts["failed"] += 1
+                print(f"Error scraping {url}: {e}", file=sys.stderr)
+                return
+        self.latency["fetch"].append(fetched - start)
+        self.latency["convert"].append(converted - fetched)
+        self.latency["write"].append(written - converted)
+        self.counts["saved"] += 1
+        print(f"Markdown saved to {name}")
+
+    async def run(self, urls: List[str]):
+        loop = asyncio.get_running_loop()
+        pages = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(self.concurrency) as self.executor:
+            await asyncio.gather(*(self._page(url, pages, loop) for url in urls))
+
+    def _tier(self, tier: str) -> int:
+        return self.fetcher.stats[tier] - self.tiers_before[tier]
+
+    def summary(self, seconds: float) -> str:
+        saved = self.counts["saved"]
+        lines = [
+            f"{saved} saved, {self.counts['failed']} failed, "
+            f"{self.counts['disallowed']} disallowed in {seconds:.1f}s "
+            f"({60 * saved / max(seconds, 1e-9):.0f} pages/min); "
+            f"tiers: {self._tier('http')} http, {self._tier('browser')} browser"
+        ]
+        for stage in STAGES:
+            values = sorted(self.latency[stage])
+            if not values:
+                continue
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(
+                f"  {stage:8} median {1000 * values[len(values) // 2]:7.1f} ms  "
+                f"p95 {1000 * p95:7.1f} ms  max {1000 * values[-1]:7.1f} ms"
+            )
+        return "\n".join(lines)
+
+
+def crawl(
+    urls: List[str],
+    out_dir: str = ".",
+    concurrency: int = CONCURRENCY,
+    per_host: int = PER_HOST,
+    browsers: int = POOL_SIZE,
+    fetcher: Optional[TieredFetcher] = None,
+) -> Crawl:
+    """Scrape urls to Markdown files in out_dir and print a summary."""
+    own = fetcher is None
+    if own:
+        fetcher = TieredFetcher(browsers=browsers, content_check=main_text)
+    job = Crawl(fetcher, out_dir, concurrency, per_host)
+    start = time.perf_counter()
+    try:
+        asyncio.run(job.run(urls))
+    finally:
+        if own:
+            fetcher.close()
+    print(job.summary(time.perf_counter() - start))
+    return job
+
+
+def write_fixture_site(root: str, count: int, crawl_delay: int = 0):
+    """Static pages plus a sitemap.xml listing them and a robots.txt."""
+    names = write_static_pages(root, count)
+    with open(os.path.join(root, "private.html"), "w") as f:
+        f.write("<html><body><p>not for crawlers</p></body></html>")
+    with open(os.path.join(root, "robots.txt"), "w") as f:
+        f.write("User-agent: *\nDisallow: /private.html\n")
+        if crawl_delay:
+            f.write(f"Crawl-delay: {crawl_delay}\n")
+    locs = "".join(f"<url><loc>{n}</loc></url>" for n in names + ["private.html"])
+    with open(os.path.join(root, "sitemap.xml"), "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f"{locs}</urlset>\n"
+        )
+
+
+def run_benchmark(count: int, concurrency: int, per_host: int, delay: float):
+    """Crawl a local fixture site whose server takes `delay` per response."""
+    with tempfile.TemporaryDirectory() as root:
+        site = os.path.join(root, "site")
+        out = os.path.join(root, "out")
+        os.makedirs(site)
+        os.makedirs(out)
+        write_fixture_site(site, count)
+        server, base = serve_static(site, delay=delay)
+        cwd = os.getcwd()
+        os.chdir(out)  # page_to_markdown saves images relative to the cwd
+        try:
+            with TieredFetcher(
+                cache=TierCache(None), content_check=main_text
+            ) as fetcher:
+                urls = read_targets(base + "sitemap.xml", fetcher.session)
+                runs = [("one at a time", 1, 1), ("async", concurrency, per_host)]
+                for label, c, h in runs:
+                    for name in os.listdir(out):
+                        if name.endswith(".md"):
+                            os.remove(name)
+                    print(f"--- {label}: concurrency {c}, per host {h}")
+                    crawl(urls, out, c, h, fetcher=fetcher)
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl pages to Markdown.")
+    parser.add_argument("source", nargs="?", help="URL list or sitemap, path or URL.")
+    parser.add_argument("--out", default=".", help="Directory for the Markdown files.")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=PER_HOST)
+    parser.add_argument("--browsers", type=int, default=POOL_SIZE)
+    parser.add_argument("--bench", type=int, nargs="?", const=100, metavar="N")
+    parser.add_argument(
+        "--delay", type=float, default=0.1, help="Fixture server latency (--bench)."
+    )
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench, args.concurrency, args.per_host, args.delay)
+    elif args.source:
+        with new_session() as session:
+            urls = read_targets(args.source, session)
+        os.makedirs(args.out, exist_ok=True)
+        os.chdir(args.out)  # images/ goes next to the Markdown
+        crawl(urls, ".", args.concurrency, args.per_host, args.browsers)
+    else:
+        parser.error("give a URL list or sitemap, or --bench")
+
+
+if __name__ == "__main__":
+    main()
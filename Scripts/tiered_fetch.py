@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+HTTP first, headless browser only when a page needs it.
+
+Most documentation pages arrive fully rendered from a plain GET in ~100 ms;
+a browser takes seconds. TieredFetcher tries a pooled requests.Session
+first and escalates to browser_pool when the response looks JS-rendered:
+little visible text, an empty single-page-app root, a "please enable
+JavaScript" notice, or (with content_check) an empty main-content pick;
+fetch_html() checks page_extract's pick. The browser tier is
+remembered per domain in TIER_CACHE only when the rendered page passes the
+checks the HTTP one failed, so later runs go straight to the browser for
+sites that need one and re-try HTTP for them after TIER_TTL. A timeout,
+connection error, 5xx or a page that is just short also falls back to the
+browser, but is not remembered: one flaky response or stub page shouldn't
+pin a domain to the slow tier.
+
+    ./tiered_fetch.py URL [URL ...]   # fetch, print the tier and timing
+    ./tiered_fetch.py --cache         # show remembered tiers
+    ./tiered_fetch.py --bench [N]     # HTTP vs browser on local fixture pages
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import etree, html
+
+from browser_pool import POOL_SIZE, BrowserPool, serve_static, write_fixture_pages
+
+TIER_CACHE = Path(
+    os.environ.get("SCRAPER_TIER_CACHE", "~/.cache/scraper_tiers.json")
+).expanduser()
+TIER_TTL = 7 * 86400  # re-try plain HTTP for browser-tier domains after this
+HTTP_TIMEOUT = 10
+HTTP_POOL_SIZE = 16  # keep-alive connections per host
+MIN_TEXT = 250  # visible characters below which a page is taken as a shell
+MIN_TEXT_DENSITY = 0.01  # visible text / HTML size, inline scripts excluded
+SPA_ROOTS = ("root", "app", "__next", "__nuxt", "___gatsby", "svelte")
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+)
+META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+INVISIBLE = ("script", "style", "noscript", "template")
+
+
+def new_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def decode(response: requests.Response) -> str:
+    """
+    Body as text. requests assumes ISO-8859-1 for text/html without a
+    charset header, so fall back to the page's own <meta charset>, then UTF-8.
+    """
+    if "charset" in response.headers.get("Content-Type", "").lower():
+        encoding = response.encoding
+    else:
+        match = META_CHARSET.search(response.content[:4096])
+        encoding = match.group(1).decode() if match else "utf-8"
+    try:
+        return response.content.decode(encoding, errors="replace")
+    except LookupError:
+        return response.content.decode("utf-8", errors="replace")
+
+
+def needs_browser(
+    html_content: str,
+    content_check: Optional[Callable] = None,
+    wait_for=None,
+    url: str = "",
+):
+    """
+    Reason string if the page looks rendered client-side, else None.
+    content_check(tree, url) may return the page's main text (None for no
+    opinion); too little of it also counts, as does no match for the
+    wait_for XPath (string or etree.XPath) a site rule expects once the
+    page is rendered.
+    """
+    try:
+        tree = html.fromstring(html_content)
+    except (etree.ParserError, ValueError):
+        return "unparseable"
+    if wait_for is not None:
+        if isinstance(wait_for, str):
+            wait_for = etree.XPath(wait_for)
+        if not wait_for(tree):
+            return f"no match for {wait_for.path}"
+    notices = " ".join(n.text_content() for n in tree.iter("noscript")).lower()
+    # Inline scripts (hydration state, bundles) are not markup the text sits in.
+    markup = len(html_content) - sum(
+        len(el.text or "") for el in tree.iter("script", "style")
+    )
+    etree.strip_elements(tree, *INVISIBLE, with_tail=False)
+    body = tree.find("body")
+    text = " ".join((body if body is not None else tree).text_content().split())
+    if len(text) < MIN_TEXT:
+        if "javascript" in notices:
+            return "noscript notice"
+        return f"{len(text)} visible characters"
+    density = len(text) / max(markup, 1)
+    if density < MIN_TEXT_DENSITY:
+        return f"text density {density:.3f}"
+    for root_id in SPA_ROOTS:
+        for el in tree.xpath("//*[@id=$id]", id=root_id):
+            if len(el.text_content().strip()) < MIN_TEXT:
+                return f"empty #{root_id}"
+    if content_check is not None:
+        main_text = content_check(tree, url)
+        if main_text is not None and len(main_text.strip()) < MIN_TEXT:
+            return "no main content"
+    return None
+
+
+class TierCache:
+    """domain -> {"tier": "http" | "browser", "checked": epoch}, kept as JSON."""
+
+    def __init__(self, path: Optional[Path] = TIER_CACHE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tiers: Dict[str, dict] = {}
+        if path is not None and path.exists():
+            try:
+                with open(path) as f:
+                    self.tiers = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: ignoring tier cache {path}: {e}", file=sys.stderr)
+
+    def get(self, domain: str) -> Optional[str]:
+        with self.lock:
+            entry = self.tiers.get(domain)
+        if entry is None:
+            return None
+        if entry["tier"] == "browser" and time.time() - entry["checked"] > TIER_TTL:
+            return None
+        return entry["tier"]
+
+    def set(self, domain: str, tier: str):
+        with self.lock:
+            if self.tiers.get(domain, {}).get("tier") == tier:
+                self.tiers[domain]["checked"] = time.time()
+                return
+            self.tiers[domain] = {"tier": tier, "checked": time.time()}
+            if self.path is None:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_name(self.path.name + ".tmp")
+                with open(tmp, "w") as f:
+                    json.dump(self.tiers, f, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Warning: cannot save tier cache: {e}", file=sys.stderr)
+
+
+class TieredFetcher:
+    """
+    fetch(url) returns rendered HTML from the cheapest tier that works. The
+    browser pool is only started the first time a page needs it.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[BrowserPool] = None,
+        browsers: int = POOL_SIZE,
+        cache: Optional[TierCache] = None,
+        content_check: Optional[Callable] = None,
+    ):
+        self.session = new_session()
+        self.pool = pool
+        self.own_pool = pool is None
+        self.browsers = browsers
+        self.cache = cache if cache is not None else TierCache()
+        self.content_check = content_check
+        self.lock = threading.Lock()
+        self.stats = {"http": 0, "browser": 0, "escalated": 0}
+        self.last_tier = threading.local()
+
+    def _browser(self) -> BrowserPool:
+        with self.lock:
+            if self.pool is None:
+                self.pool = BrowserPool(self.browsers)
+            return self.pool
+
+    def fetch_http(self, url: str) -> str:
+        response = self.session.get(url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return decode(response)
+
+    def fetch(self, url: str, wait_for=None) -> str:
+        domain = urlparse(url).netloc.lower()
+        tier = self.cache.get(domain)
+        remember = True
+        if tier != "browser":
+            try:
+                html_content = self.fetch_http(url)
+                reason = needs_browser(
+                    html_content, self.content_check, wait_for, url
+                )
+            except (
+                requests.exceptions.InvalidURL,
+                requests.exceptions.InvalidSchema,
+                requests.exceptions.MissingSchema,
+            ):
+                raise  # not a page any tier can load
+            except requests.HTTPError as e:
+                if e.response.status_code in (404, 410):
+                    raise  # a browser would get the same answer
+                # 403s from bot filters and the like: the browser may get through
+                reason = str(e)
+                remember = e.response.status_code < 500  # 5xx may be gone next time
+            except requests.RequestException as e:
+                reason = str(e)
+                remember = False  # says nothing about how the site renders
+            if reason is None:
+                self.cache.set(domain, "http")
+                self._count("http")
+                return html_content
+            print(f"Escalating {url} to the browser ({reason})")
+            self._count("escalated")
+        html_content = self._browser().fetch(url, wait_for)
+        if tier == "browser" or (
+            remember
+            and needs_browser(html_content, self.content_check, wait_for, url) is None
+        ):
+            self.cache.set(domain, "browser")
+        self._count("browser")
+        return html_content
+
+    def _count(self, tier: str):
+        with self.lock:
+            self.stats[tier] += 1
+        self.last_tier.value = tier
+
+    def close(self):
+        self.session.close()
+        if self.own_pool and self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_fetcher: Optional[TieredFetcher] = None
+
+
+def fetch_html(url: str, wait_for=None) -> str:
+    """
+    TieredFetcher.fetch() on a process-wide fetcher, closed at exit, that
+    also escalates pages whose main-content pick is empty.
+    """
+    global _default_fetcher
+    if _default_fetcher is None:
+        import atexit
+        from page_extract import main_text
+
+        _default_fetcher = TieredFetcher(content_check=main_text)
+        atexit.register(_default_fetcher.close)
+    return _default_fetcher.fetch(url, wait_for)
+
+
+def write_static_pages(root: str, count: int):
+    """Server-rendered counterparts of browser_pool's fixture pages."""
+    paragraph = "Configure the interface, then commit the change. " * 30
+    body = "".join(f"<h2>Step {j}</h2><p>{paragraph}</p>" for j in range(8))
+    names = []
+    for i in range(count):
+        name = f"static-{i}.html"
+        with open(os.path.join(root, name), "w") as f:
+            f.write(
+                f"<!doctype html><html><head><title>Static {i}</title></head>"
+                f"<body><nav><a href='/'>Home</a></nav>"
+                f"<article>{body}</article></body></html>"
+            )
+        names.append(name)
+    return names
+
+
+def run_benchmark(count: int):
+    with tempfile.TemporaryDirectory() as root:
+        static = write_static_pages(root, count)
+        dynamic = write_fixture_pages(root, count)
+        server, base = serve_static(root)
+        try:
+            fetcher = TieredFetcher(cache=TierCache(None))
+            for label, names in [("static", static), ("JS-rendered", dynamic)]:
+                start = time.perf_counter()
+                verdicts = [needs_browser(fetcher.fetch_http(base + n)) for n in names]
+                secs = (time.perf_counter() - start) / count
+                escalate = sum(v is not None for v in verdicts)
+                print(
+                    f"{label:12} HTTP {1000 * secs:6.1f} ms/page, "
+                    f"{escalate}/{count} escalated ({verdicts[0] or 'kept'})"
+                )
+            try:
+                with BrowserPool(1) as pool:
+                    pool.fetch(base + static[0])  # warm up
+                    start = time.perf_counter()
+                    for n in static:
+                        pool.fetch(base + n)
+                secs = (time.perf_counter() - start) / count
+                print(f"{'static':12} browser {1000 * secs:6.1f} ms/page")
+            except Exception as e:
+                print(f"browser tier unavailable: {e.__class__.__name__}")
+            fetcher.close()
+        finally:
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch pages over HTTP or a browser.")
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--cache", action="store_true", help="Show remembered tiers.")
+    parser.add_argument("--bench", type=int, nargs="?", const=20, metavar="N")
+    args = parser.parse_args()
+
+    if args.cache:
+        for domain, entry in sorted(TierCache().tiers.items()):
+            checked = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["checked"]))
+            print(f"{entry['tier']:8} {checked}  {domain}")
+    elif args.bench:
+        run_benchmark(args.bench)
+    elif args.urls:
+        with TieredFetcher() as fetcher:
+            for url in args.urls:
+                start = time.perf_counter()
+                html_content = fetcher.fetch(url)
+                print(
+                    f"{fetcher.last_tier.value:8} {time.perf_counter() - start:6.2f}s "
+                    f"{len(html_content):>8} {url}"
+                )
+    else:
+        parser.error("give URLs, --cache or --bench")
+
+
+if __name__ == "__main__":
+    main()